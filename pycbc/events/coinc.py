@@ -25,7 +25,7 @@
 coincident triggers.
 """
 
-import numpy, logging, pycbc.pnutils, copy, lal
+import numpy, logging, pycbc.pnutils, copy, lal, itertools
 from pycbc.detector import Detector
 
 
@@ -550,26 +550,47 @@ def cluster_over_time(stat, time, window, argmax=numpy.argmax):
 
 
 class MultiRingBuffer(object):
-    """Dynamic size n-dimensional ring buffer that can expire elements."""
+    """Dynamic size n-dimensional ring buffer that can expire elements.
+
+    The rings are segments of one shared pool of elements, with an offset,
+    capacity, and start and end count for each ring, so adding, expiring and
+    discarding elements are array operations over all the rings involved.
+    A ring only takes space in the pool once it holds elements. A ring that
+    overflows is moved to a larger segment at the end of the pool, and once
+    the pool holds much more than the elements in it, it is compacted and
+    rings that have emptied give back their space.
+    """
 
-    def __init__(self, num_rings, max_time, dtype):
+    def __init__(self, num_rings, max_time, dtype, min_buffer_size=16,
+                 buffer_increment=8):
         """
         Parameters
         ----------
         num_rings: int
-            The number of ring buffers to create. They all will have the same
-            intrinsic size and will expire at the same time.
+            The number of ring buffers to create. They all will expire at the
+            same time.
         max_time: int
             The maximum "time" an element can exist in each ring.
         dtype: numpy.dtype
             The type of each element in the ring buffer.
+        min_buffer_size: int, optional
+            The number of elements a ring can hold when it is first used.
+        buffer_increment: int, optional
+            The minimum number of elements to add to a ring when it is full.
         """
         self.max_time = max_time
-        self.buffer = []
-        self.buffer_expire = []
-        for _ in range(num_rings):
-            self.buffer.append(numpy.zeros(0, dtype=dtype))
-            self.buffer_expire.append(numpy.zeros(0, dtype=int))
+        self.min_buffer_size = min_buffer_size
+        self.buffer_increment = buffer_increment
+        self.buffer = numpy.zeros(0, dtype=dtype)
+        self.buffer_expire = numpy.zeros(0, dtype=int)
+        # Where each ring is in the pool, and how many elements it can hold
+        self.offsets = numpy.zeros(num_rings, dtype=numpy.int64)
+        self.capacity = numpy.zeros(num_rings, dtype=numpy.int64)
+        # Number of elements ever added to, and removed from, each ring
+        self.starts = numpy.zeros(num_rings, dtype=numpy.int64)
+        self.ends = numpy.zeros(num_rings, dtype=numpy.int64)
+        # The end of the segments handed out from the pool
+        self.used = 0
         self.time = 0
 
     @property
@@ -577,51 +598,168 @@ class MultiRingBuffer(object):
         return min(self.time, self.max_time)
 
     def num_elements(self):
-        return sum([len(a) for a in self.buffer])
+        return int((self.ends - self.starts).sum())
 
     @property
     def nbytes(self):
-        return sum([a.nbytes for a in self.buffer])
+        return self.buffer.nbytes + self.buffer_expire.nbytes
+
+    def _expire(self, rings):
+        """Remove the expired elements at the start of the given rings"""
+        expired = self.time - self.max_time
+        rings = numpy.arange(len(self.starts)) if rings is None \
+            else numpy.unique(rings)
+        # Elements are added in time order, so only the oldest element of
+        # each ring needs checking, until none of them has expired
+        while len(rings):
+            starts = self.starts[rings]
+            old = starts < self.ends[rings]
+            rold = rings[old]
+            old[old] = self.buffer_expire[self.offsets[rold] +
+                                          starts[old] % self.capacity[rold]] \
+                < expired
+            rings = rings[old]
+            self.starts[rings] += 1
+
+    def _element_positions(self, rings):
+        """Return the positions in the pool of the elements of the rings, one
+        ring after the other, and the number of elements of each ring
+        """
+        lens = self.ends[rings] - self.starts[rings]
+        first = numpy.zeros(len(rings), dtype=numpy.int64)
+        numpy.cumsum(lens[:-1], out=first[1:])
+        count = numpy.arange(lens.sum()) + \
+            numpy.repeat(self.starts[rings] - first, lens)
+        pos = numpy.repeat(self.offsets[rings], lens) + \
+            count % numpy.repeat(numpy.maximum(self.capacity[rings], 1), lens)
+        return pos, lens
+
+    def _move(self, rings, capacity, buffer, buffer_expire, start):
+        """Move the elements of the rings to new segments of the given
+        capacities, starting at position start of the new pool arrays
+        """
+        pos, lens = self._element_positions(rings)
+        offsets = numpy.zeros(len(rings), dtype=numpy.int64)
+        numpy.cumsum(capacity[:-1], out=offsets[1:])
+        offsets += start
+        dest = numpy.arange(len(pos)) + \
+            numpy.repeat(offsets - numpy.cumsum(lens) + lens, lens)
+        buffer[dest] = self.buffer[pos]
+        buffer_expire[dest] = self.buffer_expire[pos]
+        self.offsets[rings] = offsets
+        self.capacity[rings] = capacity
+        self.ends[rings] -= self.starts[rings]
+        self.starts[rings] = 0
+
+    def _grow(self, rings, size):
+        """Move the given rings to segments holding at least size elements"""
+        capacity = self.capacity[rings]
+        capacity = numpy.maximum(size, capacity +
+                                 numpy.maximum(capacity,
+                                               self.buffer_increment))
+        capacity = numpy.maximum(capacity, self.min_buffer_size)
+        need = self.used + capacity.sum()
+        if need > len(self.buffer):
+            new = max(need, 2 * len(self.buffer))
+            for name in ('buffer', 'buffer_expire'):
+                old = getattr(self, name)
+                arr = numpy.zeros(new, dtype=old.dtype)
+                arr[:self.used] = old[:self.used]
+                setattr(self, name, arr)
+        self._move(rings, capacity, self.buffer, self.buffer_expire,
+                   self.used)
+        self.used = need
+
+    def _compact(self):
+        """Move all rings to a new pool, shrinking the rings that hold much
+        less than they can
+        """
+        rings = numpy.arange(len(self.starts))
+        lens = self.ends - self.starts
+        capacity = self.capacity.copy()
+        shrink = lens * 4 <= capacity
+        capacity[shrink] = 2 * lens[shrink]
+        size = capacity.sum()
+        buffer = numpy.zeros(size, dtype=self.buffer.dtype)
+        buffer_expire = numpy.zeros(size, dtype=self.buffer_expire.dtype)
+        self._move(rings, capacity, buffer, buffer_expire, 0)
+        self.buffer = buffer
+        self.buffer_expire = buffer_expire
+        self.used = size
 
     def discard_last(self, indices):
         """Discard the triggers added in the latest update"""
-        for i in indices:
-            self.buffer_expire[i] = self.buffer_expire[i][:-1]
-            self.buffer[i] = self.buffer[i][:-1]
+        rings, counts = numpy.unique(numpy.asarray(indices, dtype=int),
+                                     return_counts=True)
+        self.ends[rings] = numpy.maximum(self.ends[rings] - counts,
+                                         self.starts[rings])
 
     def advance_time(self):
         """Advance the internal time increment by 1, expiring any triggers that
         are now too old.
         """
         self.time += 1
+        self._expire(None)
+        if len(self.buffer) > 8 * self.num_elements() + 1024:
+            self._compact()
 
     def add(self, indices, values):
         """Add triggers in 'values' to the buffers indicated by the indices
         """
-        for i, v in zip(indices, values):
-            self.buffer[i] = numpy.append(self.buffer[i], v)
-            self.buffer_expire[i] = numpy.append(self.buffer_expire[i], self.time)
+        indices = numpy.asarray(indices, dtype=int)
+        if len(indices):
+            # Rings may get several triggers, which go in the order given
+            order = numpy.argsort(indices, kind='stable')
+            indices = indices[order]
+            rings, first, counts = numpy.unique(indices, return_index=True,
+                                                return_counts=True)
+            rank = numpy.arange(len(indices)) - numpy.repeat(first, counts)
+
+            size = self.ends[rings] - self.starts[rings] + counts
+            full = size > self.capacity[rings]
+            if full.any():
+                self._grow(rings[full], size[full])
+
+            pos = self.offsets[indices] + \
+                (self.ends[indices] + rank) % self.capacity[indices]
+            self.buffer[pos] = numpy.asarray(values)[order]
+            self.buffer_expire[pos] = self.time
+            self.ends[rings] += counts
         self.advance_time()
 
     def expire_vector(self, buffer_index):
         """Return the expiration vector of a given ring buffer """
-        return self.buffer_expire[buffer_index]
+        pos, _ = self._element_positions(numpy.array([buffer_index]))
+        return self.buffer_expire[pos]
 
     def data(self, buffer_index):
         """Return the data vector for a given ring buffer"""
-        # Check for expired elements and discard if they exist
-        expired = self.time - self.max_time
-        exp = self.buffer_expire[buffer_index]
-        j = 0
-        while j < len(exp):
-            # Everything before this j must be expired
-            if exp[j] >= expired:
-                self.buffer_expire[buffer_index] = exp[j:].copy()
-                self.buffer[buffer_index] = self.buffer[buffer_index][j:].copy()
-                break
-            j += 1
+        pos, _ = self._element_positions(numpy.array([buffer_index]))
+        return self.buffer[pos]
+
+    def data_bulk(self, indices):
+        """Return the data and expiration vectors of several ring buffers
+
+        Parameters
+        ----------
+        indices: numpy.ndarray
+            The ring buffers to read, which may repeat.
 
-        return self.buffer[buffer_index]
+        Returns
+        -------
+        data: numpy.ndarray
+            The elements of the rings, one ring after the other.
+        expire: numpy.ndarray
+            The expiration vector of the elements.
+        offsets: numpy.ndarray
+            The elements of the ring indices[i] are
+            data[offsets[i]:offsets[i + 1]].
+        """
+        indices = numpy.asarray(indices, dtype=int)
+        pos, lens = self._element_positions(indices)
+        offsets = numpy.zeros(len(indices) + 1, dtype=numpy.int64)
+        numpy.cumsum(lens, out=offsets[1:])
+        return self.buffer[pos], self.buffer_expire[pos], offsets
 
 
 class CoincExpireBuffer(object):
@@ -723,14 +861,24 @@ class CoincExpireBuffer(object):
 
 
 class LiveCoincTimeslideBackgroundEstimator(object):
-    """Rolling buffer background estimation."""
+    """Rolling buffer background estimation.
+
+    Coincidences are formed for every combination, or coinc type, of two or
+    more of the detectors, up to a maximum number. There is one buffer of
+    single detector triggers per detector, shared by all the coinc types,
+    and one buffer of background coincidences per coinc type. Time slides
+    are applied to the first detector of each coinc type; the others are
+    not shifted relative to each other, as in `time_multi_coincidence`.
+    """
 
     def __init__(self, num_templates, analysis_block, background_statistic,
                  stat_files, ifos,
                  ifar_limit=100,
                  timeslide_interval=.035,
                  coinc_threshold=.002,
-                 return_background=False):
+                 return_background=False,
+                 max_coinc_ifos=2,
+                 coinc_types=None):
         """
         Parameters
         ----------
@@ -744,8 +892,7 @@ class LiveCoincTimeslideBackgroundEstimator(object):
             List of filenames that contain information used to construct
             various coincident statistics.
         ifos: list of strs
-            List of ifo names that are being analyzed. At the moment this must
-            be two items such as ['H1', 'L1'].
+            List of ifo names that are being analyzed, at least two.
         ifar_limit: float
             The largest inverse false alarm rate in years that we would like to
             calculate.
@@ -757,30 +904,72 @@ class LiveCoincTimeslideBackgroundEstimator(object):
         return_background: boolean
             If true, background triggers will also be included in the file
             output.
+        max_coinc_ifos: int
+            The largest number of detectors in a coincidence. Coincidences of
+            more than two detectors need a statistic that implements
+            coinc_multiifo.
+        coinc_types: list of tuples of strs, optional
+            The combinations of detectors to form coincidences of, e.g. to
+            share the work of a network between several estimators. If not
+            given, every combination of two to max_coinc_ifos detectors.
         """
         from . import stat
         self.num_templates = num_templates
         self.analysis_block = analysis_block
 
+        self.ifos = list(ifos)
+        if len(self.ifos) < 2:
+            raise ValueError("At least two ifos are needed for coincidences")
+
         stat_class = stat.get_statistic(background_statistic)
-        self.stat_calculator = stat_class(stat_files, ifos)
+        self.stat_calculator = stat_class(stat_files, self.ifos)
 
         self.timeslide_interval = timeslide_interval
+        self.coinc_threshold = coinc_threshold
         self.return_background = return_background
 
-        self.ifos = ifos
-        if len(self.ifos) != 2:
-            raise ValueError("Only a two ifo analysis is supported at this time")
-
         self.lookback_time = (ifar_limit * lal.YRJUL_SI * timeslide_interval) ** 0.5
         self.buffer_size = int(numpy.ceil(self.lookback_time / analysis_block))
 
-        det0, det1 = Detector(ifos[0]), Detector(ifos[1])
-        self.time_window = det0.light_travel_time_to_detector(det1) + coinc_threshold
-        self.coincs = CoincExpireBuffer(self.buffer_size, self.ifos)
+        if coinc_types is None:
+            coinc_types = self.all_coinc_types(self.ifos, max_coinc_ifos)
+        self.coinc_types = [tuple(ctype) for ctype in coinc_types]
+        for ctype in self.coinc_types:
+            if len(ctype) < 2 or not set(ctype) <= set(self.ifos):
+                raise ValueError("Coinc type %s is not a combination of two "
+                                 "or more of the ifos" % '-'.join(ctype))
+
+        # The coincident statistic may depend on the detectors taking part,
+        # but the tables read from the statistic files are shared
+        self.coinc_stats = {}
+        for ctype in self.coinc_types:
+            if len(ctype) == len(self.ifos):
+                self.coinc_stats[ctype] = self.stat_calculator
+            else:
+                self.coinc_stats[ctype] = \
+                    self.stat_calculator.for_ifos(ctype)
+
+        self.time_window = {}
+        for ifo0, ifo1 in itertools.combinations(self.ifos, 2):
+            det0, det1 = Detector(ifo0), Detector(ifo1)
+            window = det0.light_travel_time_to_detector(det1) + coinc_threshold
+            self.time_window[ifo0, ifo1] = self.time_window[ifo1, ifo0] = window
+
+        self.coincs = {ctype: CoincExpireBuffer(self.buffer_size, list(ctype))
+                       for ctype in self.coinc_types}
 
         self.singles = {}
 
+    @staticmethod
+    def all_coinc_types(ifos, max_coinc_ifos=2):
+        """Return every combination of two to max_coinc_ifos of the
+        detectors, in the order of the detectors given.
+        """
+        coinc_types = []
+        for num in range(2, min(max_coinc_ifos, len(ifos)) + 1):
+            coinc_types += list(itertools.combinations(ifos, num))
+        return coinc_types
+
     @classmethod
     def pick_best_coinc(cls, coinc_results):
         """Choose the best two-ifo coinc by ifar first, then statistic if needed.
@@ -837,13 +1026,16 @@ class LiveCoincTimeslideBackgroundEstimator(object):
             return coinc_results[0]
 
     @classmethod
-    def from_cli(cls, args, num_templates, analysis_chunk, ifos):
+    def from_cli(cls, args, num_templates, analysis_chunk, ifos,
+                 coinc_types=None):
         return cls(num_templates, analysis_chunk,
                    args.background_statistic,
                    args.background_statistic_files,
                    return_background=args.store_background,
                    ifar_limit=args.background_ifar_limit,
                    timeslide_interval=args.timeslide_interval,
+                   max_coinc_ifos=args.max_coinc_ifos,
+                   coinc_types=coinc_types,
                    ifos=ifos)
 
     @staticmethod
@@ -866,14 +1058,29 @@ class LiveCoincTimeslideBackgroundEstimator(object):
             help="The interval between timeslides in seconds", default=0.1)
         group.add_argument('--ifar-remove-threshold', type=float,
             help="NOT YET IMPLEMENTED", default=100.0)
+        group.add_argument('--max-coinc-ifos', type=int, default=2,
+            help="The largest number of detectors to form coincidences "
+                 "between. Above two, the statistic must support "
+                 "multi-detector coincidences.")
+
+    def coinc_type_background_time(self, ctype):
+        """Return the amount of background time that the buffers contain for
+        a coinc type. Only its first detector is time shifted, so the time
+        is limited by the least filled buffer of the others.
+        """
+        if ctype[0] not in self.singles:
+            return 0.
+        time = 1.0 / self.timeslide_interval
+        time *= self.singles[ctype[0]].filled_time * self.analysis_block
+        time *= min(self.singles[ifo].filled_time for ifo in ctype[1:]) \
+            * self.analysis_block
+        return time
 
     @property
     def background_time(self):
-        """Return the amount of background time that the buffers contain"""
-        time = 1.0 / self.timeslide_interval
-        for ifo in self.singles:
-            time *= self.singles[ifo].filled_time * self.analysis_block
-        return time
+        """Return the amount of background time that the buffers contain for
+        the coincidences of all the detectors that are searched together"""
+        return self.coinc_type_background_time(self.coinc_types[-1])
 
     def save_state(self, filename):
         """Save the current state of the background buffers"""
@@ -886,11 +1093,12 @@ class LiveCoincTimeslideBackgroundEstimator(object):
         from six.moves import cPickle
         return cPickle.load(filename)
 
-    def ifar(self, coinc_stat):
+    def ifar(self, coinc_stat, ctype=None):
         """Return the far that would be associated with the coincident given.
         """
-        n = self.coincs.num_greater(coinc_stat)
-        return self.background_time / lal.YRJUL_SI / (n + 1)
+        ctype = self.coinc_types[-1] if ctype is None else ctype
+        n = self.coincs[ctype].num_greater(coinc_stat)
+        return self.coinc_type_background_time(ctype) / lal.YRJUL_SI / (n + 1)
 
     def set_singles_buffer(self, results):
         """Create the singles buffer
@@ -939,9 +1147,9 @@ class LiveCoincTimeslideBackgroundEstimator(object):
 
         Returns
         -------
-        updated_singles: dict of numpy.ndarrays
-            Array of indices that have been just updated in the internal
-            buffers of single detector triggers.
+        new_singles: dict of numpy.ndarrays
+            The triggers just added to the internal buffers of single
+            detector triggers, as they are stored there.
         """
         if len(self.singles.keys()) == 0:
             self.set_singles_buffer(results)
@@ -953,7 +1161,7 @@ class LiveCoincTimeslideBackgroundEstimator(object):
         # FIXME Currently configured to use pycbc live output
         # where chisq is the reduced chisq and chisq_dof is the actual DOF
         logging.info("adding singles to the background estimate...")
-        updated_indices = {}
+        new_singles = {}
         for ifo in ifos:
             trigs = results[ifo]
 
@@ -973,137 +1181,205 @@ class LiveCoincTimeslideBackgroundEstimator(object):
                 data[key] = value
 
             self.singles[ifo].add(trigs['template_id'], data)
-            updated_indices[ifo] = trigs['template_id']
-        return updated_indices
+            new_singles[ifo] = data
+        return new_singles
+
+    def _coinc_candidates(self, ctype, anchor, trigs, skip_new):
+        """Find the coincidences of a coinc type that include the triggers
+        just added for one of its detectors, under any time slide.
+
+        Each detector of the coinc type in turn is joined to the candidates
+        found so far: the triggers of the same template are read from its
+        buffer for all candidates at once, and kept if they are coincident
+        with every detector already joined. The time slide is fixed by the
+        first pair, which always includes the time shifted detector.
+
+        Parameters
+        ----------
+        ctype: tuple of strs
+            The detectors of the coinc type. The first is time shifted.
+        anchor: str
+            The detector whose new triggers are used.
+        trigs: numpy.ndarray
+            The new triggers of the anchor detector.
+        skip_new: list of strs
+            Detectors whose new triggers are not used, because their
+            coincidences with these triggers have already been found.
 
-    def _find_coincs(self, results, ifos):
+        Returns
+        -------
+        members: dict of numpy.ndarrays
+            The single detector triggers of each detector in the coincidences.
+        expire: dict of numpy.ndarrays
+            The buffer time at which each single detector trigger was added.
+        slide: numpy.ndarray
+            The time slide of each coincidence.
+        """
+        step = self.timeslide_interval
+        members = {anchor: trigs}
+        expire = {anchor: numpy.zeros(len(trigs), dtype=numpy.int32)
+                  + self.singles[anchor].time - 1}
+        slide = None
+        for ifo in ctype:
+            if ifo == anchor:
+                continue
+
+            data, exp, offsets = \
+                self.singles[ifo].data_bulk(members[anchor]['template_id'])
+            rows = numpy.repeat(numpy.arange(len(offsets) - 1),
+                                numpy.diff(offsets))
+            if ifo in skip_new:
+                keep = exp != self.singles[ifo].time - 1
+                data, exp, rows = data[keep], exp[keep], rows[keep]
+            for m in members:
+                members[m] = members[m][rows]
+                expire[m] = expire[m][rows]
+
+            time = data['end_time']
+            if slide is None:
+                # Only the anchor has been joined: the time of the shifted
+                # detector minus the fixed one gives the slide
+                window = self.time_window[anchor, ifo]
+                atime = members[anchor]['end_time']
+                dt = atime - time if anchor == ctype[0] else time - atime
+                slide = numpy.rint(dt / step).astype(numpy.int32)
+                keep = abs(dt - slide * step) <= window
+            else:
+                slide = slide[rows]
+                if ifo == ctype[0]:
+                    time = time - slide * step
+                keep = numpy.ones(len(rows), dtype=bool)
+                for m in members:
+                    mtime = members[m]['end_time']
+                    if m == ctype[0]:
+                        mtime = mtime - slide * step
+                    keep &= abs(mtime - time) <= self.time_window[m, ifo]
+
+            members[ifo] = data
+            expire[ifo] = exp
+            for m in members:
+                members[m] = members[m][keep]
+                expire[m] = expire[m][keep]
+            slide = slide[keep]
+        return members, expire, slide
+
+    def _cluster(self, ctype, cstat, members, slide):
+        """Cluster coincidences of one coinc type for each time slide
+        separately, across templates, as `cluster_coincs_multiifo` does for
+        coincidences of all the detectors.
+        """
+        num = len(ctype)
+        step = self.timeslide_interval
+        # Mean time with the fixed detectors moved onto the shifted one
+        time = sum(members[ifo]['end_time'] for ifo in ctype) / num
+        time += (num - 1) * slide * step / num
+
+        tslide = slide.astype(numpy.float128)
+        time = time.astype(numpy.float128)
+        span = (time.max() - time.min()) + self.analysis_block * 10
+        time = time + span * tslide
+        return cluster_over_time(cstat, time, self.analysis_block)
+
+    def _find_coincs(self, new_singles, ifos):
         """Look for coincs within the set of single triggers
 
         Parameters
         ----------
-        results: dict of arrays
-            Dictionary of dictionaries indexed by ifo and keys such as 'snr',
-            'chisq', etc. The specific format it determined by the
-            LiveBatchMatchedFilter class.
+        new_singles: dict of numpy.ndarrays
+            The triggers just added to the buffers, indexed by ifo.
+        ifos: list of strs
+            The ifos that have been analyzed in this update.
 
         Returns
         -------
+        num_background: dict of ints
+            The number of background coincidences added for each coinc type.
         coinc_results: dict of arrays
             A dictionary of arrays containing the coincident results.
         """
-        # for each single detector trigger find the allowed coincidences
-        # Record which template and the index of the single trigger
-        # that forms each coincident trigger
-        cstat = [[]]
-        offsets = []
-        ctimes = {self.ifos[0]:[], self.ifos[1]:[]}
-        single_expire = {self.ifos[0]:[], self.ifos[1]:[]}
-        template_ids = [[]]
-        trigger_ids = {self.ifos[0]:[[]], self.ifos[1]:[[]]}
-
-        # Calculate all the permutations of coincident triggers for each
-        # new single detector trigger collected
-        for ifo in ifos:
-            trigs = results[ifo]
-
-            oifo = self.ifos[1] if self.ifos[0] == ifo else self.ifos[0]
-
-            for i in range(len(trigs['end_time'])):
-                trig_stat = trigs['stat'][i]
-                trig_time = trigs['end_time'][i]
-                template = trigs['template_id'][i]
-
-                times = self.singles[oifo].data(template)['end_time']
-                stats = self.singles[oifo].data(template)['stat']
-
-                i1, _, slide = time_coincidence(times,
-                                 numpy.array(trig_time, ndmin=1,
-                                 dtype=numpy.float64),
-                                 self.time_window,
-                                 self.timeslide_interval)
-                trig_stat = numpy.resize(trig_stat, len(i1))
-                c = self.stat_calculator.coinc(stats[i1], trig_stat,
-                                               slide, self.timeslide_interval)
-                offsets.append(slide)
-                cstat.append(c)
-                ctimes[oifo].append(times[i1])
-                ctimes[ifo].append(numpy.zeros(len(c), dtype=numpy.float64))
-                ctimes[ifo][-1].fill(trig_time)
-
-                single_expire[oifo].append(self.singles[oifo].expire_vector(template)[i1])
-                single_expire[ifo].append(numpy.zeros(len(c),
-                                          dtype=numpy.int32))
-                single_expire[ifo][-1].fill(self.singles[ifo].time - 1)
-
-                # save the template and trigger ids to keep association
-                # to singles. The trigger was just added so it must be in
-                # the last position we mark this with -1 so the
-                # slicing picks the right point
-                template_ids.append(numpy.zeros(len(c)) + template)
-                trigger_ids[oifo].append(i1)
-                trigger_ids[ifo].append(numpy.zeros(len(c)) - 1)
-
-        cstat = numpy.concatenate(cstat)
-        template_ids = numpy.concatenate(template_ids).astype(numpy.int32)
-        for ifo in ifos:
-            trigger_ids[ifo] = numpy.concatenate(trigger_ids[ifo]).astype(numpy.int32)
-
-        # cluster the triggers we've found
-        # (both zerolag and non handled together)
-        num_zerolag = 0
-        num_background = 0
-
-        logging.info('%s background and zerolag coincs', len(cstat))
-        if len(cstat) > 0:
-            offsets = numpy.concatenate(offsets)
-            ctime0 = numpy.concatenate(ctimes[self.ifos[0]]).astype(numpy.float64)
-            ctime1 = numpy.concatenate(ctimes[self.ifos[1]]).astype(numpy.float64)
-
-            cidx = cluster_coincs(cstat, ctime0, ctime1, offsets,
-                                      self.timeslide_interval,
-                                      self.analysis_block)
-            offsets = offsets[cidx]
-            zerolag_idx = (offsets == 0)
-            bkg_idx = (offsets != 0)
-
-            for ifo in self.ifos:
-                single_expire[ifo] = numpy.concatenate(single_expire[ifo])
-                single_expire[ifo] = single_expire[ifo][cidx][bkg_idx]
-
-            self.coincs.add(cstat[cidx][bkg_idx], single_expire, ifos)
-            num_zerolag = zerolag_idx.sum()
-            num_background = bkg_idx.sum()
-        elif len(ifos) > 0:
-            self.coincs.increment(ifos)
+        num_background = {}
+        candidates = {}
+        for ctype in self.coinc_types:
+            anchors = [ifo for ifo in ctype if ifo in new_singles]
+            if not anchors:
+                continue
+
+            # Each coincidence is found from the first of its detectors that
+            # has new triggers, so none is counted twice
+            found = [self._coinc_candidates(ctype, anchor,
+                                            new_singles[anchor],
+                                            anchors[:i])
+                     for i, anchor in enumerate(anchors)]
+            members = {ifo: numpy.concatenate([f[0][ifo] for f in found])
+                       for ifo in ctype}
+            expire = {ifo: numpy.concatenate([f[1][ifo] for f in found])
+                      for ifo in ctype}
+            slide = numpy.concatenate([f[2] for f in found])
+
+            logging.info('%s background and zerolag %s coincs', len(slide),
+                         '-'.join(ctype))
+            if len(slide) == 0:
+                self.coincs[ctype].increment(anchors)
+                num_background[ctype] = 0
+                continue
+
+            stat = self.coinc_stats[ctype]
+            if len(ctype) == 2:
+                cstat = stat.coinc(members[ctype[0]]['stat'],
+                                   members[ctype[1]]['stat'],
+                                   slide, self.timeslide_interval)
+            else:
+                cstat = stat.coinc_multiifo(
+                    [(ifo, members[ifo]['stat']) for ifo in ctype],
+                    slide, self.timeslide_interval,
+                    [-1 if ifo == ctype[0] else 0 for ifo in ctype],
+                    time_addition=self.coinc_threshold)
+
+            # cluster the triggers we've found
+            # (both zerolag and non handled together)
+            cidx = self._cluster(ctype, cstat, members, slide)
+            bkg = cidx[slide[cidx] != 0]
+            zerolag = cidx[slide[cidx] == 0]
+
+            self.coincs[ctype].add(cstat[bkg],
+                                   {ifo: expire[ifo][bkg] for ifo in ctype},
+                                   anchors)
+            num_background[ctype] = len(bkg)
+
+            # Only consider foreground if all its detectors were analyzed
+            if len(zerolag) and all(ifo in ifos for ifo in ctype):
+                best = zerolag[cstat[zerolag].argmax()]
+                candidates[ctype] = (self.ifar(cstat[best], ctype),
+                                     cstat[best],
+                                     {ifo: members[ifo][best]
+                                      for ifo in ctype})
 
         ####################################Collect coinc results for saving
         coinc_results = {}
-        # Save information about zerolag triggers
-        if num_zerolag > 0:
-            zerolag_results = {}
-            idx = cidx[zerolag_idx][0]
-            zerolag_cstat = cstat[cidx][zerolag_idx]
-            zerolag_results['foreground/ifar'] = self.ifar(zerolag_cstat)
-            zerolag_results['foreground/stat'] = zerolag_cstat
-            template = template_ids[idx]
-            for ifo in self.ifos:
-                trig_id = trigger_ids[ifo][idx]
-                single_data = self.singles[ifo].data(template)[trig_id]
-                for key in single_data.dtype.names:
+        report_type = self.coinc_types[0]
+        if candidates:
+            # Choose the best coinc type by ifar, then statistic, with a
+            # trials factor for the types that were possible
+            trials = sum(all(ifo in ifos for ifo in ctype)
+                         for ctype in self.coinc_types)
+            report_type = max(candidates, key=lambda c: candidates[c][:2])
+            ifar, cstat, singles = candidates[report_type]
+            coinc_results['foreground/ifar'] = ifar / trials
+            coinc_results['foreground/stat'] = cstat
+            for ifo in report_type:
+                for key in singles[ifo].dtype.names:
                     path = 'foreground/%s/%s' % (ifo, key)
-                    zerolag_results[path] = single_data[key]
-
-            zerolag_results['foreground/type'] = '-'.join(self.ifos)
-
-            coinc_results.update(zerolag_results)
+                    coinc_results[path] = singles[ifo][key]
+            coinc_results['foreground/type'] = '-'.join(report_type)
 
         # Save some summary statistics about the background
-        coinc_results['background/time'] = numpy.array([self.background_time])
-        coinc_results['background/count'] = len(self.coincs.data)
+        coinc_results['background/time'] = \
+            numpy.array([self.coinc_type_background_time(report_type)])
+        coinc_results['background/count'] = len(self.coincs[report_type].data)
 
         # Save all the background triggers
         if self.return_background:
-            coinc_results['background/stat'] = self.coincs.data
+            coinc_results['background/stat'] = self.coincs[report_type].data
         return num_background, coinc_results
 
     def backout_last(self, updated_singles, num_coincs):
@@ -1114,13 +1390,14 @@ class LiveCoincTimeslideBackgroundEstimator(object):
         updated_singles: dict of numpy.ndarrays
             Array of indices that have been just updated in the internal
             buffers of single detector triggers.
-        num_coincs: int
+        num_coincs: dict of ints
             The number of coincs that were just added to the internal buffer
-            of coincident triggers
+            of coincident triggers of each coinc type
         """
         for ifo in updated_singles:
             self.singles[ifo].discard_last(updated_singles[ifo])
-        self.coincs.remove(num_coincs)
+        for ctype in num_coincs:
+            self.coincs[ctype].remove(num_coincs[ctype])
 
     def add_singles(self, results):
         """Add singles to the background estimate and find candidates
@@ -1135,24 +1412,30 @@ class LiveCoincTimeslideBackgroundEstimator(object):
         Returns
         -------
         coinc_results: dict of arrays
-            A dictionary of arrays containing the coincident results.
+            A dictionary of arrays containing the coincident results. The
+            ifar of a foreground coinc includes the trials factor for the
+            coinc types that were possible.
         """
         # Let's see how large everything is
-        logging.info('BKG Coincs %s stored %s bytes',
-                     len(self.coincs), self.coincs.nbytes)
+        for ctype in self.coinc_types:
+            logging.info('BKG %s Coincs %s stored %s bytes', '-'.join(ctype),
+                         len(self.coincs[ctype]), self.coincs[ctype].nbytes)
 
         # If there are no results just return
         valid_ifos = [k for k in results.keys() if results[k] and k in self.ifos]
         if len(valid_ifos) == 0: return {}
 
         # Add single triggers to the internal buffer
-        self._add_singles_to_buffer(results, ifos=valid_ifos)
+        new_singles = self._add_singles_to_buffer(results, ifos=valid_ifos)
+        if not new_singles:
+            return {}
 
         # Calculate zerolag and background coincidences
-        _, coinc_results = self._find_coincs(results, ifos=valid_ifos)
+        _, coinc_results = self._find_coincs(new_singles, ifos=valid_ifos)
 
         # record if a coinc is possible in this chunk
-        if len(valid_ifos) == 2:
+        if any(all(ifo in valid_ifos for ifo in ctype)
+               for ctype in self.coinc_types):
             coinc_results['coinc_possible'] = True
 
         return coinc_results
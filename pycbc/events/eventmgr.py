@@ -27,14 +27,17 @@ produces event triggers
 from __future__ import absolute_import
 import numpy, copy, os.path
 import logging
+import weakref
 import h5py
 from six.moves import cPickle
 
 from pycbc.types import Array
 from pycbc.scheme import schemed
+from pycbc.profiling import timers
 from pycbc.detector import Detector
 
 from . import coinc, ranking
+from .trigger_store import TriggerStore
 
 from .eventmgr_cython import findchirp_cluster_over_window_cython
 
@@ -176,6 +179,38 @@ def cluster_reduce(idx, snr, window_size):
     return idx.take(ind), snr.take(ind)
 
 
+class _EventColumns(object):
+    """ Read each column of a set of events only once """
+    def __init__(self, events):
+        self.events = events
+        self.cache = {}
+
+    def __getitem__(self, name):
+        if name not in self.cache:
+            self.cache[name] = self.events[name]
+        return self.cache[name]
+
+
+class _StatColumns(object):
+    """ Present a subset of the events in the form expected by the
+    single detector statistics.
+    """
+    def __init__(self, columns, idx):
+        self.columns = columns
+        self.idx = idx
+
+    def __getitem__(self, name):
+        col = self.columns[name][self.idx]
+        # Here the events hold the complex SNR
+        if name == 'snr':
+            col = abs(col)
+        # Messy step because pycbc inspiral's internal 'chisq_dof' is 2p-2
+        # but stat.py / ranking.py functions use 'chisq_dof' = p
+        elif name == 'chisq_dof':
+            col = col / 2 + 1
+        return col
+
+
 class EventManager(object):
     def __init__(self, opt, column, column_types, **kwds):
         self.opt = opt
@@ -185,22 +220,101 @@ class EventManager(object):
         for col, coltype in zip(column, column_types):
             self.event_dtype.append((col, coltype))
 
-        self.events = numpy.array([], dtype=self.event_dtype)
-        self.accumulate = [self.events]
+        self.events = self.new_event_store()
         self.template_params = []
         self.template_index = -1
         self.template_events = numpy.array([], dtype=self.event_dtype)
         self.write_performance = False
+        self._checkpoint = None
+
+    def new_event_store(self):
+        """ Return an empty store for the triggers. Triggers are kept column
+        by column, and moved to a temporary file next to the output once there
+        are more than the given number.
+        """
+        spill_size = getattr(self.opt, 'trigger_spill_size', None)
+        spill_dir = None
+        if spill_size is not None:
+            spill_dir = os.path.dirname(os.path.abspath(self.opt.output))
+        return TriggerStore(self.event_dtype, spill_size=spill_size,
+                            spill_dir=spill_dir)
 
     def save_state(self, tnum_finished, filename):
-        """Save the current state of the background buffers"""
+        """Save the current state of the event manager to a checkpoint file.
+
+        The manager itself is stored when the file is written from scratch.
+        After that, each checkpoint only appends the triggers and templates
+        added since the previous one, and then records how many of each are
+        valid, so that a job stopped while writing restores from the last full
+        checkpoint. If the triggers have been consolidated in between, the
+        whole file is written again to a temporary file, which replaces the
+        old one once complete, so the space of the old triggers is freed.
+        """
         from pycbc.io.hdf import dump_state
 
         self.tnum_finished = tnum_finished
         logging.info('Writing checkpoint file at template %s', tnum_finished)
-        fp = h5py.File(filename, 'w')
-        dump_state(self, fp, protocol=cPickle.HIGHEST_PROTOCOL)
-        fp.close()
+
+        ckpt = getattr(self, '_checkpoint', None)
+        rewrite = ckpt is None or ckpt['filename'] != filename or \
+            ckpt['events'] is None or ckpt['events']() is not self.events
+        if rewrite:
+            ckpt = self._checkpoint = {'filename': filename,
+                                       'group': 'events',
+                                       'events': None,
+                                       'num_events': 0,
+                                       'num_templates': 0}
+            path = '%s.tmp%s' % (filename, os.getpid())
+        else:
+            path = filename
+
+        with h5py.File(path, 'w' if rewrite else 'a') as fp:
+            group = ckpt['group']
+            if rewrite:
+                skip = ('events', 'template_params', 'template_events',
+                        '_checkpoint')
+                state = {k: v for k, v in self.__dict__.items()
+                         if k not in skip}
+                dump_state((self.__class__, state), fp,
+                           protocol=cPickle.HIGHEST_PROTOCOL)
+                fp.create_dataset('template_params', (0,),
+                     dtype=h5py.special_dtype(vlen=numpy.dtype('uint8')),
+                     maxshape=(None,), chunks=True)
+                for name in self.events.names:
+                    fp.create_dataset('%s/%s' % (group, name), (0,),
+                                      dtype=self.events.dtype[name],
+                                      maxshape=(None,), chunks=True)
+
+            num_events = ckpt['num_events']
+            for chunk in self.events.iter_chunks(start=num_events):
+                end = num_events + len(chunk[self.events.names[0]])
+                for name in self.events.names:
+                    dset = fp['%s/%s' % (group, name)]
+                    dset.resize((end,))
+                    dset[num_events:end] = chunk[name]
+                num_events = end
+
+            dset = fp['template_params']
+            num_templates = len(self.template_params)
+            dset.resize((num_templates,))
+            for i in range(ckpt['num_templates'], num_templates):
+                params = cPickle.dumps(self.template_params[i],
+                                       protocol=cPickle.HIGHEST_PROTOCOL)
+                dset[i] = numpy.frombuffer(params, dtype=numpy.uint8)
+
+            fp.attrs['events_group'] = group
+            fp.attrs['num_events'] = num_events
+            fp.attrs['num_templates'] = num_templates
+            fp.attrs['tnum_finished'] = tnum_finished
+
+        if rewrite:
+            os.rename(path, filename)
+
+        # Only a weak reference is kept, so that triggers replaced by a
+        # consolidation are freed along with their spill file
+        ckpt.update({'group': group, 'events': weakref.ref(self.events),
+                     'num_events': num_events,
+                     'num_templates': num_templates})
 
     @staticmethod
     def restore_state(filename):
@@ -209,7 +323,46 @@ class EventManager(object):
 
         fp = h5py.File(filename, 'r')
         try:
-            mgr = load_state(fp)
+            if 'num_templates' not in fp.attrs:
+                # Checkpoint holding the whole pickled manager, from before
+                # the triggers were kept in a TriggerStore
+                mgr = load_state(fp)
+                if hasattr(mgr, 'accumulate'):
+                    events = numpy.concatenate(mgr.accumulate)
+                    mgr.events = mgr.new_event_store()
+                    mgr.events.append(events)
+                    del mgr.accumulate
+                mgr._checkpoint = None
+            else:
+                cls, state = load_state(fp)
+                mgr = cls.__new__(cls)
+                mgr.__dict__.update(state)
+
+                group = fp.attrs['events_group']
+                if isinstance(group, bytes):
+                    group = group.decode()
+                num_events = int(fp.attrs['num_events'])
+                num_templates = int(fp.attrs['num_templates'])
+                mgr.tnum_finished = int(fp.attrs['tnum_finished'])
+
+                mgr.events = mgr.new_event_store()
+                step = mgr.events.spill_size or max(num_events, 1)
+                for start in range(0, num_events, step):
+                    end = min(start + step, num_events)
+                    mgr.events.append({name: fp['%s/%s' % (group, name)]
+                                                        [start:end]
+                                       for name in mgr.events.names})
+
+                dset = fp['template_params']
+                mgr.template_params = [cPickle.loads(dset[i].tobytes())
+                                       for i in range(num_templates)]
+                mgr.template_index = num_templates - 1
+                mgr.template_events = numpy.array([],
+                                                  dtype=mgr.event_dtype)
+                mgr._checkpoint = {'filename': filename, 'group': group,
+                                   'events': weakref.ref(mgr.events),
+                                   'num_events': num_events,
+                                   'num_templates': num_templates}
         except Exception as e:
             fp.close()
             raise e
@@ -232,84 +385,136 @@ class EventManager(object):
                 setattr(opt, arg, getattr(opt, arg)[ifo])
         return cls(opt, column, column_types, **kwds)
 
-    def chisq_threshold(self, value, num_bins, delta=0):
-        remove = []
-        for i, event in enumerate(self.events):
-            xi = event['chisq'] / (event['chisq_dof'] +
-                                   delta * event['snr'].conj() * event['snr'])
-            if xi > value:
-                remove.append(i)
-        self.events = numpy.delete(self.events, remove)
+    def apply_cuts(self, cuts):
+        """ Apply a sequence of cuts to the events in a single pass.
 
-    def newsnr_threshold(self, threshold):
-        """ Remove events with newsnr smaller than given threshold
+        Each cut is a callable taking the event columns and the boolean mask
+        of the events kept so far, and returning the mask of the events to
+        keep. The columns are read once and shared between the cuts, and the
+        events are only selected once, after the last cut. Cuts that depend
+        on the other events, such as keeping the loudest in an interval, only
+        see the events kept by the cuts before them.
+
+        Parameters
+        ----------
+        cuts : list of callables
+            The cuts to apply, in order. See the `*_cut` methods.
         """
+        if len(self.events) == 0 or not cuts:
+            return
+
+        columns = _EventColumns(self.events)
+        keep = numpy.ones(len(self.events), dtype=bool)
+        for cut in cuts:
+            keep = cut(columns, keep)
+        if not keep.all():
+            self.events = self.events[keep]
+
+    def chisq_cut(self, value, delta=0):
+        """ Return a cut removing events with reduced chisq above value """
+        def cut(columns, keep):
+            snr = columns['snr']
+            xi = columns['chisq'] / (columns['chisq_dof'] +
+                                     delta * (snr.conj() * snr).real)
+            return keep & ~(xi > value)
+        return cut
+
+    def newsnr_cut(self, threshold):
+        """ Return a cut removing events with newsnr below threshold """
         if not self.opt.chisq_bins:
             raise RuntimeError('Chi-square test must be enabled in order to '
                                'use newsnr threshold')
 
-        nsnrs = ranking.newsnr(abs(self.events['snr']),
-                               self.events['chisq'] / self.events['chisq_dof'])
-        remove_idxs = numpy.where(nsnrs < threshold)[0]
-        self.events = numpy.delete(self.events, remove_idxs)
+        def cut(columns, keep):
+            nsnrs = ranking.newsnr(abs(columns['snr']),
+                                   columns['chisq'] / columns['chisq_dof'])
+            return keep & ~(nsnrs < threshold)
+        return cut
 
-    def keep_near_injection(self, window, injections):
+    def injection_cut(self, window, injections):
+        """ Return a cut keeping only events within window seconds of an
+        injection.
+        """
         from pycbc.events.veto import indices_within_times
-        if len(self.events) == 0:
-            return
-
         inj_time = numpy.array(injections.end_times())
-        gpstime = self.events['time_index'].astype(numpy.float64)
-        gpstime = gpstime / self.opt.sample_rate + self.opt.gps_start_time
-        i = indices_within_times(gpstime, inj_time - window, inj_time + window)
-        self.events = self.events[i]
-
-    def keep_loudest_in_interval(self, window, num_keep, statname="newsnr",
-                                 log_chirp_width=None):
-        if len(self.events) == 0:
-            return
 
+        def cut(columns, keep):
+            gpstime = columns['time_index'].astype(numpy.float64)
+            gpstime = gpstime / self.opt.sample_rate + self.opt.gps_start_time
+            i = indices_within_times(gpstime, inj_time - window,
+                                     inj_time + window)
+            near = numpy.zeros(len(keep), dtype=bool)
+            near[i] = True
+            return keep & near
+        return cut
+
+    def loudest_in_interval_cut(self, window, num_keep, statname="newsnr",
+                                log_chirp_width=None):
+        """ Return a cut keeping only the num_keep loudest events by the
+        given statistic in each interval of window samples, and in each bin
+        of log chirp mass if log_chirp_width is given.
+        """
         from pycbc.events import stat
-        e_copy = self.events.copy()
 
-        # Here self.events['snr'] is the complex SNR
-        e_copy['snr'] = abs(e_copy['snr'])
-        # Messy step because pycbc inspiral's internal 'chisq_dof' is 2p-2
-        # but stat.py / ranking.py functions use 'chisq_dof' = p
-        e_copy['chisq_dof'] = e_copy['chisq_dof'] / 2 + 1
-        # Initialize statclass with an empty file list
-        stat_instance = stat.sngl_statistic_dict[statname]([])
-        statv = stat_instance.single(e_copy)
-
-        # Convert trigger time to integer bin number
-        # NB time_index and window are in units of samples
-        wtime = (e_copy['time_index'] / window).astype(numpy.int32)
-        bins = numpy.unique(wtime)
-
-        if log_chirp_width:
-            from pycbc.conversions import mchirp_from_mass1_mass2
-            m1 = numpy.array([p['tmplt'].mass1 for p in self.template_params])
-            m2 = numpy.array([p['tmplt'].mass2 for p in self.template_params])
-            mc = mchirp_from_mass1_mass2(m1, m2)[e_copy['template_id']]
-
-            # convert chirp mass to integer bin number
-            imc = (numpy.log(mc) / log_chirp_width).astype(numpy.int32)
-            cbins = numpy.unique(imc)
-
-        keep = []
-        for b in bins:
+        def cut(columns, keep):
+            idx = numpy.flatnonzero(keep)
+            if len(idx) == 0:
+                return keep
+
+            # Initialize statclass with an empty file list
+            stat_instance = stat.sngl_statistic_dict[statname]([])
+            statv = stat_instance.single(_StatColumns(columns, idx))
+
+            # Convert trigger time to integer bin number
+            # NB time_index and window are in units of samples
+            keys = [(columns['time_index'][idx] / window).astype(numpy.int32)]
+
             if log_chirp_width:
-                for b2 in cbins:
-                    bloc = numpy.where((wtime == b) & (imc == b2))[0]
-                    bloudest = statv[bloc].argsort()[-num_keep:]
-                    keep.append(bloc[bloudest])
-            else:
-                bloc = numpy.where((wtime == b))[0]
-                bloudest = statv[bloc].argsort()[-num_keep:]
-                keep.append(bloc[bloudest])
+                from pycbc.conversions import mchirp_from_mass1_mass2
+                m1 = numpy.array([p['tmplt'].mass1
+                                  for p in self.template_params])
+                m2 = numpy.array([p['tmplt'].mass2
+                                  for p in self.template_params])
+                mc = mchirp_from_mass1_mass2(m1, m2)
+                mc = mc[columns['template_id'][idx]]
+
+                # convert chirp mass to integer bin number
+                keys.append((numpy.log(mc) / log_chirp_width).astype(
+                    numpy.int32))
+
+            # Sort by bin then by decreasing statistic, and keep the first
+            # num_keep events of each bin
+            order = numpy.lexsort([-statv] + keys[::-1])
+            new_bin = numpy.zeros(len(order), dtype=bool)
+            new_bin[0] = True
+            for key in keys:
+                skey = key[order]
+                new_bin[1:] |= skey[1:] != skey[:-1]
+            bin_start = numpy.flatnonzero(new_bin)
+            bin_len = numpy.diff(numpy.append(bin_start, len(order)))
+            rank = numpy.arange(len(order)) - numpy.repeat(bin_start, bin_len)
+
+            loudest = numpy.zeros(len(keep), dtype=bool)
+            loudest[idx[order[rank < num_keep]]] = True
+            return loudest
+        return cut
+
+    def chisq_threshold(self, value, num_bins, delta=0):
+        self.apply_cuts([self.chisq_cut(value, delta=delta)])
+
+    def newsnr_threshold(self, threshold):
+        """ Remove events with newsnr smaller than given threshold
+        """
+        self.apply_cuts([self.newsnr_cut(threshold)])
 
-        keep = numpy.concatenate(keep)
-        self.events = self.events[keep]
+    def keep_near_injection(self, window, injections):
+        self.apply_cuts([self.injection_cut(window, injections)])
+
+    def keep_loudest_in_interval(self, window, num_keep, statname="newsnr",
+                                 log_chirp_width=None):
+        self.apply_cuts([self.loudest_in_interval_cut(
+            window, num_keep, statname=statname,
+            log_chirp_width=log_chirp_width)])
 
     def add_template_events(self, columns, vectors):
         """ Add a vector indexed """
@@ -350,45 +555,59 @@ class EventManager(object):
         self.template_params[-1].update(kwds)
 
     def finalize_template_events(self):
-        self.accumulate.append(self.template_events)
+        self.events.append(self.template_events)
         self.template_events = numpy.array([], dtype=self.event_dtype)
 
+    @staticmethod
+    def logged_cut(cut, message, *args):
+        """ Return the cut, logging the message before it is applied and the
+        number of triggers it keeps after.
+        """
+        def logged(columns, keep):
+            logging.info(message, *args)
+            keep = cut(columns, keep)
+            logging.info("%d remaining triggers", keep.sum())
+            return keep
+        return logged
+
     def consolidate_events(self, opt, gwstrain=None):
-        self.events = numpy.concatenate(self.accumulate)
         logging.info("We currently have %d triggers", len(self.events))
+        cuts = []
         if opt.chisq_threshold and opt.chisq_bins:
-            logging.info("Removing triggers with poor chisq")
-            self.chisq_threshold(opt.chisq_threshold, opt.chisq_bins,
-                                 opt.chisq_delta)
-            logging.info("%d remaining triggers", len(self.events))
+            cuts.append(self.logged_cut(
+                self.chisq_cut(opt.chisq_threshold, delta=opt.chisq_delta),
+                "Removing triggers with poor chisq"))
 
         if opt.newsnr_threshold and opt.chisq_bins:
-            logging.info("Removing triggers with NewSNR below threshold")
-            self.newsnr_threshold(opt.newsnr_threshold)
-            logging.info("%d remaining triggers", len(self.events))
+            cuts.append(self.logged_cut(
+                self.newsnr_cut(opt.newsnr_threshold),
+                "Removing triggers with NewSNR below threshold"))
 
         if opt.keep_loudest_interval:
-            logging.info("Removing triggers not within the top %s "
-                         "loudest of a %s second interval by %s",
-                         opt.keep_loudest_num, opt.keep_loudest_interval,
-                         opt.keep_loudest_stat)
-            self.keep_loudest_in_interval\
-                (opt.keep_loudest_interval * opt.sample_rate,
-                 opt.keep_loudest_num, statname=opt.keep_loudest_stat,
-                 log_chirp_width=opt.keep_loudest_log_chirp_window)
-            logging.info("%d remaining triggers", len(self.events))
+            cuts.append(self.logged_cut(
+                self.loudest_in_interval_cut(
+                    opt.keep_loudest_interval * opt.sample_rate,
+                    opt.keep_loudest_num, statname=opt.keep_loudest_stat,
+                    log_chirp_width=opt.keep_loudest_log_chirp_window),
+                "Removing triggers not within the top %s "
+                "loudest of a %s second interval by %s",
+                opt.keep_loudest_num, opt.keep_loudest_interval,
+                opt.keep_loudest_stat))
 
         if opt.injection_window and hasattr(gwstrain, 'injections'):
-            logging.info("Keeping triggers within %s seconds of injection",
-                         opt.injection_window)
-            self.keep_near_injection(opt.injection_window,
-                                     gwstrain.injections)
-            logging.info("%d remaining triggers", len(self.events))
+            cuts.append(self.logged_cut(
+                self.injection_cut(opt.injection_window,
+                                   gwstrain.injections),
+                "Keeping triggers within %s seconds of injection",
+                opt.injection_window))
 
-        self.accumulate = [self.events]
+        self.apply_cuts(cuts)
 
     def finalize_events(self):
-        self.events = numpy.concatenate(self.accumulate)
+        """ Nothing to do, as the triggers are gathered into a single store
+        as each template is finished.
+        """
+        pass
 
     def make_output_dir(self, outname):
         path = os.path.dirname(outname)
@@ -414,10 +633,22 @@ class EventManager(object):
         self.make_output_dir(outname)
 
         if '.hdf' in outname:
-            self.write_to_hdf(outname)
+            with timers.phase('output'):
+                self.write_to_hdf(outname)
+            self.write_profile(outname)
         else:
             raise ValueError('Cannot write to this format')
 
+    def write_profile(self, outname):
+        """ Add the phase timers to the trigger file, if they are on. This
+        is done once the triggers are written, so that the time spent writing
+        them is included.
+        """
+        if not (timers.enabled and self.write_performance):
+            return
+        with h5py.File(outname, 'a') as f:
+            timers.write(f, self.opt.channel_name[0:2] + '/search/profile')
+
     def write_to_hdf(self, outname):
         class fw(object):
             def __init__(self, name, prefix):
@@ -557,6 +788,7 @@ class EventManager(object):
                             numpy.array([g[1] for g in gating_info[gate_type]])
                     f['gating/' + gate_type + '/pad'] = \
                             numpy.array([g[2] for g in gating_info[gate_type]])
+        f.f.close()
 
 
 class EventManagerMultiDetBase(EventManager):
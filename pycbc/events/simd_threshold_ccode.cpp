@@ -21,7 +21,7 @@
  * a combined thresholding and time clustering of a complex array using a
  * multithreaded, SIMD vectoried code.
  *
- * There are four C functions defined:
+ * There are five C functions defined:
  *
  * parallel_threshold: A multithreaded function that will identify points in a
  *                     timeseries above a user-input threshold.
@@ -31,11 +31,17 @@
  *             to compute the maximum of a complex time series over a given
  *             window.
  *
- * windowed_max: A single threaded (but not vectorized) function that finds the
+ * max_norm: A single-threaded function that computes only the largest norm
+ *           of a complex time series over a given window. It keeps no
+ *           location, so its loop is a plain reduction that the compiler
+ *           can vectorize.
+ *
+ * windowed_max: A single threaded function that finds the
  *               locations, norms, and complex values of the maxima in each of
- *               a set of predefined windows in a given complex array. It does
- *               this by calling max_simple on each window with the
- *               appropriate parameters.
+ *               a set of predefined windows in a given complex array. It
+ *               first takes the largest norm of each window with max_norm,
+ *               and only calls max_simple on the windows whose maximum is
+ *               above threshold, and so may hold a trigger.
  *
  * parallel_thresh_cluster: A multithreaded function that finds the maxima in
  *                          each of a set of contiguous, fixed-length windows
@@ -44,7 +50,7 @@
  *                          tests for above threshold, and time-clusters the
  *                          surviving triggers.
  *
- * A user calls only the last function; the other three exist to conveniently
+ * A user calls only the last function; the other four exist to conveniently
  * compartmentalize SIMD code from OpenMP code.
  */
 
@@ -164,12 +170,63 @@ void _max_simple(float * __restrict inarr, float * __restrict mval,
 }
 
 
+/*
+ * The following finds the largest norm over an interval, without its
+ * location. Windows whose largest norm is not above threshold cannot hold
+ * a trigger, and their exact maximum is then never needed.
+ */
+
+float _max_norm(float * __restrict inarr, int64_t howmany){
+
+  /*
+
+   This function takes an input float array (which consists of alternating
+   real and imaginary parts of a complex array) of real length 'howmany', and
+   returns the largest norm of its elements.
+
+  */
+
+  int64_t i;
+  float curr_norm = 0.0;
+
+#pragma omp simd reduction(max:curr_norm)
+  for (i = 0; i < howmany; i += 2){
+    float re = inarr[i];
+    float im = inarr[i+1];
+    float curr = re*re + im*im;
+    curr_norm = (curr > curr_norm) ? curr : curr_norm;
+  }
+
+  return curr_norm;
+}
+
+void _window_max(std::complex<float> * __restrict inarr,
+                 std::complex<float> * __restrict cval,
+                 float * __restrict norm,
+                 int64_t * __restrict loc, const int64_t nstart,
+                 const int64_t howmany, const float thr_sqr){
+
+  // The factor of 2 multiplying the lengths is because max_simple and
+  // max_norm need their length as a real length, not complex.
+
+  *norm = _max_norm((float *) inarr, 2*howmany);
+  if (*norm > thr_sqr){
+    _max_simple((float *) inarr, (float *) cval, norm, loc, nstart,
+                2*howmany);
+  } else {
+    // Below threshold, only the norm is used, in comparison with the
+    // neighbouring windows.
+    *cval = std::complex<float>(0.0, 0.0);
+    *loc = nstart;
+  }
+}
+
 void _windowed_max(std::complex<float> * __restrict inarr,
                    const int64_t arrlen,
                    std::complex<float> * __restrict cvals,
                    float * __restrict norms,
                    int64_t * __restrict locs, const int64_t winsize,
-                   const int64_t startoffset){
+                   const int64_t startoffset, const float thr_sqr){
 
 
   /*
@@ -185,8 +242,8 @@ void _windowed_max(std::complex<float> * __restrict inarr,
    Thus, in all cases, the length of cvals, norms, and locs should be:
       nwindows = ( (arrlen % winsize) ? (arrlen/winsize) + 1 : (arrlen/winsize) )
 
-   Note that all input sizes are for *complex* arrays; the function this function calls
-   requires *real* arrays, and lengths will be converted where appropriate.
+   The complex value and location are only found for windows whose maximum
+   norm is above thr_sqr; for the others only the norm is filled in.
 
   */
 
@@ -197,14 +254,12 @@ void _windowed_max(std::complex<float> * __restrict inarr,
   // Everything but the last window, which may not be full length
 
   for (i = 0; i < nwindows-1; i++){
-    // The factor of 2 multiplying lengths[i] is because max_simd needs its length as a real
-    // length, not complex.  But startpts and startoffset are complex values.
-    _max_simple((float *) &inarr[i*winsize], (float *) &cvals[i],
-                &norms[i], &locs[i], startoffset + i*winsize, 2*winsize);
+    _window_max(&inarr[i*winsize], &cvals[i], &norms[i], &locs[i],
+                startoffset + i*winsize, winsize, thr_sqr);
   }
   // Now the last window (which will be the only window if arrlen <= winzise)
-  _max_simple((float *) &inarr[i*winsize], (float *) &cvals[i],
-               &norms[i], &locs[i], startoffset + i*winsize, 2*(arrlen - i*winsize));
+  _window_max(&inarr[i*winsize], &cvals[i], &norms[i], &locs[i],
+              startoffset + i*winsize, arrlen - i*winsize, thr_sqr);
 
   return;
 }
@@ -304,7 +359,7 @@ int _parallel_thresh_cluster(std::complex<float> * __restrict inarr,
   for (i = 0; i < nsegs; i++){
     _windowed_max(&inarr[i*true_segsize], seglens[i], &cvals[i*nwins_ps],
                  &norms[i*nwins_ps], &mlocs[i*nwins_ps],
-                 s_winsize, i*true_segsize);
+                 s_winsize, i*true_segsize, thr_sqr);
   }
 
   /*
@@ -25,6 +25,7 @@
 This module contains functions for calculating coincident ranking statistic
 values.
 """
+import copy
 import logging
 import numpy
 from . import ranking
@@ -70,6 +71,14 @@ class Stat(object):
 
         self.ifos = ifos or []
 
+    def for_ifos(self, ifos):
+        """Return a copy of the statistic for a subset of the detectors,
+        sharing the tables read from the statistic files.
+        """
+        stat = copy.copy(self)
+        stat.ifos = list(ifos)
+        return stat
+
 
 class NewSNRStatistic(Stat):
     """Calculate the NewSNR coincident detection statistic"""
@@ -376,6 +385,20 @@ class PhaseTDNewStatistic(NewSNRStatistic):
         self.two_det_flag = (len(ifos) == 2)
         self.two_det_weights = {}
 
+    def for_ifos(self, ifos):
+        stat = NewSNRStatistic.for_ifos(self, ifos)
+        # The signal histogram depends on the detectors, so is read again
+        stat.has_hist = False
+        stat.hist_ifos = None
+        stat.relsense = {}
+        stat.weights = {}
+        stat.param_bin = {}
+        stat.two_det_flag = (len(ifos) == 2)
+        stat.two_det_weights = {}
+        for attr in ['c0_size', 'c1_size', 'c2_size']:
+            stat.__dict__.pop(attr, None)
+        return stat
+
     def get_hist(self, ifos=None):
         """Read in a signal density file for the ifo combination"""
 
@@ -651,6 +674,14 @@ class PhaseTDStatistic(NewSNRStatistic):
         self.bins = {}
         self.hist_ifos = []
 
+    def for_ifos(self, ifos):
+        stat = NewSNRStatistic.for_ifos(self, ifos)
+        # The signal histogram depends on the detectors, so is read again
+        stat.hist = None
+        stat.bins = {}
+        stat.hist_ifos = []
+        return stat
+
     def get_hist(self, ifos=None, norm='max'):
         """Read in a signal density file for the ifo combination"""
 
@@ -22,6 +22,7 @@
 # =============================================================================
 #
 from __future__ import absolute_import
+import threading
 import numpy
 from .simd_threshold_cython import parallel_thresh_cluster, parallel_threshold
 from .eventmgr import _BaseThresholdCluster
@@ -40,16 +41,17 @@ def threshold_numpy(series, value):
     return locs, vals
 
 
-outl = None
-outv = None
-count = None
+# The output buffers are kept per thread, so that segments may be filtered
+# concurrently on different threads (see pycbc_inspiral --segment-threads)
+_thread_buffers = threading.local()
 def threshold_inline(series, value):
     arr = numpy.array(series.data, copy=False, dtype=numpy.complex64)
-    global outl, outv, count
-    if outl is None or len(outl) < len(series):
-        outl = numpy.zeros(len(series), dtype=numpy.uint32)
-        outv = numpy.zeros(len(series), dtype=numpy.complex64)
-        count = numpy.zeros(1, dtype=numpy.uint32)
+    buf = _thread_buffers
+    if getattr(buf, 'outl', None) is None or len(buf.outl) < len(series):
+        buf.outl = numpy.zeros(len(series), dtype=numpy.uint32)
+        buf.outv = numpy.zeros(len(series), dtype=numpy.complex64)
+        buf.count = numpy.zeros(1, dtype=numpy.uint32)
+    outl, outv, count = buf.outl, buf.outv, buf.count
 
     N = len(series)
     threshold = value**2.0
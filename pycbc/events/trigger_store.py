@@ -0,0 +1,216 @@
+"""
+This module provides a columnar store for single detector triggers. Each
+column is kept in its own growable array, and once more than a given number of
+triggers are held in memory they are written out to extendable datasets of a
+temporary HDF file, so that the memory used by a job stays bounded however many
+triggers it finds.
+"""
+import os
+import tempfile
+import logging
+import numpy
+import h5py
+import six
+
+
+class TriggerStore(object):
+    """ Columnar store of triggers.
+
+    Triggers are added with `append`, a whole column is read with
+    ``store[name]``, and a subset of the triggers is taken with
+    ``store[mask]`` or ``store[indices]``, which returns a new store. This
+    mirrors how a structured array of triggers is used, so that code handling
+    the triggers works with either.
+
+    Parameters
+    ----------
+    dtype : numpy.dtype
+        The columns of the store, given as the dtype of a structured array.
+    spill_size : {None, int}
+        The number of triggers to hold in memory before writing them to disk.
+        If None, all triggers are kept in memory.
+    spill_dir : {None, str}
+        The directory in which to write the temporary HDF file. If None, the
+        system default temporary directory is used.
+    """
+    _initial_capacity = 1024
+
+    def __init__(self, dtype, spill_size=None, spill_dir=None):
+        self.dtype = numpy.dtype(dtype)
+        self.spill_size = spill_size
+        self.spill_dir = spill_dir
+        self._size = 0
+        self._nspilled = 0
+        self._fp = None
+        self._fname = None
+        self._data = {}
+        for name in self.dtype.names:
+            self._data[name] = numpy.zeros(self._initial_capacity,
+                                           dtype=self.dtype[name])
+
+    @property
+    def names(self):
+        return self.dtype.names
+
+    def __len__(self):
+        return self._nspilled + self._size
+
+    def _reserve(self, num):
+        """ Make sure there is room in memory for num more triggers """
+        capacity = len(self._data[self.names[0]])
+        if self._size + num <= capacity:
+            return
+        while capacity < self._size + num:
+            capacity *= 2
+        for name in self.names:
+            data = numpy.zeros(capacity, dtype=self.dtype[name])
+            data[:self._size] = self._data[name][:self._size]
+            self._data[name] = data
+
+    def append(self, events):
+        """ Add triggers to the store.
+
+        Parameters
+        ----------
+        events : numpy.ndarray or dict
+            A structured array, or a dict of arrays, holding every column.
+        """
+        num = len(events[self.names[0]])
+        if num == 0:
+            return
+        self._reserve(num)
+        for name in self.names:
+            self._data[name][self._size:self._size + num] = events[name]
+        self._size += num
+
+        if self.spill_size is not None and self._size >= self.spill_size:
+            self.spill()
+
+    def spill(self):
+        """ Write the triggers held in memory out to the temporary file """
+        if self._size == 0:
+            return
+
+        if self._fp is None:
+            fd, self._fname = tempfile.mkstemp(suffix='.hdf',
+                                               prefix='triggers-',
+                                               dir=self.spill_dir)
+            os.close(fd)
+            self._fp = h5py.File(self._fname, 'w')
+            for name in self.names:
+                self._fp.create_dataset(name, (0,), dtype=self.dtype[name],
+                                        maxshape=(None,), chunks=True)
+
+        end = self._nspilled + self._size
+        for name in self.names:
+            dset = self._fp[name]
+            dset.resize((end,))
+            dset[self._nspilled:end] = self._data[name][:self._size]
+        self._nspilled = end
+        self._size = 0
+        logging.info('Moved triggers to disk, %s held there', end)
+
+    def iter_chunks(self, start=0):
+        """ Iterate over the triggers from index start onwards in chunks,
+        each a dict of arrays.
+        """
+        if start < self._nspilled:
+            step = self.spill_size or self._nspilled
+            for begin in range(start, self._nspilled, step):
+                end = min(begin + step, self._nspilled)
+                yield {name: self._fp[name][begin:end] for name in self.names}
+        mstart = max(start - self._nspilled, 0)
+        if self._size > mstart:
+            yield {name: self._data[name][mstart:self._size]
+                   for name in self.names}
+
+    def column(self, name):
+        """ Return a whole column as an array """
+        mem = self._data[name][:self._size]
+        if not self._nspilled:
+            return mem.copy()
+        return numpy.concatenate([self._fp[name][:], mem])
+
+    def new_like(self):
+        """ Return an empty store with the same columns and settings """
+        return TriggerStore(self.dtype, spill_size=self.spill_size,
+                            spill_dir=self.spill_dir)
+
+    def take(self, key):
+        """ Return a new store with the triggers selected by a boolean mask
+        or an array of indices.
+        """
+        key = numpy.asarray(key)
+        out = self.new_like()
+        if key.dtype == bool:
+            offset = 0
+            for chunk in self.iter_chunks():
+                num = len(chunk[self.names[0]])
+                keep = key[offset:offset + num]
+                out.append({name: chunk[name][keep] for name in self.names})
+                offset += num
+        else:
+            out.append({name: self.column(name)[key] for name in self.names})
+        return out
+
+    def __getitem__(self, key):
+        if isinstance(key, six.string_types):
+            return self.column(key)
+        return self.take(key)
+
+    def __setitem__(self, name, values):
+        if self._nspilled:
+            raise ValueError('Cannot set a column of triggers that have been '
+                             'moved to disk')
+        self._data[name][:self._size] = values
+
+    def copy(self):
+        """ Return an in-memory copy of the store """
+        out = TriggerStore(self.dtype)
+        for chunk in self.iter_chunks():
+            out.append(chunk)
+        return out
+
+    def sort(self, order):
+        """ Sort the triggers by the given column, one column at a time """
+        col = self.column(order)
+        if numpy.all(col[1:] >= col[:-1]):
+            return
+        idx = numpy.argsort(col, kind='stable')
+        if self._nspilled:
+            self.spill()
+            for name in self.names:
+                self._fp[name][:] = self._fp[name][:][idx]
+        else:
+            for name in self.names:
+                data = self._data[name]
+                data[:self._size] = data[:self._size][idx]
+
+    def to_array(self):
+        """ Return the triggers as a structured array """
+        out = numpy.zeros(len(self), dtype=self.dtype)
+        for name in self.names:
+            out[name] = self.column(name)
+        return out
+
+    def close(self):
+        """ Close and delete the temporary file, if there is one """
+        if self._fp is not None:
+            self._fp.close()
+            os.remove(self._fname)
+        self._fp = self._fname = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def __getstate__(self):
+        return {'dtype': self.dtype, 'spill_size': self.spill_size,
+                'spill_dir': self.spill_dir, 'events': self.to_array()}
+
+    def __setstate__(self, state):
+        self.__init__(state['dtype'], spill_size=state['spill_size'],
+                      spill_dir=state['spill_dir'])
+        self.append(state['events'])
@@ -0,0 +1,306 @@
+"""
+This module times the transforms of each available CPU FFT backend through
+the class API, and writes and reads machine profiles of the fastest settings.
+A machine profile may be given to pycbc.fft.from_cli (--fft-profile) to
+choose the backend, FFTW measure level and number of threads, and the FFTW
+measure level of each transform size.
+"""
+
+import json
+import time
+import itertools
+import logging
+import numpy
+from pycbc.types import zeros, Array
+from pycbc.scheme import CPUScheme
+from .backend_support import get_backend_names
+from .class_api import FFT, IFFT
+from . import backend_cpu
+
+_dtypes = {('single', 'real'): numpy.float32,
+           ('single', 'complex'): numpy.complex64,
+           ('double', 'real'): numpy.float64,
+           ('double', 'complex'): numpy.complex128}
+
+def _transform_vectors(size, precision, kind, inverse, inplace, nbatch):
+    """ Return the input and output vectors of a transform.
+    """
+    ctype = _dtypes[(precision, 'complex')]
+    if kind == 'c2c':
+        invec = zeros(size * nbatch, dtype=ctype)
+        outvec = invec if inplace else zeros(size * nbatch, dtype=ctype)
+        return invec, outvec
+    elif kind != 'r2c':
+        raise ValueError("Transform kind must be either 'c2c' or 'r2c'")
+
+    rtype = _dtypes[(precision, 'real')]
+    cvec = zeros((size // 2 + 1) * nbatch, dtype=ctype)
+    if inplace:
+        rvec = Array(cvec.data.view(rtype), copy=False)
+    else:
+        rvec = zeros(size * nbatch, dtype=rtype)
+    return (cvec, rvec) if inverse else (rvec, cvec)
+
+def time_transform(backend, size, precision='single', kind='c2c',
+                   inverse=False, inplace=False, nbatch=1, measure_level=None,
+                   num_threads=1, min_time=0.2):
+    """ Time a transform through the FFT/IFFT class API.
+
+    Parameters
+    ----------
+    backend : str
+        The name of the CPU FFT backend to use.
+    size : int
+        The length of each transform.
+    precision : {'single', 'double'}
+        The precision of the transform.
+    kind : {'c2c', 'r2c'}
+        Whether to do a complex to complex, or a real to complex (or, if
+        inverse, complex to real) transform.
+    inverse : {False, bool}
+        Time the inverse rather than the forward transform.
+    inplace : {False, bool}
+        Do the transform in-place.
+    nbatch : {1, int}
+        The number of transforms done by each execution.
+    measure_level : {None, int}
+        The FFTW measure level used in planning. Ignored by other backends.
+    num_threads : {1, int}
+        The number of threads of the CPU processing scheme.
+    min_time : {0.2, float}
+        Repeat the transform for at least this many seconds.
+
+    Returns
+    -------
+    times : dict
+        The time to plan ('plan_time') and the mean time of each
+        execution ('time'), in seconds.
+    """
+    from . import fftw
+    old_backend = backend_cpu.cpu_backend
+    old_mlvl = fftw.get_measure_level() if 'fftw' in get_backend_names() \
+                                        else None
+    old_rule = fftw._measure_level_rule if old_mlvl is not None else None
+    try:
+        with CPUScheme(num_threads=num_threads):
+            backend_cpu.set_backend([backend])
+            if backend == 'fftw' and measure_level is not None:
+                fftw.set_measure_level(measure_level)
+                fftw.set_measure_level_rule(None)
+
+            invec, outvec = _transform_vectors(size, precision, kind, inverse,
+                                               inplace, nbatch)
+            kwds = {'nbatch': nbatch, 'size': size}
+            start = time.time()
+            if inverse:
+                engine = IFFT(invec, outvec, **kwds)
+            else:
+                engine = FFT(invec, outvec, **kwds)
+            plan_time = time.time() - start
+
+            engine.execute()
+            niter = 0
+            start = time.time()
+            while True:
+                engine.execute()
+                niter += 1
+                elapsed = time.time() - start
+                if elapsed >= min_time:
+                    break
+    finally:
+        backend_cpu.set_backend([old_backend])
+        if old_mlvl is not None:
+            fftw.set_measure_level(old_mlvl)
+            fftw.set_measure_level_rule(old_rule)
+
+    return {'plan_time': plan_time, 'time': elapsed / niter}
+
+def run_benchmark(sizes, backends=None, measure_levels=(0,),
+                  thread_counts=(1,), batch_sizes=(1,), precision='single',
+                  min_time=0.2):
+    """ Time forward and inverse, in-place and out-of-place, complex and
+    real transforms of each size, for each combination of backend,
+    measure level (FFTW only), number of threads and batch size.
+
+    Returns
+    -------
+    results : list of dicts
+        One entry per transform timed, giving its settings and times.
+        Settings that a backend does not support are skipped.
+    """
+    if backends is None:
+        backends = backend_cpu._alist
+
+    results = []
+    for size, backend in itertools.product(sizes, backends):
+        mlvls = measure_levels if backend == 'fftw' else [None]
+        for mlvl, nthreads, nbatch, kind, inverse, inplace in \
+                itertools.product(mlvls, thread_counts, batch_sizes,
+                                  ['c2c', 'r2c'], [False, True],
+                                  [False, True]):
+            entry = {'size': size, 'backend': backend,
+                     'measure_level': mlvl, 'num_threads': nthreads,
+                     'nbatch': nbatch, 'precision': precision,
+                     'kind': kind, 'inverse': inverse, 'inplace': inplace}
+            try:
+                entry.update(time_transform(backend, size, precision, kind,
+                                            inverse, inplace, nbatch, mlvl,
+                                            nthreads, min_time))
+            except (AttributeError, ValueError, NotImplementedError) as e:
+                logging.debug("Skipping %s: %s", entry, e)
+                continue
+            logging.info("%s: %.3g s", entry, entry['time'])
+            results.append(entry)
+    return results
+
+def _settings(entry):
+    return (entry['backend'], entry['measure_level'], entry['num_threads'])
+
+def make_profile(results, objective='throughput'):
+    """ Choose the best settings from the benchmark results.
+
+    The settings (backend, measure level and number of threads) are
+    compared by the summed time of all of the transforms timed for each
+    size that they support.
+
+    Parameters
+    ----------
+    results : list of dicts
+        The output of run_benchmark.
+    objective : {'throughput', 'latency'}
+        If 'throughput', minimize the time multiplied by the number of
+        threads, i.e. the core time used; if 'latency', minimize the wall
+        time.
+
+    Returns
+    -------
+    profile : dict
+        The results, the best settings for each size ('best'), and the
+        settings that are closest to the best over all sizes ('default').
+    """
+    from pycbc.opt import cpu_model
+    if objective not in ['throughput', 'latency']:
+        raise ValueError("Objective must be either 'throughput' or 'latency'")
+
+    sizes = sorted(set(r['size'] for r in results))
+    ntransforms = {}
+    for r in results:
+        key = (r['size'],) + _settings(r)
+        ntransforms[key] = ntransforms.get(key, 0) + 1
+
+    cost = {}
+    for r in results:
+        key = (r['size'],) + _settings(r)
+        # Only compare settings that can do every kind of transform timed
+        if ntransforms[key] < max(n for k, n in ntransforms.items()
+                                  if k[0] == r['size']):
+            continue
+        c = r['time'] * (r['num_threads'] if objective == 'throughput' else 1)
+        cost[key] = cost.get(key, 0) + c
+
+    best = {}
+    relative = {}
+    for size in sizes:
+        costs = dict((k[1:], v) for k, v in cost.items() if k[0] == size)
+        if not costs:
+            continue
+        settings = min(costs, key=costs.get)
+        best[str(size)] = {'backend': settings[0],
+                           'measure_level': settings[1],
+                           'num_threads': settings[2]}
+        for s, c in costs.items():
+            relative.setdefault(s, []).append(c / costs[settings])
+
+    # The default is the setting with the least mean slowdown relative to
+    # the best, among those that were timed at every size
+    complete = dict((s, numpy.mean(r)) for s, r in relative.items()
+                    if len(r) == len(best))
+    default = None
+    if complete:
+        s = min(complete, key=complete.get)
+        default = {'backend': s[0], 'measure_level': s[1],
+                   'num_threads': s[2]}
+
+    return {'cpu_model': cpu_model(),
+            'objective': objective,
+            'results': results,
+            'best': best,
+            'default': default}
+
+def write_profile(filename, profile):
+    """ Write a machine profile to a JSON file.
+    """
+    with open(filename, 'w') as f:
+        json.dump(profile, f, indent=2, sort_keys=True)
+
+def read_profile(filename):
+    """ Read a machine profile written by write_profile.
+    """
+    with open(filename, 'r') as f:
+        return json.load(f)
+
+def _nearest_settings(profile, size):
+    """ Return the best settings of a profile for the size nearest to size.
+    """
+    sizes = [int(s) for s in profile['best']]
+    nearest = min(sizes, key=lambda s: abs(numpy.log(float(s) / size)))
+    return profile['best'][str(nearest)]
+
+def profile_settings(profile, size=None):
+    """ Return the recommended settings of a machine profile.
+
+    Parameters
+    ----------
+    profile : dict
+        A machine profile, as returned by make_profile or read_profile.
+    size : {None, int}
+        The length of the transforms that will be done. If given, the best
+        settings for the nearest size in the profile are returned; otherwise
+        the profile default.
+
+    Returns
+    -------
+    settings : dict
+        The 'backend', 'measure_level' and 'num_threads' to use.
+    """
+    from pycbc.opt import cpu_model
+    if profile['cpu_model'] != cpu_model():
+        logging.warning("FFT profile was made on a %s CPU, but this is a "
+                        "%s", profile['cpu_model'], cpu_model())
+
+    if size is None or not profile['best']:
+        settings = profile['default']
+    else:
+        settings = _nearest_settings(profile, size)
+
+    if settings is None:
+        raise ValueError("The FFT profile does not recommend any settings")
+    return settings
+
+def profile_measure_level(profile, size, num_threads):
+    """ Return the FFTW measure level recommended by a machine profile for
+    transforms of the given size, for use with fftw.set_measure_level_rule.
+
+    Parameters
+    ----------
+    profile : dict
+        A machine profile, as returned by make_profile or read_profile.
+    size : int
+        The length of the transform.
+    num_threads : int
+        The number of threads the transform is done with.
+
+    Returns
+    -------
+    measure_level : {None, int}
+        The measure level of the best settings for the nearest size in the
+        profile, or None if these are not for FFTW with this number of
+        threads.
+    """
+    if not profile['best']:
+        return None
+    settings = _nearest_settings(profile, size)
+    if settings['backend'] != 'fftw' or \
+            settings['num_threads'] != num_threads:
+        return None
+    return settings['measure_level']
@@ -54,7 +54,8 @@ class FFT(object):
     size : int (default None)
       When nbatch is not 1, this parameter gives the logical size of each
       transform.  If nbatch is 1 (the default) this can be None, and the
-      logical size is the length of invec.
+      logical size is the length of invec; it must still be given for an
+      in-place real transform, as invec is then padded.
 
     The addresses in memory of both vectors should be divisible by
     pycbc.PYCBC_ALIGNMENT.
@@ -79,7 +80,8 @@ class IFFT(object):
     size : int (default None)
       When nbatch is not 1, this parameter gives the logical size of each
       transform.  If nbatch is 1 (the default) this can be None, and the
-      logical size is the length of outvec.
+      logical size is the length of outvec; it must still be given for an
+      in-place real transform, as outvec is then padded.
 
     The addresses in memory of both vectors should be divisible by
     pycbc.PYCBC_ALIGNMENT.
@@ -99,7 +99,7 @@ def _check_fwd_args(invec, itype, outvec, otype, nbatch, size):
     olen = len(outvec)
     if nbatch < 1:
         raise ValueError("nbatch must be >= 1")
-    if (nbatch > 1) and size is not None:
+    if (nbatch > 1) and size is None:
         raise ValueError("When nbatch > 1, size cannot be 'None'")
     if size is None:
         size = ilen
@@ -179,7 +179,7 @@ class _BaseFFT(object):
         self.outvec = outvec
         self.inplace = (self.invec.ptr == self.outvec.ptr)
         self.nbatch = nbatch
-        if nbatch > 1:
+        if size is not None:
             self.size = size
         else:
             self.size = len(invec)
@@ -232,7 +232,7 @@ class _BaseIFFT(object):
         self.outvec = outvec
         self.inplace = (self.invec.ptr == self.outvec.ptr)
         self.nbatch = nbatch
-        if nbatch > 1:
+        if size is not None:
             self.size = size
         else:
             self.size = len(outvec)
@@ -1,6 +1,11 @@
-from pycbc.types import zeros, complex64, complex128
+from pycbc.types import zeros
+import os
+import atexit
+import logging
+import tempfile
 import numpy as _np
 import ctypes
+import threading
 import pycbc.scheme as _scheme
 from pycbc.libutils import get_ctypes_library
 from .core import _BaseFFT, _BaseIFFT
@@ -35,6 +40,10 @@ float_lib = get_ctypes_library('fftw3f',['fftw3f'],mode=ctypes.RTLD_GLOBAL)
 if (double_lib is None) or (float_lib is None):
     raise ImportError("Unable to find FFTW libraries")
 
+# Only the FFTW execute functions are thread-safe, so all plan creation and
+# destruction is serialized through this lock.
+_plan_lock = threading.Lock()
+
 # Support for FFTW's two different threading backends
 _fftw_threaded_lib = None
 _fftw_threaded_set = False
@@ -151,12 +160,19 @@ def import_sys_wisdom():
 # but we provide functions to read and set it
 
 _default_measurelvl = 0
-def get_measure_level():
+_measure_level_rule = None
+def get_measure_level(size=None):
     """
     Get the current 'measure level' used in deciding how much effort to put into
     creating FFTW plans.  From least effort (and shortest planning time) to most
-    they are 0 to 3.  No arguments.
+    they are 0 to 3.  If the size of the transform is given, and a rule has been
+    set with set_measure_level_rule, the level chosen by the rule for that size
+    and the current number of threads is returned.
     """
+    if size is not None and _measure_level_rule is not None:
+        mlvl = _measure_level_rule(size, _scheme.mgr.state.num_threads)
+        if mlvl is not None:
+            return mlvl
     return _default_measurelvl
 
 def set_measure_level(mlvl):
@@ -170,6 +186,17 @@ def set_measure_level(mlvl):
         raise ValueError("Measure level can only be one of 0, 1, 2, or 3")
     _default_measurelvl = mlvl
 
+def set_measure_level_rule(rule):
+    """
+    Set a function choosing the measure level of each transform, such as one
+    made from an FFT profile. It is called with the size of the transform and
+    the number of threads, and returns a measure level, or None to use the
+    level set by set_measure_level.  If rule is None, that level is always
+    used.
+    """
+    global _measure_level_rule
+    _measure_level_rule = rule
+
 _flag_dict = {0: FFTW_ESTIMATE,
               1: FFTW_MEASURE,
               2: FFTW_MEASURE|FFTW_PATIENT,
@@ -210,6 +237,189 @@ def export_single_wisdom_to_filename(filename):
 def export_double_wisdom_to_filename(filename):
     wisdom_io(filename, 'double', 'export')
 
+# An on-disk cache of wisdom, shared between jobs. Wisdom files are stored
+# per CPU model and are named by precision, kind of transform, transform size
+# and number of threads. A file is imported the first time a transform it
+# describes is planned. The wisdom entries added while planning transforms
+# (above the estimate level) are recorded, and merged into the cache files
+# when the process exits.
+
+_wisdom_cache_dir = None
+_wisdom_cache_loaded = set()
+_wisdom_cache_dirty = set()
+_wisdom_cache_invalid = set()
+_wisdom_cache_entries = {}
+_wisdom_cache_headers = {}
+
+def set_wisdom_cache_dir(directory):
+    """Set the directory of the on-disk wisdom cache; if None, disable
+    the cache.
+    """
+    global _wisdom_cache_dir
+    if directory is not None:
+        from pycbc.opt import cpu_model
+        directory = os.path.join(directory, cpu_model())
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Another job may have just made it
+                if not os.path.isdir(directory):
+                    raise
+    _wisdom_cache_dir = directory
+
+def get_wisdom_cache_dir():
+    """Return the directory of the on-disk wisdom cache for this CPU
+    model, or None if the cache is not in use.
+    """
+    return _wisdom_cache_dir
+
+def _wisdom_cache_key(idtype, odtype, direction, size, nthreads):
+    idtype = _np.dtype(idtype)
+    odtype = _np.dtype(odtype)
+    precision = 'float' if idtype.char in ['f', 'F'] else 'double'
+    if idtype.kind == odtype.kind:
+        kind = 'c2c' if direction == FFTW_FORWARD else 'c2c_inverse'
+    elif idtype.kind == 'c':
+        kind = 'c2r'
+    else:
+        kind = 'r2c'
+    return (precision, kind, int(size), int(nthreads))
+
+def _wisdom_cache_filename(key):
+    precision, kind, size, nthreads = key
+    fname = '{0}-{1}-{2}-{3}threads.wisdom'.format(precision, kind, size,
+                                                   nthreads)
+    return os.path.join(_wisdom_cache_dir, fname)
+
+def _parse_wisdom(text):
+    """Return the header line of a wisdom string, and the set of its
+    entries, one per planned problem.
+    """
+    lines = []
+    for line in text.splitlines():
+        # Drop the parenthesis closing the whole wisdom
+        line = line.strip()
+        while line.count(')') > line.count('('):
+            line = line[:-1].rstrip()
+        if line:
+            lines.append(line)
+    if not lines:
+        raise RuntimeError('Empty wisdom')
+    return lines[0], set(lines[1:])
+
+def wisdom_entries(precision):
+    """Return the header line of the wisdom of this process, and the set of
+    its entries, one per planned problem.
+    """
+    if precision == 'float':
+        export, free = (float_lib.fftwf_export_wisdom_to_string,
+                        float_lib.fftwf_free)
+    else:
+        export, free = (double_lib.fftw_export_wisdom_to_string,
+                        double_lib.fftw_free)
+    export.restype = ctypes.c_void_p
+    free.argtypes = [ctypes.c_void_p]
+    ptr = export()
+    if not ptr:
+        raise RuntimeError('Could not export {0} wisdom'.format(precision))
+    try:
+        text = ctypes.string_at(ptr).decode()
+    finally:
+        free(ptr)
+    return _parse_wisdom(text)
+
+def _load_cached_wisdom(idtype, odtype, direction, size, nthreads):
+    """Import the cached wisdom for this transform, if there is any, the
+    first time it is planned. Must be called holding the planning lock.
+
+    Returns
+    -------
+    snapshot : {None, tuple}
+        If the transform is planned above the estimate level, the cache key
+        and the wisdom entries known before planning it, to be passed to
+        `_record_cached_wisdom` once it is planned.
+    """
+    if _wisdom_cache_dir is None:
+        return None
+    key = _wisdom_cache_key(idtype, odtype, direction, size, nthreads)
+    if key not in _wisdom_cache_loaded:
+        _wisdom_cache_loaded.add(key)
+
+        fname = _wisdom_cache_filename(key)
+        if os.path.isfile(fname):
+            try:
+                wisdom_io(fname, key[0], 'import')
+                logging.debug('Imported cached FFTW wisdom from %s', fname)
+            except RuntimeError:
+                logging.warning('Could not import cached FFTW wisdom from '
+                                '%s, it will be replaced', fname)
+                _wisdom_cache_invalid.add(key)
+
+    if get_measure_level(size) == 0:
+        return None
+    return key, wisdom_entries(key[0])[1]
+
+def _record_cached_wisdom(snapshot):
+    """Keep the wisdom entries added since the snapshot returned by
+    `_load_cached_wisdom`, to be written to the cache file of the transform.
+    Must be called holding the planning lock.
+    """
+    if snapshot is None:
+        return
+    key, before = snapshot
+    header, after = wisdom_entries(key[0])
+    if after - before:
+        _wisdom_cache_headers[key[0]] = header
+        _wisdom_cache_entries.setdefault(key, set()).update(after - before)
+        _wisdom_cache_dirty.add(key)
+
+def export_cached_wisdom():
+    """Merge the wisdom entries added by the transforms planned into their
+    on-disk cache files. Each file only holds the wisdom of its own
+    transforms. It is updated while holding a lock on it, and written to a
+    temporary file and then moved into place, so that concurrent jobs only
+    ever see complete files. This is called automatically on exit.
+    """
+    from pycbc.opt import file_lock
+    if _wisdom_cache_dir is None:
+        return
+    # The permissions a file created by this process would have
+    umask = os.umask(0)
+    os.umask(umask)
+    with _plan_lock:
+        while _wisdom_cache_dirty:
+            key = _wisdom_cache_dirty.pop()
+            entries = _wisdom_cache_entries.pop(key)
+            fname = _wisdom_cache_filename(key)
+            tmpname = None
+            try:
+                with file_lock(fname):
+                    # Keep what other jobs have added to the file
+                    if os.path.isfile(fname) and \
+                            key not in _wisdom_cache_invalid:
+                        with open(fname, 'r') as f:
+                            entries |= _parse_wisdom(f.read())[1]
+                    _wisdom_cache_invalid.discard(key)
+
+                    fd, tmpname = tempfile.mkstemp(dir=_wisdom_cache_dir,
+                                                   suffix='.tmp')
+                    with os.fdopen(fd, 'w') as f:
+                        f.write(_wisdom_cache_headers[key[0]] + '\n')
+                        for entry in sorted(entries):
+                            f.write('  ' + entry + '\n')
+                        f.write(')\n')
+                    os.chmod(tmpname, 0o666 & ~umask)
+                    os.rename(tmpname, fname)
+                logging.debug('Exported FFTW wisdom to cache file %s', fname)
+            except (RuntimeError, OSError) as e:
+                logging.warning('Could not write FFTW wisdom cache file '
+                                '%s: %s', fname, e)
+                if tmpname is not None and os.path.exists(tmpname):
+                    os.remove(tmpname)
+
+atexit.register(export_cached_wisdom)
+
 def set_planning_limit(time):
     if not _fftw_threaded_set:
         set_threads_backend()
@@ -244,6 +454,7 @@ def plan(size, idtype, odtype, direction, mlvl, aligned, nthreads, inplace):
         set_threads_backend()
     if nthreads != _fftw_current_nthreads:
         _fftw_plan_with_nthreads(nthreads)
+    snapshot = _load_cached_wisdom(idtype, odtype, direction, size, nthreads)
     # Convert a measure-level to flags
     flags = get_flag(mlvl,aligned)
 
@@ -295,6 +506,8 @@ def plan(size, idtype, odtype, direction, mlvl, aligned, nthreads, inplace):
                       ctypes.c_int]
         theplan = f(size, ip.ptr, op.ptr, flags)
 
+    _record_cached_wisdom(snapshot)
+
     # We don't need ip or op anymore
     del ip, op
 
@@ -319,18 +532,22 @@ def execute(plan, invec, outvec):
     f(plan, invec.ptr, outvec.ptr)
 
 def fft(invec, outvec, prec, itype, otype):
-    theplan, destroy = plan(len(invec), invec.dtype, outvec.dtype, FFTW_FORWARD,
-                            get_measure_level(),(check_aligned(invec.data) and check_aligned(outvec.data)),
-                   _scheme.mgr.state.num_threads, (invec.ptr == outvec.ptr))
+    with _plan_lock:
+        theplan, destroy = plan(len(invec), invec.dtype, outvec.dtype, FFTW_FORWARD,
+                                get_measure_level(len(invec)),(check_aligned(invec.data) and check_aligned(outvec.data)),
+                       _scheme.mgr.state.num_threads, (invec.ptr == outvec.ptr))
     execute(theplan, invec, outvec)
-    destroy(theplan)
+    with _plan_lock:
+        destroy(theplan)
 
 def ifft(invec, outvec, prec, itype, otype):
-    theplan, destroy = plan(len(outvec), invec.dtype, outvec.dtype, FFTW_BACKWARD,
-                            get_measure_level(),(check_aligned(invec.data) and check_aligned(outvec.data)),
-                   _scheme.mgr.state.num_threads, (invec.ptr == outvec.ptr))
+    with _plan_lock:
+        theplan, destroy = plan(len(outvec), invec.dtype, outvec.dtype, FFTW_BACKWARD,
+                                get_measure_level(len(outvec)),(check_aligned(invec.data) and check_aligned(outvec.data)),
+                       _scheme.mgr.state.num_threads, (invec.ptr == outvec.ptr))
     execute(theplan, invec, outvec)
-    destroy(theplan)
+    with _plan_lock:
+        destroy(theplan)
 
 # Class based API
 
@@ -381,11 +598,11 @@ plan_many_r2c_d.restype = ctypes.c_void_p
 # translate input and output dtypes into the correct planning function.
 
 _plan_funcs_dict = { ('complex64', 'complex64') : plan_many_c2c_f,
-                     ('complex64', 'float32') : plan_many_r2c_f,
-                     ('float32', 'complex64') : plan_many_c2r_f,
+                     ('float32', 'complex64') : plan_many_r2c_f,
+                     ('complex64', 'float32') : plan_many_c2r_f,
                      ('complex128', 'complex128') : plan_many_c2c_d,
-                     ('complex128', 'float64') : plan_many_r2c_d,
-                     ('float64', 'complex128') : plan_many_c2r_d }
+                     ('float64', 'complex128') : plan_many_r2c_d,
+                     ('complex128', 'float64') : plan_many_c2r_d }
 
 # To avoid multiple-inheritance, we set up a function that returns much
 # of the initialization that will need to be handled in __init__ of both
@@ -400,20 +617,24 @@ def _fftw_setup(fftobj):
         set_threads_backend()
     if nthreads != _fftw_current_nthreads:
         _fftw_plan_with_nthreads(nthreads)
-    mlvl = get_measure_level()
+    direction = FFTW_FORWARD if fftobj.forward else FFTW_BACKWARD
+    snapshot = _load_cached_wisdom(fftobj.invec.dtype, fftobj.outvec.dtype,
+                                   direction, fftobj.size, nthreads)
+    mlvl = get_measure_level(fftobj.size)
     aligned = check_aligned(fftobj.invec.data) and check_aligned(fftobj.outvec.data)
     flags = get_flag(mlvl, aligned)
     plan_func = _plan_funcs_dict[ (str(fftobj.invec.dtype), str(fftobj.outvec.dtype)) ]
     tmpin = zeros(len(fftobj.invec), dtype = fftobj.invec.dtype)
     tmpout = zeros(len(fftobj.outvec), dtype = fftobj.outvec.dtype)
+    c2c = fftobj.invec.dtype == fftobj.outvec.dtype
     # C2C, forward
-    if fftobj.forward and (fftobj.outvec.dtype in [complex64, complex128]):
+    if fftobj.forward and c2c:
         plan = plan_func(1, n.ctypes.data, fftobj.nbatch,
                          tmpin.ptr, inembed.ctypes.data, 1, fftobj.idist,
                          tmpout.ptr, onembed.ctypes.data, 1, fftobj.odist,
                          FFTW_FORWARD, flags)
     # C2C, backward
-    elif not fftobj.forward and (fftobj.invec.dtype in [complex64, complex128]):
+    elif not fftobj.forward and c2c:
         plan = plan_func(1, n.ctypes.data, fftobj.nbatch,
                          tmpin.ptr, inembed.ctypes.data, 1, fftobj.idist,
                          tmpout.ptr, onembed.ctypes.data, 1, fftobj.odist,
@@ -424,6 +645,7 @@ def _fftw_setup(fftobj):
                          tmpin.ptr, inembed.ctypes.data, 1, fftobj.idist,
                          tmpout.ptr, onembed.ctypes.data, 1, fftobj.odist,
                          flags)
+    _record_cached_wisdom(snapshot)
     del tmpin
     del tmpout
     return plan
@@ -435,7 +657,8 @@ class FFT(_BaseFFT):
         self.optr = self.outvec.ptr
         self._efunc = execute_function[str(self.invec.dtype)][str(self.outvec.dtype)]
         self._efunc.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p]
-        self.plan = _fftw_setup(self)
+        with _plan_lock:
+            self.plan = _fftw_setup(self)
 
     def execute(self):
         self._efunc(self.plan, self.iptr, self.optr)
@@ -447,7 +670,8 @@ class IFFT(_BaseIFFT):
         self.optr = self.outvec.ptr
         self._efunc = execute_function[str(self.invec.dtype)][str(self.outvec.dtype)]
         self._efunc.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p]
-        self.plan = _fftw_setup(self)
+        with _plan_lock:
+            self.plan = _fftw_setup(self)
 
     def execute(self):
         self._efunc(self.plan, self.iptr, self.optr)
@@ -463,8 +687,10 @@ def insert_fft_options(optgroup):
     """
     optgroup.add_argument("--fftw-measure-level",
                       help="Determines the measure level used in planning "
-                           "FFTW FFTs; allowed values are: " + str([0,1,2,3]),
-                      type=int, default=_default_measurelvl)
+                           "FFTW FFTs; allowed values are: " + str([0,1,2,3]) +
+                           ". Default is {0}, unless an FFT profile is "
+                           "given".format(_default_measurelvl),
+                      type=int, default=None)
     optgroup.add_argument("--fftw-threads-backend",
                       help="Give 'openmp', 'pthreads' or 'unthreaded' to specify which threaded FFTW to use",
                       default=None)
@@ -483,6 +709,13 @@ def insert_fft_options(optgroup):
     optgroup.add_argument("--fftw-import-system-wisdom",
                           help = "If given, call fftw[f]_import_system_wisdom()",
                           action = "store_true")
+    optgroup.add_argument("--fftw-wisdom-cache-dir",
+                      help="Directory of an on-disk wisdom cache that may be "
+                           "shared by many jobs. Wisdom for each transform is "
+                           "read from the cache when first planned, and any "
+                           "new wisdom is written to it on exit. Kept "
+                           "separately for each CPU model.",
+                      default=None)
 
 def verify_fft_options(opt,parser):
     """Parses the FFT options and verifies that they are
@@ -496,7 +729,7 @@ def verify_fft_options(opt,parser):
     parser : object
         OptionParser instance.
     """
-    if opt.fftw_measure_level not in [0,1,2,3]:
+    if opt.fftw_measure_level not in [None,0,1,2,3]:
         parser.error("{0} is not a valid FFTW measure level.".format(opt.fftw_measure_level))
 
     if opt.fftw_import_system_wisdom and ((opt.fftw_input_float_wisdom_file is not None)
@@ -514,4 +747,8 @@ def from_cli(opt):
     set_threads_backend(opt.fftw_threads_backend)
 
     # Set the user-provided measure level
-    set_measure_level(opt.fftw_measure_level)
+    if opt.fftw_measure_level is not None:
+        set_measure_level(opt.fftw_measure_level)
+
+    if opt.fftw_wisdom_cache_dir is not None:
+        set_wisdom_cache_dir(opt.fftw_wisdom_cache_dir)
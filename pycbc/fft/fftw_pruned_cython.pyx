@@ -16,24 +16,26 @@ def second_phase_cython(int N1, int N2, int NI,
                              numpy.ndarray[numpy.uint32_t, ndim=1] indices,
                              numpy.ndarray[numpy.complex64_t, ndim=1] out,
                              numpy.ndarray[COMPLEXTYPE, ndim=1] invec):
-    cdef float pi = 3.14159265359
+    cdef double pi = 3.14159265358979323846
     cdef int N = N1 * N2
-    cdef float sp, cp, phase_inc, n1f
+    cdef double sp, cp, phase_inc
     cdef numpy.uint32_t k, k2, n1
-    cdef COMPLEXTYPE val, twiddle_inc, twiddle
-    
+    cdef int i
+    cdef double complex val, twiddle_inc, twiddle
+
+    # The twiddle factors are accumulated in double precision, as the
+    # error of repeated single precision multiplications grows with N1
     for i in range(NI):
         val = 0 + 0j
         k = indices[i]
         k2 = k % N2
-        phase_inc = (2 * pi * k) / <float> N
+        phase_inc = (2 * pi * k) / <double> N
         sp = sin(phase_inc)
         cp = cos(phase_inc)
-        twiddle_inc = cp + cp * 1j
+        twiddle_inc = cp + sp * 1j
         twiddle = 1 + 0j
-        
+
         for n1 in range(N1):
-            n1f = <float> n1
             val += twiddle * invec[k2 + N2*n1]
             twiddle *= twiddle_inc
         out[i] = val
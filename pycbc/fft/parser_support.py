@@ -26,6 +26,8 @@ This package provides a front-end to various fast Fourier transform
 implementations within PyCBC.
 """
 
+import logging
+import functools
 from .backend_support import get_backend_modules, get_backend_names
 from .backend_support import set_backend, get_backend
 
@@ -56,6 +58,16 @@ def insert_fft_option_group(parser):
                       help="Preference list of the FFT backends. "
                            "Choices are: \n" + str(get_backend_names()),
                       nargs='*', default=[])
+    fft_group.add_argument("--fft-profile",
+                      help="Machine profile written by pycbc_fft_benchmark. "
+                           "Its recommended backend, FFTW measure level and "
+                           "number of CPU threads are used, unless given by "
+                           "--fft-backends, --fftw-measure-level or "
+                           "--processing-scheme respectively. Unless "
+                           "--fftw-measure-level is given, each FFTW "
+                           "transform size is planned at the measure level "
+                           "that was fastest for the nearest size profiled.",
+                      default=None)
 
     for backend in get_backend_modules():
         try:
@@ -82,6 +94,17 @@ def verify_fft_options(opt, parser):
             if backend not in _all_backends:
                 parser.error("Backend {0} is not available".format(backend))
 
+    if opt.fft_profile is not None:
+        from .benchmark import read_profile, profile_settings
+        try:
+            settings = profile_settings(read_profile(opt.fft_profile))
+        except (IOError, OSError, ValueError, KeyError) as e:
+            parser.error("Could not read FFT profile {0}: {1}".format(
+                         opt.fft_profile, e))
+        if settings['backend'] not in get_backend_names():
+            parser.error("Backend {0} recommended by the FFT profile is not "
+                         "available".format(settings['backend']))
+
     for backend in get_backend_modules():
         try:
             backend.verify_fft_options(opt, parser)
@@ -112,7 +135,18 @@ def from_cli(opt):
     Returns
     """
 
-    set_backend(opt.fft_backends)
+    settings = None
+    if getattr(opt, 'fft_profile', None) is not None:
+        from .benchmark import read_profile, profile_settings
+        profile = read_profile(opt.fft_profile)
+        settings = profile_settings(profile)
+
+    if settings is not None and len(opt.fft_backends) == 0:
+        logging.info("Using FFT backend %s from profile %s",
+                     settings['backend'], opt.fft_profile)
+        set_backend([settings['backend']])
+    else:
+        set_backend(opt.fft_backends)
 
     # Eventually, we need to be able to parse command lines
     # from more than just the current scheme's preference. But
@@ -126,3 +160,15 @@ def from_cli(opt):
         backend.from_cli(opt)
     except AttributeError:
         pass
+
+    if settings is not None and \
+            getattr(opt, 'fftw_measure_level', None) is None and \
+            backend.__name__ == 'pycbc.fft.fftw':
+        from .benchmark import profile_measure_level
+        if settings['measure_level'] is not None:
+            logging.info("Using FFTW measure level %s from profile %s",
+                         settings['measure_level'], opt.fft_profile)
+            backend.set_measure_level(settings['measure_level'])
+        # Plan each size at the level that was fastest for it
+        backend.set_measure_level_rule(
+            functools.partial(profile_measure_level, profile))
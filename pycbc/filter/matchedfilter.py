@@ -28,12 +28,13 @@ utilities.
 
 import logging
 from math import sqrt
-from pycbc.types import TimeSeries, FrequencySeries, zeros, Array
+from pycbc.types import TimeSeries, FrequencySeries, zeros, Array, array_pool
 from pycbc.types import complex_same_precision_as, real_same_precision_as
 from pycbc.fft import fft, ifft, IFFT
 import pycbc.scheme
 from pycbc import events
 from pycbc.events import ranking
+from pycbc.profiling import timers
 import pycbc
 import numpy
 
@@ -127,7 +128,8 @@ class MatchedFilterControl(object):
     def __init__(self, low_frequency_cutoff, high_frequency_cutoff, snr_threshold, tlen,
                  delta_f, dtype, segment_list, template_output, use_cluster,
                  downsample_factor=1, upsample_threshold=1, upsample_method='pruned_fft',
-                 gpu_callback_method='none', cluster_function='symmetric'):
+                 gpu_callback_method='none', cluster_function='symmetric',
+                 template_batch_size=1):
         """ Create a matched filter engine.
 
         Parameters
@@ -149,7 +151,12 @@ class MatchedFilterControl(object):
             only apply a threshold.
         downsample_factor : {1, int}, optional
             The factor by which to reduce the sample rate when doing a heirarchical
-            matched filter
+            matched filter. If larger than one, a coarse snr is first computed
+            from the correlation band-limited to the reduced Nyquist frequency,
+            and the full rate snr is then only computed, with a pruned inverse
+            FFT, around the coarse peaks above the lowered threshold. Must be
+            a power of two, and is only supported with 'findchirp' clustering
+            or with clustering disabled.
         upsample_threshold : {1, float}, optional
             The fraction of the snr_threshold to trigger on the subsampled filter.
         upsample_method : {pruned_fft, str}
@@ -159,6 +166,11 @@ class MatchedFilterControl(object):
             sliding forward window; if 'symmetric', each window's peak is compared
             to the windows before and after it, and only kept as a trigger if larger
             than both.
+        template_batch_size : {1, int}, optional
+            The number of templates to filter together against each segment
+            with `batched_matched_filter_and_cluster`. If larger than one,
+            `template_output` must hold `template_batch_size` contiguous
+            templates of length `tlen`. Only supported on the CPU.
         """
         # Assuming analysis time is constant across templates and segments, also
         # delta_f is constant across segments.
@@ -176,10 +188,41 @@ class MatchedFilterControl(object):
         self.cluster_function = cluster_function
         self.segments = segment_list
         self.htilde = template_output
+        self.template_batch_size = template_batch_size
+
+        if template_batch_size > 1:
+            if downsample_factor != 1:
+                raise ValueError("MatchedFilter: template batching is not "
+                                 "supported with a heirarchical search")
+            if len(template_output) != template_batch_size * tlen:
+                raise ValueError("MatchedFilter: 'template_output' must have "
+                                 "length template_batch_size * tlen")
+
+            # Each template in the batch gets its own contiguous block of
+            # the template, correlation and snr memory so that a single
+            # many-transform IFFT can be done over all of them.
+            self.use_cluster = use_cluster
+            self.corr_batch_mem = array_pool.borrow(tlen * template_batch_size,
+                                                    self.dtype)
+            self.snr_batch_mem = array_pool.borrow(tlen * template_batch_size,
+                                                   self.dtype)
+            bslices = [slice(i * tlen, (i + 1) * tlen)
+                       for i in range(template_batch_size)]
+            self.htilde_batch = [template_output[b] for b in bslices]
+            self.corr_batch = [self.corr_batch_mem[b] for b in bslices]
+            self.snr_batch = [self.snr_batch_mem[b] for b in bslices]
+            self.batch_engines = {}
+            self.batch_clusterers = {}
 
         if downsample_factor == 1:
-            self.snr_mem = zeros(self.tlen, dtype=self.dtype)
-            self.corr_mem = zeros(self.tlen, dtype=self.dtype)
+            if template_batch_size > 1:
+                # The single template methods reuse the first batch slot
+                self.htilde = self.htilde_batch[0]
+                self.snr_mem = self.snr_batch[0]
+                self.corr_mem = self.corr_batch[0]
+            else:
+                self.snr_mem = array_pool.borrow(self.tlen, self.dtype)
+                self.corr_mem = array_pool.borrow(self.tlen, self.dtype)
 
             if use_cluster and (cluster_function == 'symmetric'):
                 self.matched_filter_and_cluster = self.full_matched_filter_and_cluster_symm
@@ -211,13 +254,26 @@ class MatchedFilterControl(object):
             self.ifft = IFFT(self.corr_mem, self.snr_mem)
 
         elif downsample_factor >= 1:
+            if use_cluster and cluster_function == 'symmetric':
+                raise ValueError("MatchedFilter: the heirarchical search "
+                                 "requires 'findchirp' clustering or no "
+                                 "clustering")
+            if upsample_method != 'pruned_fft':
+                raise ValueError("Invalid upsample method")
+            if downsample_factor & (downsample_factor - 1) or \
+                    self.tlen % downsample_factor:
+                raise ValueError("MatchedFilter: 'downsample_factor' must be "
+                                 "a power of two that divides the segment "
+                                 "length")
+
             self.matched_filter_and_cluster = self.heirarchical_matched_filter_and_cluster
+            self.use_cluster = use_cluster
             self.downsample_factor = downsample_factor
             self.upsample_method = upsample_method
             self.upsample_threshold = upsample_threshold
 
             N_full = self.tlen
-            N_red = N_full / downsample_factor
+            N_red = N_full // downsample_factor
             self.kmin_full, self.kmax_full = get_cutoff_indices(self.flow,
                                               self.fhigh, self.delta_f, N_full)
 
@@ -229,10 +285,18 @@ class MatchedFilterControl(object):
             else:
                 self.kmax_red = N_red - 1
 
-            self.snr_mem = zeros(N_red, dtype=self.dtype)
-            self.corr_mem_full = FrequencySeries(zeros(N_full, dtype=self.dtype), delta_f=self.delta_f)
+            self.snr_mem = array_pool.borrow(N_red, self.dtype)
+            self.corr_mem_full = FrequencySeries(
+                array_pool.borrow(N_full, self.dtype), delta_f=self.delta_f,
+                copy=False)
             self.corr_mem = Array(self.corr_mem_full[0:N_red], copy=False)
-            self.inter_vec = zeros(N_full, dtype=self.dtype)
+            self.inter_vec = array_pool.borrow(N_full, self.dtype)
+            self.corr_transposed = array_pool.borrow(N_full, self.dtype)
+
+            # The coarse snr is the inverse FFT of the first N_red bins of
+            # the correlation, so it is sampled at every downsample_factor
+            # sample of the full rate snr
+            self.ifft = IFFT(self.corr_mem, self.snr_mem)
 
         else:
             raise ValueError("Invalid downsample factor")
@@ -269,9 +333,12 @@ class MatchedFilterControl(object):
             The snr values at the trigger locations.
         """
         norm = (4.0 * self.delta_f) / sqrt(template_norm)
-        self.correlators[segnum].correlate()
-        self.ifft.execute()
-        snrv, idx = self.threshold_and_clusterers[segnum].threshold_and_cluster(self.snr_threshold / norm, window)
+        with timers.phase('correlate'):
+            self.correlators[segnum].correlate()
+        with timers.phase('fft'):
+            self.ifft.execute()
+        with timers.phase('threshold'):
+            snrv, idx = self.threshold_and_clusterers[segnum].threshold_and_cluster(self.snr_threshold / norm, window)
 
         if len(idx) == 0:
             return [], [], [], [], []
@@ -314,11 +381,14 @@ class MatchedFilterControl(object):
             The snr values at the trigger locations.
         """
         norm = (4.0 * self.delta_f) / sqrt(template_norm)
-        self.correlators[segnum].correlate()
-        self.ifft.execute()
-        idx, snrv = events.threshold(self.snr_mem[self.segments[segnum].analyze],
-                                     self.snr_threshold / norm)
-        idx, snrv = events.cluster_reduce(idx, snrv, window)
+        with timers.phase('correlate'):
+            self.correlators[segnum].correlate()
+        with timers.phase('fft'):
+            self.ifft.execute()
+        with timers.phase('threshold'):
+            idx, snrv = events.threshold(self.snr_mem[self.segments[segnum].analyze],
+                                         self.snr_threshold / norm)
+            idx, snrv = events.cluster_reduce(idx, snrv, window)
 
         if len(idx) == 0:
             return [], [], [], [], []
@@ -362,23 +432,127 @@ class MatchedFilterControl(object):
             The snr values at the trigger locations.
         """
         norm = (4.0 * self.delta_f) / sqrt(template_norm)
-        self.correlators[segnum].correlate()
-        self.ifft.execute()
-        idx, snrv = events.threshold_only(self.snr_mem[self.segments[segnum].analyze],
-                                          self.snr_threshold / norm)
+        with timers.phase('correlate'):
+            self.correlators[segnum].correlate()
+        with timers.phase('fft'):
+            self.ifft.execute()
+        with timers.phase('threshold'):
+            idx, snrv = events.threshold_only(self.snr_mem[self.segments[segnum].analyze],
+                                              self.snr_threshold / norm)
         logging.info("%s points above threshold" % str(len(idx)))
 
         snr = TimeSeries(self.snr_mem, epoch=epoch, delta_t=self.delta_t, copy=False)
         corr = FrequencySeries(self.corr_mem, delta_f=self.delta_f, copy=False)
         return snr, norm, corr, idx, snrv
 
-    def heirarchical_matched_filter_and_cluster(self, segnum, template_norm, window):
+    def _get_batch_engine(self, nbatch):
+        """ Return the batch correlator and many-transform IFFT that act on
+        the first `nbatch` templates of the batch memory. These are created
+        on first use, so that only the full batch size and the final
+        partial batch cost a plan.
+        """
+        if nbatch not in self.batch_engines:
+            corr_slice = slice(self.kmin, self.kmax)
+            corr = BatchCorrelator([h[corr_slice] for h in self.htilde_batch[:nbatch]],
+                                   [c[corr_slice] for c in self.corr_batch[:nbatch]],
+                                   self.kmax - self.kmin)
+            blen = nbatch * self.tlen
+            ifft = IFFT(self.corr_batch_mem[0:blen], self.snr_batch_mem[0:blen],
+                        nbatch=nbatch, size=self.tlen)
+            self.batch_engines[nbatch] = (corr, ifft)
+        return self.batch_engines[nbatch]
+
+    def batched_matched_filter_and_cluster(self, segnum, template_norms, window,
+                                           epoch=None):
+        """ Filter a batch of templates against a single segment.
+
+        The templates must already be stored in the first
+        `len(template_norms)` slots of the batch template memory (see
+        `htilde_batch`). All of them are correlated against the segment in a
+        single pass and transformed with a single many-transform IFFT, after
+        which each is thresholded and clustered on its own.
+
+        Parameters
+        ----------
+        segnum : int
+            Index into the list of segments at MatchedFilterControl construction
+            against which to filter.
+        template_norms : list of floats
+            The htilde, template normalization factor of each template in the
+            batch.
+        window : int or list of ints
+            Size of the window over which to cluster triggers, in samples.
+            If a list, one window per template in the batch.
+
+        Returns
+        -------
+        results : list of tuples
+            For each template in the batch, the tuple of
+            (snr, norm, correlation, idx, snrv) that would be returned by
+            `matched_filter_and_cluster` for that template alone.
+        """
+        nbatch = len(template_norms)
+        if nbatch > self.template_batch_size:
+            raise ValueError("Batch of %s templates is larger than the "
+                             "template batch size %s" %
+                             (nbatch, self.template_batch_size))
+        if not hasattr(window, '__len__'):
+            window = [window] * nbatch
+
+        corr, ifft = self._get_batch_engine(nbatch)
+        with timers.phase('correlate'):
+            corr.execute(self.segments[segnum][self.kmin:self.kmax])
+        with timers.phase('fft'):
+            ifft.execute()
+
+        analyze = self.segments[segnum].analyze
+        results = []
+        for i in range(nbatch):
+            norm = (4.0 * self.delta_f) / sqrt(template_norms[i])
+            snr_mem = self.snr_batch[i]
+            with timers.phase('threshold'):
+                if self.use_cluster and self.cluster_function == 'symmetric':
+                    key = (i, analyze.start, analyze.stop)
+                    if key not in self.batch_clusterers:
+                        self.batch_clusterers[key] = \
+                            events.ThresholdCluster(snr_mem[analyze])
+                    snrv, idx = self.batch_clusterers[key].threshold_and_cluster(
+                        self.snr_threshold / norm, window[i])
+                    # The clustering output memory is reused between calls
+                    idx, snrv = idx.copy(), snrv.copy()
+                elif self.use_cluster:
+                    idx, snrv = events.threshold(snr_mem[analyze],
+                                                 self.snr_threshold / norm)
+                    idx, snrv = events.cluster_reduce(idx, snrv, window[i])
+                else:
+                    idx, snrv = events.threshold_only(snr_mem[analyze],
+                                                      self.snr_threshold / norm)
+                    # The thresholding output memory is reused between calls
+                    idx, snrv = idx.copy(), snrv.copy()
+
+            if len(idx) == 0:
+                results.append(([], [], [], [], []))
+                continue
+
+            logging.info("%s points above threshold" % str(len(idx)))
+
+            snr = TimeSeries(snr_mem, epoch=epoch, delta_t=self.delta_t,
+                             copy=False)
+            corr = FrequencySeries(self.corr_batch[i], delta_f=self.delta_f,
+                                   copy=False)
+            results.append((snr, norm, corr, idx, snrv))
+        return results
+
+    def heirarchical_matched_filter_and_cluster(self, segnum, template_norm, window, epoch=None):
         """ Returns the complex snr timeseries, normalization of the complex snr,
         the correlation vector frequency series, the list of indices of the
         triggers, and the snr values at the trigger locations. Returns empty
         lists for these for points that are not above the threshold.
 
-        Calculated the matched filter, threshold, and cluster.
+        Calculated the matched filter, threshold, and cluster. The snr is first
+        calculated at the reduced sample rate, and the full rate snr is then
+        only calculated within a reduced rate sample of the points above the
+        lowered threshold.
 
         Parameters
         ----------
@@ -396,7 +570,7 @@ class MatchedFilterControl(object):
         norm : float
             The normalization of the complex snr.
         corrrelation: FrequencySeries
-            A frequency series containing the correlation vector.
+            A frequency series containing the full rate correlation vector.
         idx : Array
             List of indices of the triggers.
         snrv : Array
@@ -405,6 +579,7 @@ class MatchedFilterControl(object):
         from pycbc.fft.fftw_pruned import pruned_c2cifft, fft_transpose
         htilde = self.htilde
         stilde = self.segments[segnum]
+        factor = self.downsample_factor
 
         norm = (4.0 * stilde.delta_f) / sqrt(template_norm)
 
@@ -412,61 +587,51 @@ class MatchedFilterControl(object):
                   stilde[self.kmin_red:self.kmax_red],
                   self.corr_mem[self.kmin_red:self.kmax_red])
 
-        ifft(self.corr_mem, self.snr_mem)
-
-        if not hasattr(stilde, 'red_analyze'):
-            stilde.red_analyze = \
-                             slice(stilde.analyze.start/self.downsample_factor,
-                                   stilde.analyze.stop/self.downsample_factor)
-
+        self.ifft.execute()
 
-        idx_red, snrv_red = events.threshold(self.snr_mem[stilde.red_analyze],
+        red_analyze = slice(stilde.analyze.start // factor,
+                            stilde.analyze.stop // factor)
+        idx_red, snrv_red = events.threshold(self.snr_mem[red_analyze],
                                 self.snr_threshold / norm * self.upsample_threshold)
         if len(idx_red) == 0:
-            return [], None, [], [], []
+            return [], [], [], [], []
 
-        idx_red, _ = events.cluster_reduce(idx_red, snrv_red, window / self.downsample_factor)
+        if self.use_cluster:
+            idx_red, _ = events.cluster_reduce(idx_red, snrv_red,
+                                               max(window // factor, 1))
         logging.info("%s points above threshold at reduced resolution"\
                       %(str(len(idx_red)),))
 
-        # The fancy upsampling is here
-        if self.upsample_method=='pruned_fft':
-            idx = (idx_red + stilde.analyze.start/self.downsample_factor)\
-                   * self.downsample_factor
-
-            idx = smear(idx, self.downsample_factor)
-
-            # cache transposed  versions of htilde and stilde
-            if not hasattr(self.corr_mem_full, 'transposed'):
-                self.corr_mem_full.transposed = zeros(len(self.corr_mem_full), dtype=self.dtype)
-
-            if not hasattr(htilde, 'transposed'):
-                htilde.transposed = zeros(len(self.corr_mem_full), dtype=self.dtype)
-                htilde.transposed[self.kmin_full:self.kmax_full] = htilde[self.kmin_full:self.kmax_full]
-                htilde.transposed = fft_transpose(htilde.transposed)
-
-            if not hasattr(stilde, 'transposed'):
-                stilde.transposed = zeros(len(self.corr_mem_full), dtype=self.dtype)
-                stilde.transposed[self.kmin_full:self.kmax_full] = stilde[self.kmin_full:self.kmax_full]
-                stilde.transposed = fft_transpose(stilde.transposed)
-
-            correlate(htilde.transposed, stilde.transposed, self.corr_mem_full.transposed)
-            snrv = pruned_c2cifft(self.corr_mem_full.transposed, self.inter_vec, idx, pretransposed=True)
-            idx = idx - stilde.analyze.start
-            idx2, snrv = events.threshold(Array(snrv, copy=False), self.snr_threshold / norm)
-
-            if len(idx2) > 0:
-                correlate(htilde[self.kmax_red:self.kmax_full],
-                          stilde[self.kmax_red:self.kmax_full],
-                          self.corr_mem_full[self.kmax_red:self.kmax_full])
-                idx, snrv = events.cluster_reduce(idx[idx2], snrv, window)
-            else:
-                idx, snrv = [], []
+        # The full rate peak lies within half a reduced rate sample of the
+        # coarse peak, so only calculate the snr at those points
+        idx = (idx_red.astype(numpy.int64) + red_analyze.start) * factor
+        idx = smear(idx, factor)
+        idx = idx[(idx >= stilde.analyze.start) & (idx < stilde.analyze.stop)]
+
+        # Complete the full rate correlation above the reduced Nyquist
+        # frequency, and transpose it for the pruned inverse FFT
+        correlate(htilde[self.kmax_red:self.kmax_full],
+                  stilde[self.kmax_red:self.kmax_full],
+                  self.corr_mem_full[self.kmax_red:self.kmax_full])
+        fft_transpose(self.corr_mem_full, outvec=self.corr_transposed)
+        snrv = pruned_c2cifft(self.corr_transposed, self.inter_vec, idx,
+                              pretransposed=True)
+        idx = idx - stilde.analyze.start
+
+        idx2, snrv = events.threshold(Array(snrv, copy=False),
+                                      self.snr_threshold / norm)
+        if len(idx2) == 0:
+            return [], [], [], [], []
 
-            logging.info("%s points at full rate and clustering" % len(idx))
-            return self.snr_mem, norm, self.corr_mem_full, idx, snrv
+        if self.use_cluster:
+            idx, snrv = events.cluster_reduce(idx[idx2], snrv, window)
         else:
-            raise ValueError("Invalid upsample method")
+            idx, snrv = idx[idx2], snrv.copy()
+
+        logging.info("%s points at full rate and clustering" % len(idx))
+        snr = TimeSeries(self.snr_mem, epoch=epoch,
+                         delta_t=self.delta_t * factor, copy=False)
+        return snr, norm, self.corr_mem_full, idx, snrv
 
 
 def compute_max_snr_over_sky_loc_stat(hplus, hcross, hphccorr,
@@ -848,11 +1013,11 @@ class MatchedFilterSkyMaxControl(object):
 
         self.matched_filter_and_cluster = \
                                     self.full_matched_filter_and_cluster
-        self.snr_plus_mem = zeros(self.tlen, dtype=self.dtype)
-        self.corr_plus_mem = zeros(self.tlen, dtype=self.dtype)
-        self.snr_cross_mem = zeros(self.tlen, dtype=self.dtype)
-        self.corr_cross_mem = zeros(self.tlen, dtype=self.dtype)
-        self.snr_mem = zeros(self.tlen, dtype=self.dtype)
+        self.snr_plus_mem = array_pool.borrow(self.tlen, self.dtype)
+        self.corr_plus_mem = array_pool.borrow(self.tlen, self.dtype)
+        self.snr_cross_mem = array_pool.borrow(self.tlen, self.dtype)
+        self.corr_cross_mem = array_pool.borrow(self.tlen, self.dtype)
+        self.snr_mem = array_pool.borrow(self.tlen, self.dtype)
         self.cached_hplus_hcross_correlation = None
         self.cached_hplus_hcross_hplus = None
         self.cached_hplus_hcross_hcross = None
@@ -1274,10 +1439,182 @@ def smear(idx, factor):
 
     s = [idx]
     for i in range(factor+1):
-        a = i - factor/2
+        a = i - factor // 2
         s += [idx + a]
     return numpy.unique(numpy.concatenate(s))
 
+def _ifft_window_costs(N, nfreq, length, pruned):
+    """ Approximate operation counts of the methods of ifft_window.
+    """
+    costs = {'fft': 5.0 * N * numpy.log2(N),
+             'direct': 8.0 * nfreq * length}
+    if pruned:
+        N2 = 2 ** int(numpy.log2(N) / 2)
+        N1 = N // N2
+        costs['pruned'] = 5.0 * N * numpy.log2(N2) + N + 8.0 * N1 * length
+    return costs
+
+def ifft_window(qtilde, start, length, kmin=0, kmax=None, method='auto'):
+    """ Return consecutive samples of the complex inverse FFT of a vector.
+
+    Only the samples ``start`` to ``start + length`` (modulo the length of
+    the vector) of the inverse FFT are computed. Depending on the method,
+    this is done by the full inverse FFT, by the pruned inverse FFT, or
+    by the direct inner product of the vector with the Fourier phases of each
+    sample, which needs no transform or memory of the full length.
+
+    Parameters
+    ----------
+    qtilde : Array
+        The complex vector to inverse transform, e.g. the correlation vector
+        returned by matched_filter_core.
+    start : int
+        The index of the first sample to compute.
+    length : int
+        The number of samples to compute.
+    kmin : {0, int}, optional
+        Only transform the elements of qtilde from this index, treating the
+        others as zero.
+    kmax : {None, int}, optional
+        Only transform the elements of qtilde up to this index. If None, the
+        length of qtilde.
+    method : {'auto', 'fft', 'pruned', 'direct'}
+        How to compute the samples. If 'auto', the method with the fewest
+        operations is chosen. The 'pruned' method is only available for
+        single precision, power of two length vectors with the CPU scheme.
+
+    Returns
+    -------
+    q : numpy.ndarray
+        The complex samples of the inverse FFT.
+    """
+    N = len(qtilde)
+    if kmax is None:
+        kmax = N
+    if length < 1 or length > N:
+        raise ValueError("The window length must be between 1 and the length "
+                         "of the vector")
+
+    pruned = qtilde.dtype == numpy.complex64 and not N & (N - 1) and \
+        isinstance(pycbc.scheme.mgr.state, pycbc.scheme.CPUScheme)
+    if method == 'auto':
+        costs = _ifft_window_costs(N, kmax - kmin, length, pruned)
+        method = min(costs, key=costs.get)
+    elif method == 'pruned' and not pruned:
+        raise ValueError("The pruned inverse FFT requires a single precision, "
+                         "power of two length vector and the CPU scheme")
+    elif method not in ['fft', 'direct', 'pruned']:
+        raise ValueError("Unknown method %s" % method)
+
+    idx = numpy.arange(start, start + length) % N
+    if method in ['fft', 'pruned']:
+        if kmin > 0 or kmax < N:
+            vec = zeros(N, dtype=qtilde.dtype)
+            vec[kmin:kmax] = qtilde[kmin:kmax]
+            qtilde = vec
+        q = zeros(N, dtype=qtilde.dtype)
+        if method == 'fft':
+            ifft(qtilde, q)
+            return q.numpy()[idx]
+        from pycbc.fft.fftw_pruned import pruned_c2cifft
+        return pruned_c2cifft(qtilde, q, idx)
+
+    # Multiply the vector by the matrix of Fourier phases of the window
+    # samples, taking the phase indices modulo N so the phases are exact.
+    # The rows are done a block at a time to bound the memory of the matrix.
+    k = numpy.arange(kmin, kmax)
+    v = qtilde.numpy()[kmin:kmax].astype(numpy.complex128)
+    block = max(1, 2 ** 22 // max(len(k), 1))
+    q = numpy.zeros(length, dtype=numpy.complex128)
+    for i in range(0, length, block):
+        phases = numpy.outer(idx[i:i + block], k) % N
+        q[i:i + block] = numpy.dot(numpy.exp(2j * numpy.pi / N * phases), v)
+    return q.astype(qtilde.dtype)
+
+def matched_filter_window_core(template, data, start, length, psd=None,
+                               low_frequency_cutoff=None,
+                               high_frequency_cutoff=None, h_norm=None,
+                               corr_out=None, method='auto'):
+    """ Return a window of the complex snr and its normalization.
+
+    This is the same as matched_filter_core, but only the samples ``start``
+    to ``start + length`` of the snr time series are computed, using
+    ifft_window.
+
+    Parameters
+    ----------
+    template : TimeSeries or FrequencySeries
+        The template waveform
+    data : TimeSeries or FrequencySeries
+        The strain data to be filtered.
+    start : int
+        The index in the full snr time series of the first sample to compute.
+    length : int
+        The number of snr samples to compute.
+    psd : {FrequencySeries}, optional
+        The noise weighting of the filter.
+    low_frequency_cutoff : {None, float}, optional
+        The frequency to begin the filter calculation. If None, begin at the
+        first frequency after DC.
+    high_frequency_cutoff : {None, float}, optional
+        The frequency to stop the filter calculation. If None, continue to the
+        the nyquist frequency.
+    h_norm : {None, float}, optional
+        The template normalization. If none, this value is calculated internally.
+    corr_out : {None, Array}, optional
+        An array to use as memory for correlation storage. If None, memory is
+        allocated internally. No zero'ing is done internally.
+    method : {'auto', 'fft', 'pruned', 'direct'}
+        How to compute the snr samples, see ifft_window.
+
+    Returns
+    -------
+    snr : TimeSeries
+        A time series containing the requested samples of the complex snr.
+    corrrelation: FrequencySeries
+        A frequency series containing the correlation vector.
+    norm : float
+        The normalization of the complex snr.
+    """
+    htilde = make_frequency_series(template)
+    stilde = make_frequency_series(data)
+
+    if len(htilde) != len(stilde):
+        raise ValueError("Length of template and data must match")
+
+    N = (len(stilde)-1) * 2
+    kmin, kmax = get_cutoff_indices(low_frequency_cutoff,
+                                   high_frequency_cutoff, stilde.delta_f, N)
+
+    if corr_out is not None:
+        qtilde = corr_out
+    else:
+        qtilde = zeros(N, dtype=complex_same_precision_as(data))
+
+    correlate(htilde[kmin:kmax], stilde[kmin:kmax], qtilde[kmin:kmax])
+
+    if psd is not None:
+        if isinstance(psd, FrequencySeries):
+            try:
+                numpy.testing.assert_almost_equal(stilde.delta_f, psd.delta_f)
+            except AssertionError:
+                raise ValueError("PSD delta_f does not match data")
+            qtilde[kmin:kmax] /= psd[kmin:kmax]
+        else:
+            raise TypeError("PSD must be a FrequencySeries")
+
+    q = ifft_window(qtilde, start, length, kmin, kmax, method=method)
+
+    if h_norm is None:
+        h_norm = sigmasq(htilde, psd, low_frequency_cutoff, high_frequency_cutoff)
+
+    norm = (4.0 * stilde.delta_f) / sqrt( h_norm)
+
+    return (TimeSeries(q, epoch=stilde.start_time + start * stilde.delta_t,
+                       delta_t=stilde.delta_t, copy=False),
+            FrequencySeries(qtilde, epoch=stilde._epoch, delta_f=stilde.delta_f, copy=False),
+            norm)
+
 def matched_filter(template, data, psd=None, low_frequency_cutoff=None,
                   high_frequency_cutoff=None, sigmasq=None):
     """ Return the complex snr.
@@ -1468,7 +1805,8 @@ class LiveBatchMatchedFilter(object):
                  maxelements=2**27,
                  snr_abort_threshold=None,
                  newsnr_threshold=None,
-                 max_triggers_in_batch=None):
+                 max_triggers_in_batch=None,
+                 compact_templates=False):
         """Create a batched matchedfilter instance
 
         Parameters
@@ -1493,11 +1831,17 @@ class LiveBatchMatchedFilter(object):
             Record X number of the loudest triggers by newsnr in each mpi
         process group. Signal consistency values will also only be calculated
         for these triggers.
+        compact_templates: {False, bool}
+            If True, keep the templates only in the band-limited, reduced
+        precision form of `pycbc.waveform.compress.QuantizedWaveform`, and
+        expand each into working memory when it is filtered. The templates
+        given are modified to use this working memory. CPU only.
         """
         self.snr_threshold = snr_threshold
         self.snr_abort_threshold = snr_abort_threshold
         self.newsnr_threshold = newsnr_threshold
         self.max_triggers_in_batch = max_triggers_in_batch
+        self.compact_templates = compact_templates
 
         from pycbc import vetoes
         self.power_chisq = vetoes.SingleDetPowerChisq(chisq_bins, None)
@@ -1564,7 +1908,46 @@ class LiveBatchMatchedFilter(object):
                 htilde.cout = self.cout_mem[mid][s:e]
                 s += psize
                 e += psize
-            self.corr.append(BatchCorrelator(tgroup, [t.cout for t in tgroup], len(tgroup[0])))
+
+            if compact_templates:
+                # The templates are expanded into their correlation memory
+                # and correlated in place
+                self.corr.append(BatchCorrelator([t.cout for t in tgroup],
+                                                 [t.cout for t in tgroup],
+                                                 len(tgroup[0])))
+            else:
+                self.corr.append(BatchCorrelator(tgroup, [t.cout for t in tgroup], len(tgroup[0])))
+
+        if compact_templates:
+            self._compact_templates()
+
+    def _compact_templates(self):
+        """Replace the template memory by the compact form of each template
+        and a working memory shared by all templates of the same length.
+        """
+        from pycbc.waveform.bank import cache_sigma_view
+        from pycbc.waveform import waveform_norm_exists
+        from pycbc.waveform.compress import QuantizedWaveform
+
+        self.template_work_mem = {}
+        full_nbytes = compact_nbytes = 0
+        for tgroup in self.tgroups:
+            for htilde in tgroup:
+                # sigmasq only needs the template itself the first time
+                if not waveform_norm_exists(htilde.approximant):
+                    cache_sigma_view(htilde)
+                htilde.compact = QuantizedWaveform(htilde)
+                full_nbytes += htilde.nbytes
+                compact_nbytes += htilde.compact.nbytes
+
+                flen = len(htilde)
+                if flen not in self.template_work_mem:
+                    self.template_work_mem[flen] = zeros(flen,
+                                                         dtype=htilde.dtype)
+                htilde._data = self.template_work_mem[flen].data
+
+        logging.info("Compacted templates from %.1f MB to %.1f MB",
+                     full_nbytes / 1024.0 ** 2, compact_nbytes / 1024.0 ** 2)
 
     def set_data(self, data):
         """Set the data reader object to use"""
@@ -1619,6 +2002,8 @@ class LiveBatchMatchedFilter(object):
 
         keep = []
         for i, (snrv, norm, l, htilde, stilde) in enumerate(veto_info):
+            if self.compact_templates:
+                htilde.compact.expand(htilde)
             correlate(htilde, stilde, htilde.cout)
             c, d = self.power_chisq.values(htilde.cout, snrv,
                                            norm, stilde.psd, [l], htilde)
@@ -1658,6 +2043,10 @@ class LiveBatchMatchedFilter(object):
 
         seg = slice(valid_start, valid_end)
 
+        if self.compact_templates:
+            for htilde in tgroup:
+                htilde.compact.expand(htilde.cout)
+
         self.corr[self.block_id].execute(stilde)
         self.ifts[mid].execute()
 
@@ -1822,7 +2211,7 @@ def followup_event_significance(ifo, data_reader, bank,
 
 def compute_followup_snr_series(data_reader, htilde, trig_time,
                                 duration=0.095, check_state=True,
-                                coinc_window=0.05):
+                                coinc_window=0.05, method='auto'):
     """Given a StrainBuffer, a template frequency series and a trigger time,
     compute a portion of the SNR time series centered on the trigger for its
     rapid sky localization and followup.
@@ -1855,6 +2244,9 @@ def compute_followup_snr_series(data_reader, htilde, trig_time,
         Maximum possible time between coincident triggers at different
         detectors. This is needed to properly determine data padding.
 
+    method : {'auto', 'fft', 'pruned', 'direct'}
+        How to compute the SNR series, see ifft_window.
+
     Returns
     -------
     snr : TimeSeries
@@ -1879,30 +2271,34 @@ def compute_followup_snr_series(data_reader, htilde, trig_time,
                 return None
 
     stilde = data_reader.overwhitened_data(htilde.delta_f)
-    snr, _, norm = matched_filter_core(htilde, stilde,
-                                          h_norm=htilde.sigmasq(stilde.psd))
+    snr_len = (len(stilde) - 1) * 2
+    sample_rate = stilde.sample_rate
 
-    valid_end = int(len(snr) - data_reader.trim_padding)
-    valid_start = int(valid_end - data_reader.blocksize * snr.sample_rate)
+    valid_end = int(snr_len - data_reader.trim_padding)
+    valid_start = int(valid_end - data_reader.blocksize * sample_rate)
 
-    half_dur_samples = int(snr.sample_rate * duration / 2)
-    coinc_samples = int(snr.sample_rate * coinc_window)
+    half_dur_samples = int(sample_rate * duration / 2)
+    coinc_samples = int(sample_rate * coinc_window)
     valid_start -= half_dur_samples + coinc_samples
     valid_end += half_dur_samples
-    if valid_start < 0 or valid_end > len(snr)-1:
+    if valid_start < 0 or valid_end > snr_len-1:
         raise ValueError(('Requested SNR duration ({0} s)'
                           ' too long').format(duration))
 
-    # Onsource slice for Bayestar followup
-    onsource_idx = float(trig_time - snr.start_time) * snr.sample_rate
+    # Onsource window for Bayestar followup, only this part of the SNR
+    # time series is computed
+    onsource_idx = float(trig_time - stilde.start_time) * sample_rate
     onsource_idx = int(round(onsource_idx))
-    onsource_slice = slice(onsource_idx - half_dur_samples,
-                           onsource_idx + half_dur_samples + 1)
-    return snr[onsource_slice] * norm
+    snr, _, norm = matched_filter_window_core(
+            htilde, stilde, onsource_idx - half_dur_samples,
+            2 * half_dur_samples + 1, h_norm=htilde.sigmasq(stilde.psd),
+            method=method)
+    return snr * norm
 
 __all__ = ['match', 'matched_filter', 'sigmasq', 'sigma', 'get_cutoff_indices',
            'sigmasq_series', 'make_frequency_series', 'overlap',
            'overlap_cplx', 'matched_filter_core', 'correlate',
+           'matched_filter_window_core', 'ifft_window',
            'MatchedFilterControl', 'LiveBatchMatchedFilter',
            'MatchedFilterSkyMaxControl', 'MatchedFilterSkyMaxControlNoPhase',
            'compute_max_snr_over_sky_loc_stat_no_phase',
@@ -32,21 +32,25 @@ ctypedef fused COMPLEXTYPE:
     float complex
     double complex
 
+@cython.boundscheck(False)
+@cython.wraparound(False)
 def _batch_correlate(numpy.ndarray [long, ndim=1] x,
                      numpy.ndarray [float complex, ndim=1] y,
                      numpy.ndarray [long, ndim=1] z,
                      size, num_vectors):
     cdef unsigned int nvec = num_vectors
     cdef unsigned int vsize = size
+    cdef unsigned int i, j
 
     cdef float complex* xp
     cdef float complex* zp
+    cdef float complex* yp = &y[0]
 
     for i in range(nvec):
         xp = <float complex*> x[i]
         zp = <float complex*> z[i]
-        for j in range(vsize):
-            zp[j] = xp[j].conjugate() * y[j]
+        for j in prange(vsize, nogil=True):
+            zp[j] = xp[j].conjugate() * yp[j]
 
 def batch_correlate_execute(self, y):
     num_vectors = self.num_vectors # pylint:disable=unused-variable
@@ -1024,6 +1024,59 @@ class ReadByTemplate(object):
                 self.segs = (self.segs - gating_veto_segs).coalesce()
         self.valid = veto.segments_to_start_end(self.segs)
 
+        # Files written with an index of where the triggers of each template
+        # end can be read by contiguous slices, older ones through the
+        # region references
+        key = '%s/template_end_boundaries' % self.ifo
+        if key in self.file:
+            self.starts = self.file['%s/template_boundaries' % self.ifo][:]
+            self.ends = self.file[key][:]
+        else:
+            self.starts = self.ends = None
+        self.columns = {}
+
+    def column(self, col):
+        """ Return a column of triggers for all templates, to be sliced.
+        Columns stored uncompressed and contiguous are memory-mapped.
+
+        Parameters
+        ----------
+        col: str
+            Name of column to read
+
+        Returns
+        -------
+        data: h5py.Dataset or numpy.memmap
+            The requested column of data
+        """
+        if col not in self.columns:
+            dset = self.file['%s/%s' % (self.ifo, col)]
+            offset = dset.id.get_offset()
+            if dset.chunks is None and offset is not None:
+                dset = np.memmap(self.filename, mode='r', dtype=dset.dtype,
+                                 offset=offset, shape=dset.shape)
+            self.columns[col] = dset
+        return self.columns[col]
+
+    def template_slice(self, num):
+        """ Return the slice of the trigger columns holding the triggers of
+        template with id 'num'
+
+        Parameters
+        ----------
+        num: int
+            The template id to read triggers for
+
+        Returns
+        -------
+        tslice: slice or None
+            The indices of this templates triggers, or None if the file has
+            no index of template end boundaries
+        """
+        if self.ends is None:
+            return None
+        return slice(self.starts[num], self.ends[num])
+
     def get_data(self, col, num):
         """ Get a column of data for template with id 'num'
 
@@ -1039,8 +1092,11 @@ class ReadByTemplate(object):
         data: numpy.ndarray
             The requested column of data
         """
-        ref = self.file['%s/%s_template' % (self.ifo, col)][num]
-        return self.file['%s/%s' % (self.ifo, col)][ref]
+        tslice = self.template_slice(num)
+        if tslice is None:
+            ref = self.file['%s/%s_template' % (self.ifo, col)][num]
+            return self.file['%s/%s' % (self.ifo, col)][ref]
+        return np.asarray(self.column(col)[tslice])
 
     def set_template(self, num):
         """ Set the active template to read from
@@ -1078,8 +1134,11 @@ class ReadByTemplate(object):
         # Calculate the trigger id by adding the relative offset in self.keep
         # to the absolute beginning index of this templates triggers stored
         # in 'template_boundaries'
-        trigger_id = self.keep + \
-                         self.file['%s/template_boundaries' % self.ifo][num]
+        if self.starts is None:
+            start = self.file['%s/template_boundaries' % self.ifo][num]
+        else:
+            start = self.starts[num]
+        trigger_id = self.keep + start
         return trigger_id
 
     def __getitem__(self, col):
@@ -1103,6 +1162,13 @@ class ReadByTemplate(object):
         data = data[self.keep] if self.valid else data
         return data
 
+    def close(self):
+        """ Close the trigger and bank files """
+        self.columns = {}
+        self.file.close()
+        if self.bank != {}:
+            self.bank.close()
+
 
 chisq_choices = ['traditional', 'cont', 'bank', 'max_cont_trad', 'sg',
                  'max_bank_cont', 'max_bank_trad', 'max_bank_cont_trad']
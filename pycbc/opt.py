@@ -20,6 +20,7 @@ other modules and packages may use in addition to some optimized utilities.
 """
 import os, sys
 import logging
+import contextlib
 from collections import OrderedDict
 
 # Work around different Python versions to get runtime
@@ -65,6 +66,26 @@ elif HAVE_GETCONF:
     LEVEL3_CACHE_LINESIZE = getconf('LEVEL3_CACHE_LINESIZE')
 
 
+def cpu_model():
+    """ Return a string identifying the model of CPU we are running on,
+    suitable for use in a file name. This is the 'model name' from
+    /proc/cpuinfo where available, and the platform processor otherwise.
+    """
+    import platform, re
+    model = None
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    model = line.split(':', 1)[1]
+                    break
+    except (IOError, OSError):
+        pass
+    if not model:
+        model = platform.processor() or platform.machine() or 'unknown'
+    return re.sub('[^A-Za-z0-9.]+', '_', model.strip()).strip('_')
+
+
 def insert_optimization_option_group(parser):
     """
     Adds the options used to specify optimization-specific options.
@@ -149,3 +170,17 @@ class LimitedSizeDict(OrderedDict):
         if self.size_limit is not None:
             while len(self) > self.size_limit:
                 self.popitem(last=False)
+
+@contextlib.contextmanager
+def file_lock(filename):
+    """ Hold an exclusive lock on filename while in the block, so that jobs
+    sharing a cache file update it one at a time. The lock is taken on a
+    separate file, filename + '.lock', as the file itself may be replaced.
+    """
+    import fcntl
+    with open(filename + '.lock', 'a') as lockf:
+        fcntl.flock(lockf, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lockf, fcntl.LOCK_UN)
@@ -0,0 +1,153 @@
+"""
+This module provides a registry of the time spent in each phase of an
+analysis, such as template generation, correlation, FFTs and vetoes, and of
+event counters. It is off by default, in which case timing a phase costs one
+attribute lookup and two empty method calls.
+
+The phases are timed with
+
+>>> from pycbc.profiling import timers
+>>> with timers.phase('correlate'):
+...     corr.correlate()
+
+and the breakdown can be logged, written to the output file of a job, and
+combined across jobs with pycbc_profile_summary.
+"""
+import time
+import logging
+import threading
+import functools
+import numpy
+
+
+class _NullPhase(object):
+    """ Context manager used when the timers are off """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+class _Phase(object):
+    """ Context manager adding the time spent in its block to a phase """
+    __slots__ = ('timers', 'name', 'start')
+
+    def __init__(self, timers, name):
+        self.timers = timers
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.timers.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+_null_phase = _NullPhase()
+
+
+class PhaseTimers(object):
+    """ Registry of the time spent in named phases, and of named counters.
+
+    Times are summed over the threads that run a phase, so phases run
+    concurrently may add up to more than the wall time.
+    """
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self.reset()
+
+    def enable(self, enabled=True):
+        """ Turn the timers on or off """
+        self.enabled = enabled
+
+    def reset(self):
+        """ Forget all times and counts """
+        with self._lock:
+            self.times = {}
+            self.calls = {}
+            self.counters = {}
+
+    def phase(self, name):
+        """ Return a context manager timing its block as the named phase """
+        if not self.enabled:
+            return _null_phase
+        return _Phase(self, name)
+
+    def timed(self, name):
+        """ Decorator timing each call of a function as the named phase """
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwds):
+                with self.phase(name):
+                    return fn(*args, **kwds)
+            return wrapper
+        return decorator
+
+    def add_time(self, name, seconds):
+        """ Add a time, in seconds, to the named phase """
+        with self._lock:
+            self.times[name] = self.times.get(name, 0.) + seconds
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def count(self, name, num=1):
+        """ Add to the named counter, if the timers are on """
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + num
+
+    def report(self):
+        """ Log the time spent in each phase and the counters """
+        for name in sorted(self.times, key=self.times.get, reverse=True):
+            logging.info("Phase %s: %.3f s in %s calls", name,
+                         self.times[name], self.calls[name])
+        for name in sorted(self.counters):
+            logging.info("Counter %s: %s", name, self.counters[name])
+
+    def write(self, f, prefix):
+        """ Write the times, calls and counters to an open HDF file, under
+        the group prefix.
+        """
+        names = sorted(self.times)
+        f[prefix + '/phases'] = numpy.array(names, dtype='S')
+        f[prefix + '/phase_time'] = numpy.array([self.times[n] for n in names],
+                                                dtype=numpy.float64)
+        f[prefix + '/phase_calls'] = numpy.array([self.calls[n]
+                                                  for n in names],
+                                                 dtype=numpy.int64)
+        names = sorted(self.counters)
+        f[prefix + '/counters'] = numpy.array(names, dtype='S')
+        f[prefix + '/counter_values'] = numpy.array([self.counters[n]
+                                                     for n in names],
+                                                    dtype=numpy.int64)
+
+
+def read_profile(f, prefix):
+    """ Read the times, calls and counters written by `PhaseTimers.write`.
+
+    Returns
+    -------
+    times : dict
+        The time spent in each phase.
+    calls : dict
+        The number of times each phase was entered.
+    counters : dict
+        The value of each counter.
+    """
+    phases = f[prefix + '/phases'][:].astype(str)
+    times = dict(zip(phases, f[prefix + '/phase_time'][:]))
+    calls = dict(zip(phases, f[prefix + '/phase_calls'][:]))
+    counters = dict(zip(f[prefix + '/counters'][:].astype(str),
+                        f[prefix + '/counter_values'][:]))
+    return times, calls, counters
+
+
+# The timers shared by the filtering code
+timers = PhaseTimers()
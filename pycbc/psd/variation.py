@@ -36,7 +36,7 @@ def mean_square(data, delta_t, srate, short_stride, stride):
 
     Returns
     -------
-    m_s: List
+    m_s: numpy.ndarray
         Mean square of given time series
     """
 
@@ -50,15 +50,76 @@ def mean_square(data, delta_t, srate, short_stride, stride):
     short_ms[1:-1][outliers] = ave[outliers]
 
     # Calculate mean square of data every step within a window equal to
-    # stride seconds
-    m_s = []
+    # stride seconds, from the cumulative sum of the short mean squares
     inv_time = int(1. / short_stride)
-    for index in range(int(delta_t - stride + 1)):
-        m_s.append(numpy.mean(short_ms[inv_time * index:inv_time *
-                                       int(index+stride)]))
+    num = int(delta_t - stride + 1)
+    csum = numpy.zeros(len(short_ms) + 1, dtype=numpy.float64)
+    numpy.cumsum(short_ms, out=csum[1:])
+    first = inv_time * numpy.arange(max(num, 0))
+    last = numpy.minimum(first + inv_time * int(stride), len(short_ms))
+    m_s = (csum[last] - csum[first]) / (last - first)
     return m_s
 
 
+def _bandpass_response(srate, psd_duration, low_freq, high_freq):
+    """ Return the magnitude of the response of a bandpass filter between
+    low_freq and high_freq, sampled at the frequencies of a PSD estimated
+    from segments of psd_duration seconds.
+    """
+    filt = sig.firwin(4 * srate, [low_freq, high_freq], pass_zero=False,
+                      window='hann', nyq=srate / 2)
+    filt.resize(int(psd_duration * srate))
+    # Fourier transform the filter and take the absolute value to get
+    # rid of the phase.
+    return abs(rfft(filt))
+
+
+def _variation_filter(psd, bandpass, srate, psd_duration, dtype):
+    """ Return the time domain filter that is convolved with the strain to
+    give the time series whose mean square is the PSD variation.
+    """
+    freqs = numpy.array(psd.sample_frequencies, dtype=dtype)
+    psd = psd.numpy()
+
+    # Make the weighting filter - bandpass, which weight by f^-7/6,
+    # and whiten. The normalization is chosen so that the variance
+    # will be one if this filter is applied to white noise which
+    # already has a variance of one.
+    fweight = freqs ** (-7./6.) * bandpass / numpy.sqrt(psd)
+    fweight[0] = 0.
+    norm = (sum(abs(fweight) ** 2) / (len(fweight) - 1.)) ** -0.5
+    fweight = norm * fweight
+    fwhiten = numpy.sqrt(2. / srate) / numpy.sqrt(psd)
+    fwhiten[0] = 0.
+    return sig.hann(int(psd_duration * srate)) * numpy.roll(
+        irfft(fwhiten * fweight), int(psd_duration / 2) * srate)
+
+
+def _interpolate_table(table, start, step, times, hold_last=False):
+    """ Linearly interpolate a uniformly sampled table of values at the
+    given times. Times outside the table, or next to a missing value, get
+    the value 1. If hold_last is True, times after the end of the table get
+    its last value instead.
+    """
+    x = (numpy.asarray(times, dtype=numpy.float64) - start) / step
+    vals = numpy.ones(len(x), dtype=numpy.float64)
+    num = len(table)
+    if num == 0:
+        return vals
+    if hold_last:
+        x = numpy.minimum(x, num - 1)
+    inside = (x >= 0) & (x <= num - 1)
+    x = x[inside]
+    if num == 1:
+        vals[inside] = table[0]
+    else:
+        idx = numpy.minimum(x.astype(numpy.int64), num - 2)
+        frac = x - idx
+        vals[inside] = table[idx] * (1. - frac) + table[idx + 1] * frac
+    vals[numpy.isnan(vals)] = 1.
+    return vals
+
+
 def calc_filt_psd_variation(strain, segment, short_segment, psd_long_segment,
                             psd_duration, psd_stride, psd_avg_method, low_freq,
                             high_freq):
@@ -129,12 +190,7 @@ def calc_filt_psd_variation(strain, segment, short_segment, psd_long_segment,
                               - segment + step)
 
     # Create a bandpass filter between low_freq and high_freq
-    filt = sig.firwin(4 * srate, [low_freq, high_freq], pass_zero=False,
-                      window='hann', nyq=srate / 2)
-    filt.resize(int(psd_duration * srate))
-    # Fourier transform the filter and take the absolute value to get
-    # rid of the phase.
-    filt = abs(rfft(filt))
+    filt = _bandpass_response(srate, psd_duration, low_freq, high_freq)
 
     psd_var_list = []
     for tlong in times_long:
@@ -155,21 +211,8 @@ def calc_filt_psd_variation(strain, segment, short_segment, psd_long_segment,
                            seg_stride=int(psd_stride * strain.sample_rate),
                            avg_method=psd_avg_method)
         astrain = astrain.numpy()
-        freqs = numpy.array(plong.sample_frequencies, dtype=fs_dtype)
-        plong = plong.numpy()
-
-        # Make the weighting filter - bandpass, which weight by f^-7/6,
-        # and whiten. The normalization is chosen so that the variance
-        # will be one if this filter is applied to white noise which
-        # already has a variance of one.
-        fweight = freqs ** (-7./6.) * filt / numpy.sqrt(plong)
-        fweight[0] = 0.
-        norm = (sum(abs(fweight) ** 2) / (len(fweight) - 1.)) ** -0.5
-        fweight = norm * fweight
-        fwhiten = numpy.sqrt(2. / srate) / numpy.sqrt(plong)
-        fwhiten[0] = 0.
-        full_filt = sig.hann(int(psd_duration * srate)) * numpy.roll(
-            irfft(fwhiten * fweight), int(psd_duration / 2) * srate)
+        full_filt = _variation_filter(plong, filt, srate, psd_duration,
+                                      fs_dtype)
         # Convolve the filter with long segment of data
         wstrain = sig.fftconvolve(astrain, full_filt, mode='same')
         wstrain = wstrain[int(strain_crop * srate):-int(strain_crop * srate)]
@@ -208,12 +251,242 @@ def find_trigger_value(psd_var, idx, start, sample_rate):
     # Find gps time of the trigger
     time = start + idx / sample_rate
     # Extract the PSD variation at trigger time through linear
-    # interpolation
-    if not hasattr(psd_var, 'cached_psd_var_interpolant'):
-        from scipy import interpolate
-        psd_var.cached_psd_var_interpolant = \
-            interpolate.interp1d(psd_var.sample_times.numpy(), psd_var.numpy(),
-                                 fill_value=1.0, bounds_error=False)
-    vals = psd_var.cached_psd_var_interpolant(time)
+    # interpolation of the uniformly sampled time series
+    return _interpolate_table(psd_var.numpy(), float(psd_var.start_time),
+                              psd_var.delta_t, time)
 
-    return vals
+
+class PSDVariation(object):
+    """ Streaming estimate of the PSD variation.
+
+    This computes the same statistic as `calc_filt_psd_variation` as blocks
+    of strain arrive, so that it can be used where the data is never held
+    all at once, such as in the low latency search. The strain is filtered
+    by overlap-save convolution with the filter made from the latest PSD,
+    the mean square of the filtered strain is taken once per short segment,
+    outliers are replaced as in `mean_square`, and once per step the mean
+    over the last segment seconds is added to a table of values from which
+    the variation at the time of triggers is read.
+
+    Parameters
+    ----------
+    sample_rate : int
+        Sample rate of the strain.
+    segment : {float, 8}
+        Duration of the segments for the mean square estimation in seconds.
+    short_segment : {float, 0.25}
+        Duration of the short segments for the outliers removal.
+    psd_duration : {float, 8}
+        Duration of the filter, in seconds.
+    low_freq : {float, 20}
+        Low frequency of the bandpass filter.
+    high_freq : {float, 480}
+        High frequency of the bandpass filter.
+    step : {float, 1}
+        Time between values of the PSD variation, in seconds.
+    max_length : {None, float}
+        The number of seconds of values to keep. If None, all are kept.
+    """
+    def __init__(self, sample_rate, segment=8., short_segment=0.25,
+                 psd_duration=8., low_freq=20., high_freq=480., step=1.,
+                 max_length=None):
+        self.sample_rate = int(sample_rate)
+        self.segment = segment
+        self.short_segment = short_segment
+        self.psd_duration = psd_duration
+        self.step = step
+        self.max_length = max_length
+        self.short_len = int(short_segment * self.sample_rate)
+        self.shorts_per_step = int(round(step / short_segment))
+        self.shorts_per_segment = int(round(segment / short_segment))
+        self.bandpass = _bandpass_response(self.sample_rate, psd_duration,
+                                           low_freq, high_freq)
+        self.filter = None
+        self._psd = None
+
+        # Table of values
+        self.values = numpy.zeros(0, dtype=numpy.float32)
+        self.start_time = None
+        self.reset()
+
+    def reset(self):
+        """ Forget the strain and mean squares of the current stretch of
+        data. Values already in the table are kept.
+        """
+        # Time of the next input sample and of the first sample in the
+        # overlap-save buffer
+        self._next_time = None
+        self._buffer_time = None
+        self._buffer = numpy.zeros(0, dtype=numpy.float64)
+        # Filtered strain not yet in a short segment
+        self._filtered = numpy.zeros(0, dtype=numpy.float64)
+        # Short segment mean squares, counted from the start of the stretch
+        # of data, which starts at _short_time
+        self._short_time = None
+        self._raw = numpy.zeros(0, dtype=numpy.float64)
+        self._raw_start = 0
+        self._smooth = numpy.zeros(0, dtype=numpy.float64)
+        self._smooth_start = 0
+        self._num_values = 0
+
+    def set_psd(self, psd):
+        """ Make the filter from a PSD estimate of the strain. The PSD is
+        interpolated to the frequency resolution of the filter if needed.
+        """
+        if psd is self._psd:
+            return
+        self._psd = psd
+        delta_f = 1. / self.psd_duration
+        if abs(psd.delta_f - delta_f) > 1e-9 * delta_f:
+            psd = pycbc.psd.interpolate(psd, delta_f)
+        self.filter = _variation_filter(psd, self.bandpass, self.sample_rate,
+                                        self.psd_duration, numpy.float64)
+
+    def update(self, strain):
+        """ Add the next block of strain.
+
+        Parameters
+        ----------
+        strain : TimeSeries
+            The strain following the last block that was added. If there is
+            a gap, the stretch of data starts again.
+        """
+        if self.filter is None:
+            raise ValueError('The PSD must be set before adding strain')
+        if int(strain.sample_rate) != self.sample_rate:
+            raise ValueError('Strain sample rate %s does not match %s' %
+                             (strain.sample_rate, self.sample_rate))
+
+        start = float(strain.start_time)
+        if self._next_time is None or \
+                abs(start - self._next_time) > 0.5 / self.sample_rate:
+            self.reset()
+            self._buffer_time = start
+        self._next_time = start + len(strain) / float(self.sample_rate)
+
+        # Overlap-save convolution: each filtered sample needs the whole
+        # filter length of strain around it
+        flen = len(self.filter)
+        buf = numpy.concatenate([self._buffer, strain.numpy()])
+        if len(buf) < flen:
+            self._buffer = buf
+            return
+        filtered = sig.fftconvolve(buf, self.filter, mode='valid')
+        ftime = self._buffer_time + (flen // 2) / float(self.sample_rate)
+        self._buffer = buf[len(buf) - flen + 1:]
+        self._buffer_time += (len(buf) - flen + 1) / float(self.sample_rate)
+
+        if self._short_time is None:
+            # Start the short segments at a multiple of the step
+            first = numpy.ceil(ftime / self.step) * self.step
+            skip = int(round((first - ftime) * self.sample_rate))
+            if skip >= len(filtered):
+                return
+            filtered = filtered[skip:]
+            self._short_time = ftime + skip / float(self.sample_rate)
+        self._filtered = numpy.concatenate([self._filtered, filtered])
+        self._add_short_segments()
+
+    def _add_short_segments(self):
+        """ Take the mean square of each complete short segment of filtered
+        strain, replace outliers, and add any new values to the table.
+        """
+        num = len(self._filtered) // self.short_len
+        if num == 0:
+            return
+        used = num * self.short_len
+        short_ms = numpy.mean(self._filtered[:used].reshape(num, -1) ** 2,
+                              axis=1)
+        self._filtered = self._filtered[used:]
+        self._raw = numpy.concatenate([self._raw, short_ms])
+
+        # A short segment is an outlier if it is more than twice the
+        # average of its neighbours, so it is only final once the next one
+        # is known. The first segment of a stretch has no left neighbour
+        # and is kept as is.
+        end = self._raw_start + len(self._raw) - 1
+        nsmooth = self._smooth_start + len(self._smooth)
+        if end > nsmooth:
+            idx = numpy.arange(nsmooth, end) - self._raw_start
+            cur = self._raw[idx].copy()
+            has_left = idx > 0
+            if not has_left.all():
+                # Only possible for the first segment of the stretch
+                idx, cur0 = idx[1:], cur[:1]
+                cur = cur[1:]
+            else:
+                cur0 = cur[:0]
+            ave = 0.5 * (self._raw[idx - 1] + self._raw[idx + 1])
+            outliers = cur > 2. * ave
+            cur[outliers] = ave[outliers]
+            self._smooth = numpy.concatenate([self._smooth, cur0, cur])
+            # Keep the last final segment as the left neighbour
+            drop = end - 1 - self._raw_start
+            self._raw = self._raw[drop:]
+            self._raw_start += drop
+
+        # Each value is the mean over segment seconds of short segments,
+        # and is given at the end of that time
+        nsmooth = self._smooth_start + len(self._smooth)
+        num = (nsmooth - self.shorts_per_segment) // self.shorts_per_step \
+            + 1 - self._num_values
+        if num <= 0:
+            return
+        csum = numpy.zeros(len(self._smooth) + 1, dtype=numpy.float64)
+        numpy.cumsum(self._smooth, out=csum[1:])
+        first = (self._num_values + numpy.arange(num)) * \
+            self.shorts_per_step - self._smooth_start
+        last = first + self.shorts_per_segment
+        vals = (csum[last] - csum[first]) / self.shorts_per_segment
+        time = self._short_time + self._num_values * self.step + \
+            self.shorts_per_segment * self.short_segment
+        self._add_values(vals, time)
+        self._num_values += num
+        drop = first[-1] + self.shorts_per_step
+        self._smooth = self._smooth[drop:]
+        self._smooth_start += drop
+
+    def _add_values(self, vals, time):
+        """ Add values, the first of which is at the given time, to the
+        table, marking any gap since the last value as missing.
+        """
+        if self.start_time is not None:
+            gap = int(round((time - self.start_time) / self.step)) - \
+                len(self.values)
+            if gap < 0:
+                self.values = self.values[:len(self.values) + gap]
+            elif gap > 0:
+                missing = numpy.zeros(gap, dtype=self.values.dtype) + \
+                    numpy.nan
+                self.values = numpy.concatenate([self.values, missing])
+        else:
+            self.start_time = time
+        self.values = numpy.concatenate([self.values,
+                                         vals.astype(self.values.dtype)])
+
+        if self.max_length is not None:
+            drop = len(self.values) - int(self.max_length / self.step)
+            if drop > 0:
+                self.values = self.values[drop:]
+                self.start_time += drop * self.step
+
+    def find_trigger_value(self, times):
+        """ Return the PSD variation at the given GPS times. Times after
+        the latest value get that value, as the variation is only known
+        after the filter and the mean square window have passed; times
+        before the first value or in gaps get 1.
+
+        Parameters
+        ----------
+        times : numpy.ndarray
+            GPS times of the triggers
+
+        Returns
+        -------
+        vals : numpy.ndarray
+            PSD variation at the given times
+        """
+        if self.start_time is None:
+            return numpy.ones(len(times), dtype=numpy.float32)
+        return _interpolate_table(self.values, self.start_time, self.step,
+                                  times, hold_last=True).astype(numpy.float32)
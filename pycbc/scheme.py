@@ -245,7 +245,9 @@ def insert_processing_option_group(parser):
                            "of threads can be provided by the PYCBC_NUM_THREADS "
                            "environment variable. If the environment variable "
                            "is not set, the number of threads matches the number "
-                           "of logical cores. ",
+                           "of logical cores. If no number of threads is given "
+                           "and an --fft-profile is, the number recommended by "
+                           "the profile is used. ",
                       default="cpu")
 
     processing_group.add_argument("--processing-device-id",
@@ -270,6 +272,14 @@ def from_cli(opt):
     scheme_str = opt.processing_scheme.split(':')
     name = scheme_str[0]
 
+    # Take the number of threads from the FFT profile if there is one and
+    # it was not given explicitly
+    if len(scheme_str) == 1 and name in ['cpu', 'mkl'] and \
+            getattr(opt, 'fft_profile', None) is not None:
+        from pycbc.fft.benchmark import read_profile, profile_settings
+        numt = profile_settings(read_profile(opt.fft_profile))['num_threads']
+        scheme_str.append(str(numt))
+
     if name == "cuda":
         logging.info("Running with CUDA support")
         ctx = CUDAScheme(opt.processing_device_id)
@@ -3,3 +3,4 @@ from .timeseries import *
 from .frequencyseries import *
 from .optparse import *
 from .aligned import check_aligned
+from .array_pool import ArrayPool, array_pool
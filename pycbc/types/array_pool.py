@@ -0,0 +1,133 @@
+"""
+This module provides a pool of reusable scratch Arrays. Arrays are handed out
+by (length, dtype) for the current processing scheme, and returned to the pool
+when no longer needed, so that the filtering and veto code does not allocate
+fresh aligned memory for every template and segment.
+"""
+import contextlib
+import logging
+import threading
+
+import numpy as _numpy
+
+import pycbc.scheme as _scheme
+from .array import zeros, empty
+
+
+class ArrayPool(object):
+    """ A pool of reusable Arrays keyed by length, dtype and scheme.
+
+    Arrays taken with `borrow` stay owned by the caller until they are given
+    back with `release`; only then may they be handed out again. The pool
+    keeps track of how much memory it holds, both in total and in use, and of
+    the peak of each.
+    """
+    def __init__(self):
+        self._free = {}
+        self._borrowed = {}
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.in_use_nbytes = 0
+        self.peak_nbytes = 0
+        self.peak_in_use_nbytes = 0
+        self.num_allocations = 0
+        self.num_reuses = 0
+
+    @staticmethod
+    def _key(length, dtype):
+        return (int(length), _numpy.dtype(dtype), _scheme.mgr.state)
+
+    def borrow(self, length, dtype, zero=True):
+        """ Take an Array from the pool, allocating it if none is free.
+
+        Parameters
+        ----------
+        length : int
+            The length of the Array.
+        dtype : numpy.dtype
+            The dtype of the Array.
+        zero : {True, boolean}, optional
+            If True, the Array is zeroed before it is returned; otherwise its
+            contents are whatever the previous borrower left in it.
+
+        Returns
+        -------
+        array : Array
+            An aligned Array in the memory of the current scheme.
+        """
+        key = self._key(length, dtype)
+        with self._lock:
+            free = self._free.get(key)
+            ary = free.pop() if free else None
+            if ary is None:
+                self.num_allocations += 1
+            else:
+                self.num_reuses += 1
+
+        if ary is None:
+            ary = zeros(length, dtype=dtype) if zero else \
+                  empty(length, dtype=dtype)
+            nbytes = ary.nbytes
+            with self._lock:
+                self.nbytes += nbytes
+                self.peak_nbytes = max(self.peak_nbytes, self.nbytes)
+        elif zero:
+            ary.clear()
+
+        with self._lock:
+            self._borrowed[id(ary)] = key
+            self.in_use_nbytes += ary.nbytes
+            self.peak_in_use_nbytes = max(self.peak_in_use_nbytes,
+                                          self.in_use_nbytes)
+        return ary
+
+    def release(self, *arrays):
+        """ Give Arrays taken with `borrow` back to the pool.
+
+        Raises
+        ------
+        ValueError
+            If an Array was not borrowed from this pool, or was already
+            released.
+        """
+        with self._lock:
+            for ary in arrays:
+                key = self._borrowed.pop(id(ary), None)
+                if key is None:
+                    raise ValueError("ArrayPool: this Array was not borrowed "
+                                     "from the pool")
+                self.in_use_nbytes -= ary.nbytes
+                self._free.setdefault(key, []).append(ary)
+
+    @contextlib.contextmanager
+    def borrowed(self, length, dtype, zero=True):
+        """ Context manager that borrows an Array and releases it on exit.
+        """
+        ary = self.borrow(length, dtype, zero=zero)
+        try:
+            yield ary
+        finally:
+            self.release(ary)
+
+    def clear(self):
+        """ Drop all free Arrays, so that their memory can be reclaimed.
+        Borrowed Arrays are unaffected.
+        """
+        with self._lock:
+            for arrays in self._free.values():
+                for ary in arrays:
+                    self.nbytes -= ary.nbytes
+            self._free = {}
+
+    def report(self):
+        """ Log the current and peak memory held by the pool.
+        """
+        mb = 1024.0 ** 2
+        logging.info("Array pool: holding %.1f MB (%.1f MB in use), peak "
+                     "%.1f MB (%.1f MB in use), %s allocations, %s reuses",
+                     self.nbytes / mb, self.in_use_nbytes / mb,
+                     self.peak_nbytes / mb, self.peak_in_use_nbytes / mb,
+                     self.num_allocations, self.num_reuses)
+
+# The pool shared by the filtering and veto code
+array_pool = ArrayPool()
@@ -15,12 +15,109 @@
 
 from pycbc.filter import make_frequency_series
 from pycbc.filter import  matched_filter_core
-from pycbc.types import Array
+from pycbc.types import array_pool
+from pycbc.opt import LimitedSizeDict
+from pycbc.waveform.bank import psd_key, template_key
 import numpy as np
 import logging
+import threading
 
 BACKEND_PREFIX="pycbc.vetoes.autochisq_"
 
+def autochisq_lags(Nsnr, stride=1, num_points=None, oneside=None):
+    """ Return the offsets from a trigger of the points used by the
+    autochisq, and the number of points on each side.
+    """
+    num_points_all = int(Nsnr/stride)
+    if num_points is None:
+        num_points = num_points_all
+    if (num_points > num_points_all):
+        num_points = num_points_all
+
+    start_point = - stride*num_points
+    end_point = stride*num_points+1
+    if oneside == 'left':
+        achisq_idx_list = np.arange(start_point, 0, stride)
+    elif oneside == 'right':
+        achisq_idx_list = np.arange(stride, end_point, stride)
+    else:
+        achisq_idx_list_pt1 = np.arange(start_point, 0, stride)
+        achisq_idx_list_pt2 = np.arange(stride, end_point, stride)
+        achisq_idx_list = np.append(achisq_idx_list_pt1,
+                                    achisq_idx_list_pt2)
+    return achisq_idx_list, num_points
+
+def autochisq_at_lags(sn, corr_sn, hauto_corr_vec, lags, indices,
+                      twophase=True, maxvalued=False, chunk_size=2**20):
+    """ Compute the autochisq of every trigger at once, given the template
+    autocorrelation at the offsets used by the test.
+
+    The points around all the triggers are gathered from the snr series
+    together, a block of triggers at a time so that no more than about
+    chunk_size points are held at once.
+
+    Parameters
+    ----------
+    sn: Array[complex]
+        normalized array of complex snr of the template
+    corr_sn : Array[complex]
+        normalized array of complex snr to correlate against
+    hauto_corr_vec: numpy.ndarray[complex]
+        the template autocorrelation at each of the offsets in lags
+    lags: numpy.ndarray[int]
+        the offsets from each trigger of the points tested
+    indices: Array[int]
+        the indices of the triggers
+    twophase: Boolean, optional; default=True
+        If True calculate the auto-chisq using both phases of the filter.
+    maxvalued: Boolean, optional; default=False
+        Return the largest auto-chisq at any of the points tested if True.
+
+    Returns
+    -------
+    achisq: numpy.ndarray
+        The autochisq of each trigger
+    """
+    sn = np.asarray(sn)
+    corr_sn = np.asarray(corr_sn)
+    indices = np.asarray(indices, dtype=np.int64)
+    hauto_corr_vec = np.asarray(hauto_corr_vec)
+    lags = np.asarray(lags, dtype=np.int64)
+    Nsnr = len(sn)
+
+    hauto_norm = hauto_corr_vec.real*hauto_corr_vec.real
+    hauto_norm += hauto_corr_vec.imag*hauto_corr_vec.imag
+    chisq_norm = 1.0 - hauto_norm
+
+    achisq = np.zeros(len(indices))
+    block = max(1, chunk_size // max(len(lags), 1))
+    for start in range(0, len(indices), block):
+        ind = indices[start:start + block]
+        snr = sn[ind]
+        snrabs = np.abs(snr)
+        cphi = (snr.real / snrabs)[:, None]
+        sphi = (snr.imag / snrabs)[:, None]
+        # By construction, the other "phase" of the SNR is 0
+        snr_ind = snr.real*cphi[:, 0] + snr.imag*sphi[:, 0]
+
+        # The points tested around each trigger, wrapped around the series
+        points = corr_sn[(ind[:, None] + lags[None, :]) % Nsnr]
+
+        z = points.real*cphi + points.imag*sphi
+        dz = z - hauto_corr_vec.real[None, :]*snr_ind[:, None]
+        curr_achisq = dz*dz/chisq_norm
+
+        if twophase:
+            z = -points.real*sphi + points.imag*cphi
+            dz = z - hauto_corr_vec.imag[None, :]*snr_ind[:, None]
+            curr_achisq += dz*dz/chisq_norm
+
+        if maxvalued:
+            achisq[start:start + block] = curr_achisq.max(axis=1)
+        else:
+            achisq[start:start + block] = curr_achisq.sum(axis=1)
+
+    return achisq
 
 def autochisq_from_precomputed(sn, corr_sn, hautocorr, indices,
                        stride=1, num_points=None, oneside=None,
@@ -65,67 +162,11 @@ def autochisq_from_precomputed(sn, corr_sn, hautocorr, indices,
         returns autochisq values and snr corresponding to the instances
         of time defined by indices
     """
-    Nsnr = len(sn)
-
-    achisq = np.zeros(len(indices))
-    num_points_all = int(Nsnr/stride)
-    if num_points is None:
-        num_points = num_points_all
-    if (num_points > num_points_all):
-        num_points = num_points_all
-
-    snrabs = np.abs(sn[indices])
-    cphi_array = (sn[indices]).real / snrabs
-    sphi_array = (sn[indices]).imag / snrabs
-
-    start_point = - stride*num_points
-    end_point = stride*num_points+1
-    if oneside == 'left':
-        achisq_idx_list = np.arange(start_point, 0, stride)
-    elif oneside == 'right':
-        achisq_idx_list = np.arange(stride, end_point, stride)
-    else:
-        achisq_idx_list_pt1 = np.arange(start_point, 0, stride)
-        achisq_idx_list_pt2 = np.arange(stride, end_point, stride)
-        achisq_idx_list = np.append(achisq_idx_list_pt1,
-                                    achisq_idx_list_pt2)
-
-    hauto_corr_vec = hautocorr[achisq_idx_list]
-    hauto_norm = hauto_corr_vec.real*hauto_corr_vec.real
-    # REMOVE THIS LINE TO REPRODUCE OLD RESULTS
-    hauto_norm += hauto_corr_vec.imag*hauto_corr_vec.imag
-    chisq_norm = 1.0 - hauto_norm
-
-    for ip,ind in enumerate(indices):
-        curr_achisq_idx_list = achisq_idx_list + ind
-
-        cphi = cphi_array[ip]
-        sphi = sphi_array[ip]
-        # By construction, the other "phase" of the SNR is 0
-        snr_ind =  sn[ind].real*cphi + sn[ind].imag*sphi
-
-        # Wrap index if needed (maybe should fail in this case?)
-        if curr_achisq_idx_list[0] < 0:
-            curr_achisq_idx_list[curr_achisq_idx_list < 0] += Nsnr
-        if curr_achisq_idx_list[-1] > (Nsnr - 1):
-            curr_achisq_idx_list[curr_achisq_idx_list > (Nsnr-1)] -= Nsnr
-
-        z = corr_sn[curr_achisq_idx_list].real*cphi + \
-             corr_sn[curr_achisq_idx_list].imag*sphi
-        dz = z - hauto_corr_vec.real*snr_ind
-        curr_achisq_list = dz*dz/chisq_norm
-
-        if twophase:
-            chisq_norm = 1.0 - hauto_norm
-            z = -corr_sn[curr_achisq_idx_list].real*sphi + \
-                 corr_sn[curr_achisq_idx_list].imag*cphi
-            dz = z - hauto_corr_vec.imag*snr_ind
-            curr_achisq_list += dz*dz/chisq_norm
-
-        if maxvalued:
-            achisq[ip] = curr_achisq_list.max()
-        else:
-            achisq[ip] = curr_achisq_list.sum()
+    lags, num_points = autochisq_lags(len(sn), stride=stride,
+                                      num_points=num_points, oneside=oneside)
+    achisq = autochisq_at_lags(sn, corr_sn, np.asarray(hautocorr)[lags],
+                               lags, indices, twophase=twophase,
+                               maxvalued=maxvalued)
 
     dof = num_points
     if oneside is None:
@@ -193,8 +234,11 @@ class SingleDetAutoChisq(object):
                     raise ValueError(err_msg)
                 self.dof = maximal_value_dof
 
-            self._autocor = None
-            self._autocor_id = None
+            # The template autocorrelation at the offsets tested, for each
+            # template and PSD. Segments may be filtered on several threads,
+            # so the cache is only accessed holding the lock.
+            self._autocor = LimitedSizeDict(size_limit=2**12)
+            self._autocor_lock = threading.Lock()
         else:
             self.do = False
 
@@ -226,24 +270,36 @@ class SingleDetAutoChisq(object):
         """
         if self.do and (len(indices) > 0):
             htilde = make_frequency_series(template)
+            N = (len(htilde) - 1) * 2
 
-            # Check if we need to recompute the autocorrelation
-            key = (id(template), id(psd))
-            if key != self._autocor_id:
+            lags, num_points = autochisq_lags(len(sn), stride=self.stride,
+                                              num_points=self.num_points,
+                                              oneside=self.one_sided)
+
+            # Only the autocorrelation at the offsets tested is kept, so that
+            # it can be cached for many templates
+            key = (template_key(template), psd_key(psd), len(sn),
+                   low_frequency_cutoff, high_frequency_cutoff)
+            with self._autocor_lock:
+                autocor = self._autocor.get(key)
+            if autocor is None:
                 logging.info("Calculating autocorrelation")
+                snr_mem = array_pool.borrow(N, htilde.dtype, zero=False)
+                corr_mem = array_pool.borrow(N, htilde.dtype)
 
                 if not self.reverse_template:
                     Pt, _, P_norm = matched_filter_core(htilde,
                               htilde, psd=psd,
                               low_frequency_cutoff=low_frequency_cutoff,
-                              high_frequency_cutoff=high_frequency_cutoff)
+                              high_frequency_cutoff=high_frequency_cutoff,
+                              out=snr_mem, corr_out=corr_mem)
                     Pt = Pt * (1./ Pt[0])
-                    self._autocor = Array(Pt, copy=True)
                 else:
                     Pt, _, P_norm = matched_filter_core(htilde.conj(),
                               htilde, psd=psd,
                               low_frequency_cutoff=low_frequency_cutoff,
-                              high_frequency_cutoff=high_frequency_cutoff)
+                              high_frequency_cutoff=high_frequency_cutoff,
+                              out=snr_mem, corr_out=corr_mem)
 
                     # T-reversed template has same norm as forward template
                     # so we can normalize using that
@@ -251,29 +307,36 @@ class SingleDetAutoChisq(object):
                     #        code is really slow ... why??
                     norm_fac = P_norm / float(((template.sigmasq(psd))**0.5))
                     Pt *= norm_fac
-                    self._autocor = Array(Pt, copy=True)
-                self._autocor_id = key
+                autocor = Pt.numpy()[lags]
+                array_pool.release(snr_mem, corr_mem)
+                with self._autocor_lock:
+                    self._autocor[key] = autocor
 
             logging.info("...Calculating autochisquare")
             sn = sn*norm
             if self.reverse_template:
                 assert(stilde is not None)
+                snr_mem = array_pool.borrow(N, htilde.dtype, zero=False)
+                corr_mem = array_pool.borrow(N, htilde.dtype)
                 asn, _, ahnrm = matched_filter_core(htilde.conj(), stilde,
                                  low_frequency_cutoff=low_frequency_cutoff,
                                  high_frequency_cutoff=high_frequency_cutoff,
-                                 h_norm=template.sigmasq(psd))
+                                 h_norm=template.sigmasq(psd),
+                                 out=snr_mem, corr_out=corr_mem)
                 correlation_snr = asn * ahnrm
+                array_pool.release(snr_mem, corr_mem)
             else:
                 correlation_snr = sn
 
-            achi_list = np.array([])
-            index_list = np.array(indices)
-            dof, achi_list, _ = autochisq_from_precomputed(sn, correlation_snr,
-                               self._autocor, index_list, stride=self.stride,
-                               num_points=self.num_points,
-                               oneside=self.one_sided, twophase=self.two_phase,
+            achi_list = autochisq_at_lags(sn, correlation_snr,
+                               autocor, lags, indices,
+                               twophase=self.two_phase,
                                maxvalued=self.take_maximum_value)
-            self.dof = dof
+            self.dof = num_points
+            if self.one_sided is None:
+                self.dof = self.dof * 2
+            if self.two_phase:
+                self.dof = self.dof * 2
             return achi_list
 
 class SingleDetSkyMaxAutoChisq(SingleDetAutoChisq):
@@ -21,10 +21,13 @@
 #
 # =============================================================================
 #
-import logging, numpy
+import os, hashlib, logging, numpy, h5py
 from pycbc.types import Array, zeros, real_same_precision_as, TimeSeries
-from pycbc.filter import overlap_cplx, matched_filter_core
+from pycbc.types import array_pool
+from pycbc.filter import matched_filter_core, get_cutoff_indices
 from pycbc.waveform import FilterBank
+from pycbc.waveform.bank import psd_key, template_key
+from pycbc.opt import file_lock, LimitedSizeDict
 from math import sqrt
 
 def segment_snrs(filters, stilde, psd, low_frequency_cutoff):
@@ -48,41 +51,88 @@ def segment_snrs(filters, stilde, psd, low_frequency_cutoff):
     snrs = []
     norms = []
 
+    # The correlation is only scratch, so one vector serves every template
+    corr_mem = array_pool.borrow((len(stilde) - 1) * 2, stilde.dtype)
     for bank_template in filters:
         # For every template compute the snr against the stilde segment
         snr, _, norm = matched_filter_core(
                 bank_template, stilde, h_norm=bank_template.sigmasq(psd),
-                psd=None, low_frequency_cutoff=low_frequency_cutoff)
+                psd=None, low_frequency_cutoff=low_frequency_cutoff,
+                corr_out=corr_mem)
         # SNR time series stored here
         snrs.append(snr)
         # Template normalization factor stored here
         norms.append(norm)
+    array_pool.release(corr_mem)
 
     return snrs, norms
 
-def template_overlaps(bank_filters, template, psd, low_frequency_cutoff):
-    """ This functions calculates the overlaps between the template and the
-    bank veto templates.
+def bank_overlap_matrix(bank_filters, psd, low_frequency_cutoff):
+    """ Return the bank veto templates as the rows of a matrix, normalized
+    by their sigma for the given PSD, for use with template_overlaps_matrix.
+    It only depends on the bank and the PSD, so may be reused for many
+    templates.
+
+    Returns
+    -------
+    bank_matrix: tuple
+        The frequency indices (kmin, kmax) covered, the PSD over them and the
+        normalized bank veto templates.
+    """
+    delta_f = bank_filters[0].delta_f
+    kmin, kmax = get_cutoff_indices(low_frequency_cutoff, None, delta_f,
+                                    (len(bank_filters[0]) - 1) * 2)
+    bank = numpy.array([b.numpy()[kmin:kmax] for b in bank_filters])
+    bank_sigmasq = numpy.array([b.sigmasq(psd) for b in bank_filters])
+    bank /= numpy.sqrt(bank_sigmasq)[:, None]
+    return (kmin, kmax), psd.numpy()[kmin:kmax], bank
+
+def template_overlaps_matrix(bank_filters, templates, psd,
+                             low_frequency_cutoff, chunk_size=32,
+                             bank_matrix=None):
+    """ This function calculates the overlaps between many templates and the
+    bank veto templates at once, as a matrix product over a few templates at
+    a time.
 
     Parameters
     ----------
     bank_filters: List of FrequencySeries
-    template: FrequencySeries
+    templates: List of FrequencySeries
     psd: FrequencySeries
     low_frequency_cutoff: float
+    chunk_size: {32, int}
+        The number of templates whitened and multiplied together.
+    bank_matrix: {None, tuple}
+        The output of bank_overlap_matrix for these bank veto templates and
+        PSD. It is calculated if not given.
 
     Returns
     -------
-    overlaps: List of complex overlap values.
+    overlaps: numpy.ndarray
+        The complex overlap of each template (rows) with each bank veto
+        template (columns).
     """
-    overlaps = []
-    template_ow = template / psd
-    for bank_template in bank_filters:
-        overlap = overlap_cplx(template_ow, bank_template,
-                low_frequency_cutoff=low_frequency_cutoff, normalized=False)
-        norm = sqrt(1 / template.sigmasq(psd) / bank_template.sigmasq(psd))
-        overlaps.append(overlap * norm)
-        if (abs(overlaps[-1]) > 0.99):
+    if bank_matrix is None:
+        bank_matrix = bank_overlap_matrix(bank_filters, psd,
+                                          low_frequency_cutoff)
+    (kmin, kmax), psd_vals, bank = bank_matrix
+    delta_f = bank_filters[0].delta_f
+
+    overlaps = numpy.zeros((len(templates), len(bank_filters)),
+                           dtype=numpy.complex128)
+    for start in range(0, len(templates), chunk_size):
+        chunk = templates[start:start + chunk_size]
+        template_ow = numpy.array([t.numpy()[kmin:kmax] for t in chunk])
+        template_ow /= psd_vals
+        sigma = numpy.sqrt([t.sigmasq(psd) for t in chunk])
+        overlaps[start:start + len(chunk)] = \
+            4 * delta_f * numpy.dot(template_ow.conj(), bank.T) / \
+            sigma[:, None]
+    return overlaps
+
+def _log_close_overlaps(bank_filters, template, overlaps):
+    for bank_template, overlap in zip(bank_filters, overlaps):
+        if (abs(overlap) > 0.99):
             errMsg = "Overlap > 0.99 between bank template and filter. "
             errMsg += "This bank template will not be used to calculate "
             errMsg += "bank chisq for this filter template. The expected "
@@ -92,10 +142,107 @@ def template_overlaps(bank_filters, template, psd, low_frequency_cutoff):
                       %(template.params.mass1, template.params.mass2)
             errMsg += "Masses of bank filter template: %e %e\n" \
                       %(bank_template.params.mass1, bank_template.params.mass2)
-            errMsg += "Overlap: %e" %(abs(overlaps[-1]))
+            errMsg += "Overlap: %e" %(abs(overlap))
             logging.info(errMsg)
+
+def template_overlaps(bank_filters, template, psd, low_frequency_cutoff):
+    """ This functions calculates the overlaps between the template and the
+    bank veto templates.
+
+    Parameters
+    ----------
+    bank_filters: List of FrequencySeries
+    template: FrequencySeries
+    psd: FrequencySeries
+    low_frequency_cutoff: float
+
+    Returns
+    -------
+    overlaps: List of complex overlap values.
+    """
+    overlaps = list(template_overlaps_matrix(bank_filters, [template], psd,
+                                             low_frequency_cutoff)[0])
+    _log_close_overlaps(bank_filters, template, overlaps)
     return overlaps
 
+class BankVetoOverlaps(object):
+    """ The overlaps of templates with the bank veto templates, for each PSD
+    they have been computed against.
+
+    Values are keyed by the hash of the PSD (see `pycbc.waveform.bank.psd_key`)
+    and of the template (see `template_key`), so that they can be written out
+    and reused by other jobs that see the same PSD.
+
+    Parameters
+    ----------
+    bank_key : {None, str}
+        A hash of the bank veto templates. The values are stored in files
+        under this key, so that jobs using different banks may share a file.
+    """
+    def __init__(self, bank_key=None):
+        self.bank_key = bank_key
+        self.values = {}
+
+    def get(self, key, tkey):
+        """ Return the overlaps of a template for the given PSD key, or None
+        if they have not been computed.
+        """
+        return self.values.get(key, {}).get(tkey)
+
+    def update(self, key, tkeys, overlaps):
+        """ Store the overlaps of many templates for the given PSD key.
+        """
+        values = self.values.setdefault(key, {})
+        for tkey, overlap in zip(tkeys, overlaps):
+            values[tkey] = overlap
+
+    def load(self, filename):
+        """ Read the values stored in a file for the same bank veto templates,
+        if there are any. Values already held take precedence.
+        """
+        if not os.path.exists(filename):
+            return
+
+        with h5py.File(filename, 'r') as f:
+            group = str(self.bank_key)
+            if group not in f:
+                return
+
+            for key in f[group]:
+                values = self.values.setdefault(key, {})
+                data = f[group][key]
+                tkeys = data['templates'][:].astype(str)
+                for tkey, overlap in zip(tkeys, data['overlaps'][:]):
+                    values.setdefault(tkey, overlap)
+            logging.info('Loaded bank veto overlaps for %s PSDs from %s',
+                         len(f[group]), filename)
+
+    def save(self, filename):
+        """ Write the overlaps to a file, keeping any values already stored in
+        it, for this and for other bank veto templates. The file is locked
+        while it is read and replaced, so that jobs sharing it keep each
+        other's values.
+        """
+        with file_lock(filename):
+            self.load(filename)
+
+            group = str(self.bank_key)
+            tmpname = '%s.tmp%s' % (filename, os.getpid())
+            with h5py.File(tmpname, 'w') as f:
+                if os.path.exists(filename):
+                    with h5py.File(filename, 'r') as old:
+                        for other in old:
+                            if other != group:
+                                old.copy(other, f)
+
+                for key, values in self.values.items():
+                    tkeys = sorted(values)
+                    f['%s/%s/templates' % (group, key)] = \
+                        numpy.array(tkeys).astype('S')
+                    f['%s/%s/overlaps' % (group, key)] = \
+                        numpy.array([values[t] for t in tkeys])
+            os.rename(tmpname, filename)
+
 def bank_chisq_from_filters(tmplt_snr, tmplt_norm, bank_snrs, bank_norms,
         tmplt_bank_matches, indices=None):
     """ This function calculates and returns a TimeSeries object containing the
@@ -167,7 +314,8 @@ class SingleDetBankVeto(object):
        memory management of its filters internally, and calculates the bank
        veto TimeSeries.
     """
-    def __init__(self, bank_file, flen, delta_f, f_low, cdtype, approximant=None, **kwds):
+    def __init__(self, bank_file, flen, delta_f, f_low, cdtype, approximant=None,
+                 overlap_cache_file=None, **kwds):
         if bank_file is not None:
             self.do = True
 
@@ -190,8 +338,12 @@ class SingleDetBankVeto(object):
             self.filters = list(bank_veto_bank)
             self.dof = len(bank_veto_bank) * 2
 
-            self._overlaps_cache = {}
+            self.overlap_cache_file = overlap_cache_file
+            self.overlaps = BankVetoOverlaps(self.bank_key())
+            if overlap_cache_file is not None:
+                self.overlaps.load(overlap_cache_file)
             self._segment_snrs_cache = {}
+            self._bank_matrices = LimitedSizeDict(size_limit=2**2)
         else:
             self.do = False
 
@@ -203,13 +355,52 @@ class SingleDetBankVeto(object):
             self._segment_snrs_cache[key] = data
         return self._segment_snrs_cache[key]
 
+    def bank_key(self):
+        """ Return a hash of the bank veto templates and the settings they
+        are generated with.
+        """
+        digest = hashlib.sha1()
+        for bank_template in self.filters:
+            digest.update(numpy.asarray(bank_template.params).tobytes())
+        digest.update(repr((self.seg_len_freq, float(self.delta_f),
+                            float(self.f_low))).encode())
+        return digest.hexdigest()
+
+    def precompute_overlaps(self, templates, psd):
+        """ Calculate together the overlaps of the given templates with the
+        bank veto templates, for those not already known for this PSD.
+
+        Returns
+        -------
+        overlaps: list
+            The overlaps of each template.
+        """
+        key = psd_key(psd)
+        tkeys = [template_key(t) for t in templates]
+        missing = [i for i, tkey in enumerate(tkeys)
+                   if self.overlaps.get(key, tkey) is None]
+        if missing:
+            logging.info("...Calculate bank veto overlaps of %s templates",
+                         len(missing))
+            if key not in self._bank_matrices:
+                self._bank_matrices[key] = bank_overlap_matrix(
+                    self.filters, psd, self.f_low)
+            overlaps = template_overlaps_matrix(
+                self.filters, [templates[i] for i in missing], psd, self.f_low,
+                bank_matrix=self._bank_matrices[key])
+            for i, overlap in zip(missing, overlaps):
+                _log_close_overlaps(self.filters, templates[i], overlap)
+            self.overlaps.update(key, [tkeys[i] for i in missing], overlaps)
+        return [self.overlaps.get(key, tkey) for tkey in tkeys]
+
     def cache_overlaps(self, template, psd):
-        key = (id(template.params), id(psd))
-        if key not in self._overlaps_cache:
-            logging.info("...Calculate bank veto overlaps")
-            o = template_overlaps(self.filters, template, psd, self.f_low)
-            self._overlaps_cache[key] = o
-        return self._overlaps_cache[key]
+        return self.precompute_overlaps([template], psd)[0]
+
+    def save_overlaps(self):
+        """ Write the overlaps to the cache file, if one was given.
+        """
+        if self.do and self.overlap_cache_file is not None:
+            self.overlaps.save(self.overlap_cache_file)
 
     def values(self, template, psd, stilde, snrv, norm, indices):
         """
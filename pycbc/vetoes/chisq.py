@@ -24,8 +24,10 @@
 import numpy, logging, math, pycbc.fft
 
 from pycbc.types import zeros, real_same_precision_as, TimeSeries, complex_same_precision_as
+from pycbc.types import array_pool
 from pycbc.filter import sigmasq_series, make_frequency_series, matched_filter_core, get_cutoff_indices
 from pycbc.scheme import schemed
+from pycbc.opt import LimitedSizeDict
 import pycbc.pnutils
 
 BACKEND_PREFIX="pycbc.vetoes.chisq_"
@@ -106,6 +108,14 @@ def shift_sum(v1, shifts, bins):
     err_msg += "scheme. You shouldn't be seeing this error!"
     raise ValueError(err_msg)
 
+@schemed(BACKEND_PREFIX)
+def shift_sum_batch(v1s, shifts_list, bins_list):
+    """ Calculate the time shifted sums of many FrequencySeries at once
+    """
+    err_msg = "This function is a stub that should be overridden using the "
+    err_msg += "scheme. You shouldn't be seeing this error!"
+    raise ValueError(err_msg)
+
 def power_chisq_at_points_from_precomputed(corr, snr, snr_norm, bins, indices):
     """Calculate the chisq timeseries from precomputed values for only select points.
 
@@ -135,9 +145,42 @@ def power_chisq_at_points_from_precomputed(corr, snr, snr_norm, bins, indices):
     chisq = shift_sum(corr, indices, bins) # pylint:disable=assignment-from-no-return
     return (chisq * num_bins - (snr.conj() * snr).real) * (snr_norm ** 2.0)
 
-_q_l = None
-_qtilde_l = None
-_chisq_l = None
+def power_chisq_at_points_batch(corrs, snrs, snr_norms, bins_list,
+                                indices_list):
+    """Calculate the chisq at select points for a group of templates.
+
+    This is `power_chisq_at_points_from_precomputed` for many templates at
+    once. On the CPU the points of all the templates are evaluated together in
+    a single threaded kernel.
+
+    Parameters
+    ----------
+    corrs: list of FrequencySeries
+        The product of each template and the data in the frequency domain.
+    snrs: list of numpy.ndarray
+        The unnormalized snr values of each template at its selected points.
+    snr_norms: list of floats
+        The normalization of the snr of each template.
+    bins_list: list of lists of integers
+        The edges of the equal power bins of each template.
+    indices_list: list of Arrays
+        The indices where we will calculate the chisq of each template.
+
+    Returns
+    -------
+    chisqs: list of Arrays
+        The chisq at the selected points of each template.
+    """
+    import pycbc.scheme
+    if isinstance(pycbc.scheme.mgr.state, pycbc.scheme.CPUScheme):
+        sums = shift_sum_batch(corrs, indices_list, bins_list) # pylint:disable=assignment-from-no-return
+    else:
+        sums = [shift_sum(corr, indices, bins) for corr, indices, bins # pylint:disable=assignment-from-no-return
+                in zip(corrs, indices_list, bins_list)]
+
+    return [(chisq * (len(bins) - 1) - (snr.conj() * snr).real) * (norm ** 2.0)
+            for chisq, snr, norm, bins in zip(sums, snrs, snr_norms, bins_list)]
+
 def power_chisq_from_precomputed(corr, snr, snr_norm, bins, indices=None, return_bins=False):
     """Calculate the chisq timeseries from precomputed values.
 
@@ -166,28 +209,17 @@ def power_chisq_from_precomputed(corr, snr, snr_norm, bins, indices=None, return
     chisq: TimeSeries
     """
     # Get workspace memory
-    global _q_l, _qtilde_l, _chisq_l
-
     bin_snrs = []
 
-    if _q_l is None or len(_q_l) != len(snr):
-        q = zeros(len(snr), dtype=complex_same_precision_as(snr))
-        qtilde = zeros(len(snr), dtype=complex_same_precision_as(snr))
-        _q_l = q
-        _qtilde_l = qtilde
-    else:
-        q = _q_l
-        qtilde = _qtilde_l
+    q = array_pool.borrow(len(snr), complex_same_precision_as(snr),
+                          zero=False)
+    qtilde = array_pool.borrow(len(snr), complex_same_precision_as(snr))
 
     if indices is not None:
         snr = snr.take(indices)
 
-    if _chisq_l is None or len(_chisq_l) < len(snr):
-        chisq = zeros(len(snr), dtype=real_same_precision_as(snr))
-        _chisq_l = chisq
-    else:
-        chisq = _chisq_l[0:len(snr)]
-        chisq.clear()
+    chisq_mem = array_pool.borrow(len(snr), real_same_precision_as(snr))
+    chisq = chisq_mem
 
     num_bins = len(bins) - 1
 
@@ -210,6 +242,7 @@ def power_chisq_from_precomputed(corr, snr, snr_norm, bins, indices=None, return
             chisq_accum_bin(chisq, q)
 
     chisq = (chisq * num_bins - snr.squared_norm()) * (snr_norm ** 2.0)
+    array_pool.release(q, qtilde, chisq_mem)
 
     if indices is None:
         chisq = TimeSeries(chisq, delta_t=snr.delta_t, epoch=snr.start_time, copy=False)
@@ -291,12 +324,17 @@ def power_chisq(template, data, num_bins, psd,
 
     bins = power_chisq_bins(htilde, num_bins, psd, low_frequency_cutoff,
                             high_frequency_cutoff)
-    corra = zeros((len(htilde)-1)*2, dtype=htilde.dtype)
+    N = (len(htilde)-1)*2
+    corra = array_pool.borrow(N, htilde.dtype)
+    snra = array_pool.borrow(N, htilde.dtype, zero=False)
     total_snr, corr, tnorm = matched_filter_core(htilde, stilde, psd,
                            low_frequency_cutoff, high_frequency_cutoff,
-                           corr_out=corra)
+                           out=snra, corr_out=corra)
 
-    return power_chisq_from_precomputed(corr, total_snr, tnorm, bins, return_bins=return_bins)
+    ret = power_chisq_from_precomputed(corr, total_snr, tnorm, bins,
+                                       return_bins=return_bins)
+    array_pool.release(corra, snra)
+    return ret
 
 
 class SingleDetPowerChisq(object):
@@ -321,34 +359,39 @@ class SingleDetPowerChisq(object):
         safe_dict.update(pycbc.pnutils.__dict__)
         return eval(arg, {"__builtins__":None}, safe_dict)
 
+    # Bins that depend only on the PSD and the frequency range of a template,
+    # shared by every template of an approximant with a precomputed norm
+    _norm_bin_cache = LimitedSizeDict(size_limit=2**12)
+
     def cached_chisq_bins(self, template, psd):
-        from pycbc.opt import LimitedSizeDict
+        """ Return the chisq bins of a template, cached by the content of the
+        PSD so that they are reused between segments with the same PSD.
+        """
+        from pycbc.waveform import waveform_norm_exists
+        from pycbc.waveform.bank import cumulative_filter_norm, psd_key
 
-        key = id(psd)
-        if not hasattr(psd, '_chisq_cached_key'):
-            psd._chisq_cached_key = {}
+        num_bins = int(self.parse_option(template, self.num_bins))
+
+        if waveform_norm_exists(template.approximant):
+            kmin = int(template.f_lower / psd.delta_f)
+            kmax = template.end_idx
+            key = (psd_key(psd), template.approximant, template.min_f_lower,
+                   num_bins, kmin, kmax)
+            if key not in self._norm_bin_cache:
+                self._norm_bin_cache[key] = \
+                    power_chisq_bins_from_sigmasq_series(
+                        cumulative_filter_norm(psd, template.approximant,
+                                               template.min_f_lower),
+                        num_bins, kmin, kmax)
+            return self._norm_bin_cache[key]
 
         if not hasattr(template, '_bin_cache'):
-            template._bin_cache = LimitedSizeDict(size_limite=2**2)
-
-        if key not in template._bin_cache or id(template.params) not in psd._chisq_cached_key:
-            psd._chisq_cached_key[id(template.params)] = True
-            num_bins = int(self.parse_option(template, self.num_bins))
-
-            if hasattr(psd, 'sigmasq_vec') and \
-                    template.approximant in psd.sigmasq_vec:
-                kmin = int(template.f_lower / psd.delta_f)
-                kmax = template.end_idx
-                bins = power_chisq_bins_from_sigmasq_series(
-                    psd.sigmasq_vec[template.approximant],
-                    num_bins,
-                    kmin,
-                    kmax
-                )
-            else:
-                bins = power_chisq_bins(template, num_bins, psd, template.f_lower)
-            template._bin_cache[key] = bins
+            template._bin_cache = LimitedSizeDict(size_limit=2**2)
 
+        key = (psd_key(psd), num_bins)
+        if key not in template._bin_cache:
+            template._bin_cache[key] = power_chisq_bins(template, num_bins,
+                                                        psd, template.f_lower)
         return template._bin_cache[key]
 
     def values(self, corr, snrv, snr_norm, psd, indices, template):
@@ -363,36 +406,57 @@ class SingleDetPowerChisq(object):
             Number of statistical degrees of freedom for the chisq test
             in the given template
         """
+        return self.values_batch([corr], [snrv], [snr_norm], psd,
+                                 [indices], [template])[0]
 
-        if self.do:
-            num_above = len(indices)
+    def values_batch(self, corrs, snrvs, snr_norms, psd, indices_list,
+                     templates):
+        """ Calculate the chisq at the points given by indices for a group of
+        templates filtered against the same segment, evaluating the points of
+        all of them together.
+
+        Returns
+        -------
+        results: list of tuples
+            The (chisq, chisq_dof) of each template, as returned by `values`.
+        """
+        if not self.do:
+            return [(None, None)] * len(templates)
+
+        above_list, sel = [], []
+        for i, (snrv, snr_norm, indices) in \
+                enumerate(zip(snrvs, snr_norms, indices_list)):
             if self.snr_threshold:
                 above = abs(snrv * snr_norm) > self.snr_threshold
                 num_above = above.sum()
                 logging.info('%s above chisq activation threshold' % num_above)
-                above_indices = indices[above]
-                above_snrv = snrv[above]
-                rchisq = numpy.zeros(len(indices), dtype=numpy.float32)
-                dof = -100
             else:
-                above_indices = indices
-                above_snrv = snrv
-
+                above = slice(None)
+                num_above = len(indices)
+            above_list.append(above)
             if num_above > 0:
-                bins = self.cached_chisq_bins(template, psd)
-                dof = (len(bins) - 1) * 2 - 2
-                chisq = power_chisq_at_points_from_precomputed(corr,
-                                     above_snrv, snr_norm, bins, above_indices)
-
+                sel.append(i)
+
+        bins = {i: self.cached_chisq_bins(templates[i], psd) for i in sel}
+        chisqs = power_chisq_at_points_batch(
+            [corrs[i] for i in sel],
+            [snrvs[i][above_list[i]] for i in sel],
+            [snr_norms[i] for i in sel],
+            [bins[i] for i in sel],
+            [indices_list[i][above_list[i]] for i in sel])
+        chisqs = dict(zip(sel, chisqs))
+
+        results = []
+        for i, indices in enumerate(indices_list):
+            dof = (len(bins[i]) - 1) * 2 - 2 if i in bins else -100
             if self.snr_threshold:
-                if num_above > 0:
-                    rchisq[above] = chisq
+                rchisq = numpy.zeros(len(indices), dtype=numpy.float32)
+                if i in chisqs:
+                    rchisq[above_list[i]] = chisqs[i]
             else:
-                rchisq = chisq
-
-            return rchisq, numpy.repeat(dof, len(indices))# dof * numpy.ones_like(indices)
-        else:
-            return None, None
+                rchisq = chisqs.get(i)
+            results.append((rchisq, numpy.repeat(dof, len(indices))))
+        return results
 
 class SingleDetSkyMaxPowerChisq(SingleDetPowerChisq):
     """Class that handles precomputation and memory management for efficiently
@@ -407,13 +471,17 @@ class SingleDetSkyMaxPowerChisq(SingleDetPowerChisq):
     def calculate_chisq_bins(self, template, psd):
         """ Obtain the chisq bins for this template and PSD.
         """
+        from pycbc.waveform import waveform_norm_exists
+        from pycbc.waveform.bank import cumulative_filter_norm
+
         num_bins = int(self.parse_option(template, self.num_bins))
-        if hasattr(psd, 'sigmasq_vec') and \
-                                       template.approximant in psd.sigmasq_vec:
+        if waveform_norm_exists(template.approximant):
             kmin = int(template.f_lower / psd.delta_f)
             kmax = template.end_idx
             bins = power_chisq_bins_from_sigmasq_series(
-                   psd.sigmasq_vec[template.approximant], num_bins, kmin, kmax)
+                   cumulative_filter_norm(psd, template.approximant,
+                                          template.min_f_lower),
+                   num_bins, kmin, kmax)
         else:
             bins = power_chisq_bins(template, num_bins, psd, template.f_lower)
         return bins
@@ -4,6 +4,7 @@ cimport numpy
 from libc.stdlib cimport malloc, free
 from libc.math cimport cos, sin # This imports c's sin and cos function from the math library
 from cython import wraparound, boundscheck, cdivision
+from cython.parallel import prange
 from pycbc.types import real_same_precision_as
 
 ctypedef fused REALTYPE:
@@ -129,6 +130,83 @@ def point_chisq_code(numpy.ndarray[REALTYPE, ndim=1] chisq,
     free(outr_tmp)
     free(outi_tmp)
 
+# The number of points of one template handled by a single work item of the
+# batched kernel, which sets the size of its scratch arrays
+_CHISQ_BLOCK = 16
+
+@boundscheck(False)
+@wraparound(False)
+@cdivision(True)
+cdef void _point_chisq_block(float complex* v1, int slen, float* shifts,
+                             int n, unsigned int* bins, int nbins,
+                             float* chisq) nogil:
+    # The same sum as point_chisq_code, for at most 16 points of one template
+    cdef float pr[16]
+    cdef float pi[16]
+    cdef float vsr[16]
+    cdef float vsi[16]
+    cdef float outr[16]
+    cdef float outi[16]
+    cdef unsigned int bstart, bend, j
+    cdef int i, r
+    cdef float vr, vi, vs, va, t1, t2, k1, k2, k3
+
+    for r in range(nbins):
+        bstart = bins[r]
+        bend = bins[r+1]
+
+        for i in range(n):
+            pr[i] = cos(2 * 3.141592653 * shifts[i] * (bstart) / slen)
+            pi[i] = sin(2 * 3.141592653 * shifts[i] * (bstart) / slen)
+            vsr[i] = cos(2 * 3.141592653 * shifts[i] / slen)
+            vsi[i] = sin(2 * 3.141592653 * shifts[i] / slen)
+            outr[i] = 0
+            outi[i] = 0
+
+        for j in range(bstart, bend):
+            vr = v1[j].real
+            vi = v1[j].imag
+            vs = vr + vi
+            va = vi - vr
+
+            for i in range(n):
+                t1 = pr[i]
+                t2 = pi[i]
+
+                k1 = vr * (t1 + t2)
+                k2 = t1 * va
+                k3 = t2 * vs
+
+                outr[i] += k1 - k3
+                outi[i] += k1 + k2
+
+                pr[i] = t1 * vsr[i] - t2 * vsi[i]
+                pi[i] = t1 * vsi[i] + t2 * vsr[i]
+
+        for i in range(n):
+            chisq[i] += outr[i]*outr[i] + outi[i]*outi[i]
+
+@boundscheck(False)
+@wraparound(False)
+def _shift_sum_batch(numpy.ndarray[long, ndim=1] v1_ptrs,
+                     numpy.ndarray[long, ndim=1] slens,
+                     numpy.ndarray[long, ndim=1] bin_ptrs,
+                     numpy.ndarray[long, ndim=1] nbins,
+                     numpy.ndarray[long, ndim=1] starts,
+                     numpy.ndarray[long, ndim=1] counts,
+                     numpy.ndarray[numpy.float32_t, ndim=1] _shifts,
+                     numpy.ndarray[numpy.float32_t, ndim=1] _chisq):
+    cdef int nitems = v1_ptrs.shape[0]
+    cdef int j
+    cdef float* shifts = &_shifts[0]
+    cdef float* chisq = &_chisq[0]
+
+    for j in prange(nitems, nogil=True, schedule='dynamic'):
+        _point_chisq_block(<float complex*> v1_ptrs[j], slens[j],
+                           shifts + starts[j], counts[j],
+                           <unsigned int*> bin_ptrs[j], nbins[j],
+                           chisq + starts[j])
+
 def chisq_accum_bin_numpy(chisq, q):
     chisq += q.squared_norm()
 
@@ -155,3 +233,45 @@ def shift_sum(v1, shifts, bins):
 
     return  chisq
 
+def shift_sum_batch(v1s, shifts_list, bins_list):
+    """ Calculate the time shifted sums of many templates' correlations at
+    once, with the points of every template spread over the threads of the
+    scheme.
+    """
+    if any(v1.dtype != numpy.complex64 for v1 in v1s):
+        return [shift_sum(v1, shifts, bins)
+                for v1, shifts, bins in zip(v1s, shifts_list, bins_list)]
+
+    counts = [len(shifts) for shifts in shifts_list]
+    total = sum(counts)
+    shifts = numpy.zeros(total, dtype=numpy.float32)
+    chisq = numpy.zeros(total, dtype=numpy.float32)
+    if total == 0:
+        return [chisq[:0] for _ in counts]
+
+    # The arrays are referenced here so that they outlive the kernel
+    v1s = [numpy.array(v1.data, copy=False) for v1 in v1s]
+    bins_list = [numpy.array(bins, dtype=numpy.uint32) for bins in bins_list]
+
+    v1_ptrs, slens, bin_ptrs, nbins, starts, nums = [], [], [], [], [], []
+    offset = 0
+    for v1, tshifts, bins, num in zip(v1s, shifts_list, bins_list, counts):
+        shifts[offset:offset + num] = tshifts
+        for start in range(offset, offset + num, _CHISQ_BLOCK):
+            v1_ptrs.append(v1.ctypes.data)
+            slens.append(len(v1))
+            bin_ptrs.append(bins.ctypes.data)
+            nbins.append(len(bins) - 1)
+            starts.append(start)
+            nums.append(min(_CHISQ_BLOCK, offset + num - start))
+        offset += num
+
+    _shift_sum_batch(numpy.array(v1_ptrs, dtype=numpy.int_),
+                     numpy.array(slens, dtype=numpy.int_),
+                     numpy.array(bin_ptrs, dtype=numpy.int_),
+                     numpy.array(nbins, dtype=numpy.int_),
+                     numpy.array(starts, dtype=numpy.int_),
+                     numpy.array(nums, dtype=numpy.int_),
+                     shifts, chisq)
+
+    return numpy.split(chisq, numpy.cumsum(counts)[:-1])
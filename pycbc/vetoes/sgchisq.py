@@ -4,9 +4,10 @@ See https://arxiv.org/abs/1709.08974 for a discussion.
 
 import numpy
 
-from pycbc.waveform.utils import apply_fseries_time_shift
 from pycbc.filter import sigma
+from pycbc.opt import LimitedSizeDict
 from pycbc.waveform import sinegauss
+from pycbc.waveform.bank import psd_key
 from pycbc.vetoes.chisq import SingleDetPowerChisq
 from pycbc.events import ranking
 
@@ -47,6 +48,7 @@ class SingleDetSGChisq(SingleDetPowerChisq):
                 hashes = bank.table['template_hash'][mask.astype(bool)]
                 for h in hashes:
                     self.params[h] = values
+            self._tiles = LimitedSizeDict(size_limit=2**6)
         else:
             self.do = False
 
@@ -101,78 +103,108 @@ class SingleDetSGChisq(SingleDetPowerChisq):
 
         if template.params.template_hash not in self.params:
             return numpy.ones(len(snrv))
-        values = self.params[template.params.template_hash].split(',')
+        values = self.params[template.params.template_hash]
 
-        # Get the chisq bins to use as the frequency reference point
-        bins = self.cached_chisq_bins(template, psd)
+        # Only triggers with a high enough newsnr are tested
+        snr = abs(snrv * snr_norm)
+        nsnr = ranking.newsnr(snr, bchisq / bchisq_dof)
+        above = numpy.flatnonzero(~(nsnr < self.snr_threshold))
 
-        # This is implemented slowly, so let's not call it often, OK?
         chisq = numpy.ones(len(snrv))
-        for i, snrvi in enumerate(snrv):
-            #Skip if newsnr too low
-            snr = abs(snrvi * snr_norm)
-            nsnr = ranking.newsnr(snr, bchisq[i] / bchisq_dof[i])
-            if nsnr < self.snr_threshold:
-                continue
-
-            N = (len(template) - 1) * 2
-            dt = 1.0 / (N * template.delta_f)
-            kmin = int(template.f_lower / psd.delta_f)
-            time = float(template.epoch) + dt * indices[i]
-            # Shift the time of interest to be centered on 0
-            stilde_shift = apply_fseries_time_shift(stilde, -time)
-
-            # Only apply the sine-Gaussian in a +-50 Hz range around the
-            # central frequency
-            qwindow = 50
-            chisq[i] = 0
-
-            # Estimate the maximum frequency up to which the waveform has
-            # power by approximating power per frequency
-            # as constant over the last 2 chisq bins. We cannot use the final
-            # chisq bin edge as it does not have to be where the waveform
-            # terminates.
-            fstep = (bins[-2] - bins[-3])
-            fpeak = (bins[-2] + fstep) * template.delta_f
-
-            # This is 90% of the Nyquist frequency of the data
-            # This allows us to avoid issues near Nyquist due to resample
-            # Filtering
-            fstop = len(stilde) * stilde.delta_f * 0.9
-
-            dof = 0
-            # Calculate the sum of SNR^2 for the sine-Gaussians specified
-            for descr in values:
-                # Get the q and frequency offset from the descriptor
-                q, offset = descr.split('-')
-                q, offset = float(q), float(offset)
-                fcen = fpeak + offset
-                flow = max(kmin * template.delta_f, fcen - qwindow)
-                fhigh = fcen + qwindow
-
-                # If any sine-gaussian tile has an upper frequency near
-                # nyquist return 1 instead.
-                if fhigh > fstop:
-                    return numpy.ones(len(snrv))
-
-                kmin = int(flow / template.delta_f)
-                kmax = int(fhigh / template.delta_f)
-
-                #Calculate sine-gaussian tile
-                gtem = sinegauss.fd_sine_gaussian(1.0, q, fcen, flow,
-                                      len(template) * template.delta_f,
-                                      template.delta_f).astype(numpy.complex64)
-                gsigma = sigma(gtem, psd=psd,
-                                     low_frequency_cutoff=flow,
-                                     high_frequency_cutoff=fhigh)
-                #Calculate the SNR of the tile
-                gsnr = (gtem[kmin:kmax] * stilde_shift[kmin:kmax]).sum()
-                gsnr *= 4.0 * gtem.delta_f / gsigma
-                chisq[i] += abs(gsnr)**2.0
-                dof += 2
-            if dof == 0:
-                chisq[i] = 1
-            else:
-                chisq[i] /= dof
+        if not len(above):
+            return chisq
+
+        # Get the chisq bins to use as the frequency reference point
+        bins = self.cached_chisq_bins(template, psd)
+        tiles = self.cached_tiles(template, psd, stilde, bins, values)
+        if tiles is None:
+            return chisq
+        kmin, filters = tiles
+
+        N = (len(template) - 1) * 2
+        dt = 1.0 / (N * template.delta_f)
+        times = float(template.epoch) + dt * numpy.asarray(indices)[above]
+        phase = 2 * numpy.pi * stilde.delta_f * \
+            numpy.arange(kmin, kmin + filters.shape[1])
+        data = stilde.numpy()[kmin:kmin + filters.shape[1]]
+
+        # Shift the data of each trigger to be centered on its time, and
+        # take the SNR of every tile at once, a block of triggers at a time
+        step = max(1, 2**22 // filters.shape[1])
+        for start in range(0, len(above), step):
+            sel = above[start:start + step]
+            shift = numpy.exp(1j * numpy.outer(times[start:start + step],
+                                               phase))
+            shifted = data * shift
+            gsnr = numpy.dot(shifted, filters.T)
+            chisq[sel] = (abs(gsnr)**2.0).sum(axis=1) / (2 * len(filters))
         return chisq
 
+    def cached_tiles(self, template, psd, stilde, bins, values):
+        """ Return the sine-Gaussian tiles of a template, normalized and
+        stacked over a common frequency range, as (kmin, filters). The tiles
+        only depend on the end frequency of the template and on the PSD, so
+        they are cached by those. None is returned if any tile reaches close
+        to the Nyquist frequency, or if there are none.
+        """
+        # Estimate the maximum frequency up to which the waveform has
+        # power by approximating power per frequency
+        # as constant over the last 2 chisq bins. We cannot use the final
+        # chisq bin edge as it does not have to be where the waveform
+        # terminates.
+        fstep = (bins[-2] - bins[-3])
+        fpeak = (bins[-2] + fstep) * template.delta_f
+
+        # This is 90% of the Nyquist frequency of the data
+        # This allows us to avoid issues near Nyquist due to resample
+        # Filtering
+        fstop = len(stilde) * stilde.delta_f * 0.9
+
+        kmin = int(template.f_lower / psd.delta_f)
+        key = (values, fpeak, kmin, fstop, len(template), template.delta_f,
+               psd_key(psd))
+        if key in self._tiles:
+            return self._tiles[key]
+
+        # Only apply the sine-Gaussian in a +-50 Hz range around the
+        # central frequency
+        qwindow = 50
+
+        tiles = []
+        for descr in values.split(','):
+            # Get the q and frequency offset from the descriptor
+            q, offset = descr.split('-')
+            q, offset = float(q), float(offset)
+            fcen = fpeak + offset
+            flow = max(kmin * template.delta_f, fcen - qwindow)
+            fhigh = fcen + qwindow
+
+            # If any sine-gaussian tile has an upper frequency near
+            # nyquist return 1 instead.
+            if fhigh > fstop:
+                tiles = []
+                break
+
+            kmin = int(flow / template.delta_f)
+            kmax = int(fhigh / template.delta_f)
+
+            #Calculate sine-gaussian tile
+            gtem = sinegauss.fd_sine_gaussian(1.0, q, fcen, flow,
+                                  len(template) * template.delta_f,
+                                  template.delta_f).astype(numpy.complex64)
+            gsigma = sigma(gtem, psd=psd,
+                                 low_frequency_cutoff=flow,
+                                 high_frequency_cutoff=fhigh)
+            tiles.append((kmin, kmax, gtem.numpy()[kmin:kmax] *
+                          (4.0 * gtem.delta_f / gsigma)))
+
+        result = None
+        if tiles:
+            lo = min(t[0] for t in tiles)
+            hi = max(t[1] for t in tiles)
+            filters = numpy.zeros((len(tiles), hi - lo), dtype=numpy.complex64)
+            for i, (kmin, kmax, tile) in enumerate(tiles):
+                filters[i, kmin - lo:kmax - lo] = tile
+            result = (lo, filters)
+        self._tiles[key] = result
+        return result
@@ -27,7 +27,9 @@ This module provides classes that describe banks of waveforms
 """
 import types
 import logging
+import os
 import os.path
+import weakref
 import h5py
 from copy import copy
 import numpy as np
@@ -36,67 +38,210 @@ import pycbc.waveform
 import pycbc.pnutils
 import pycbc.waveform.compress
 from pycbc import DYN_RANGE_FAC
+from pycbc.opt import LimitedSizeDict, file_lock
 from pycbc.types import FrequencySeries, zeros
 import pycbc.io
 import six
 import hashlib
 
+_psd_keys = {}
+
+def psd_key(psd):
+    """ Return a hash of the content of a PSD, used to key the caches of
+    template norms. The hash is computed once for each PSD object.
+    """
+    pid = id(psd)
+    if pid in _psd_keys and _psd_keys[pid][0]() is psd:
+        return _psd_keys[pid][1]
+
+    digest = hashlib.sha1()
+    digest.update(np.ascontiguousarray(psd.numpy()).tobytes())
+    digest.update(repr((len(psd), float(psd.delta_f))).encode())
+    key = digest.hexdigest()
+
+    def forget(ref, pid=pid):
+        _psd_keys.pop(pid, None)
+    _psd_keys[pid] = (weakref.ref(psd, forget), key)
+    return key
+
+def template_key(template):
+    """ Return a hash identifying a template by its parameters and the
+    settings it was generated with.
+    """
+    digest = hashlib.sha1()
+    digest.update(np.asarray(template.params).tobytes())
+    digest.update(repr((template.approximant, float(template.f_lower),
+                        int(template.end_idx), len(template),
+                        float(template.delta_f))).encode())
+    return digest.hexdigest()
+
+_filter_norms = LimitedSizeDict(size_limit=2**5)
+
+def cumulative_filter_norm(psd, approximant, f_lower):
+    """ Return the cumulative template norm of an approximant with a
+    precomputable norm, cached by the content of the PSD.
+    """
+    key = (psd_key(psd), approximant, f_lower)
+    if key not in _filter_norms:
+        _filter_norms[key] = pycbc.waveform.get_waveform_filter_norm(
+            approximant, psd, len(psd), psd.delta_f, f_lower)
+    return _filter_norms[key]
+
+_psd_invsqrt = LimitedSizeDict(size_limit=2**5)
+
 def sigma_cached(self, psd):
     """ Cache sigma calculate for use in tandem with the FilterBank class
     """
     if not hasattr(self, '_sigmasq'):
-        from pycbc.opt import LimitedSizeDict
         self._sigmasq = LimitedSizeDict(size_limit=2**5)
 
-    key = id(psd)
-    if not hasattr(psd, '_sigma_cached_key'):
-        psd._sigma_cached_key = {}
-
-    if key not in self._sigmasq or id(self) not in psd._sigma_cached_key:
-        psd._sigma_cached_key[id(self)] = True
-        # If possible, we precalculate the sigmasq vector for all possible waveforms
-        if pycbc.waveform.waveform_norm_exists(self.approximant):
-            if not hasattr(psd, 'sigmasq_vec'):
-                psd.sigmasq_vec = {}
-
-            if self.approximant not in psd.sigmasq_vec:
-                psd.sigmasq_vec[self.approximant] = \
-                    pycbc.waveform.get_waveform_filter_norm(
-                        self.approximant,
-                        psd,
-                        len(psd),
-                        psd.delta_f,
-                        self.min_f_lower
-                    )
-
-            if not hasattr(self, 'sigma_scale'):
-                # Get an amplitude normalization (mass dependant constant norm)
-                amp_norm = pycbc.waveform.get_template_amplitude_norm(
-                                     self.params, approximant=self.approximant)
-                amp_norm = 1 if amp_norm is None else amp_norm
-                self.sigma_scale = (DYN_RANGE_FAC * amp_norm) ** 2.0
-
-            curr_sigmasq = psd.sigmasq_vec[self.approximant]
-
-            kmin = int(self.f_lower / psd.delta_f)
-            self._sigmasq[key] = self.sigma_scale * \
-                (curr_sigmasq[self.end_idx-1] - curr_sigmasq[kmin])
+    key = psd_key(psd)
+    if key in self._sigmasq:
+        return self._sigmasq[key]
+
+    table = getattr(self, 'sigmasq_table', None)
+    if table is not None:
+        sigmasq = table.get(key, self.template_index)
+        if sigmasq is not None:
+            self._sigmasq[key] = sigmasq
+            return sigmasq
+
+    # If possible, we precalculate the sigmasq vector for all possible waveforms
+    if pycbc.waveform.waveform_norm_exists(self.approximant):
+        if not hasattr(self, 'sigma_scale'):
+            # Get an amplitude normalization (mass dependant constant norm)
+            amp_norm = pycbc.waveform.get_template_amplitude_norm(
+                                 self.params, approximant=self.approximant)
+            amp_norm = 1 if amp_norm is None else amp_norm
+            self.sigma_scale = (DYN_RANGE_FAC * amp_norm) ** 2.0
+
+        curr_sigmasq = cumulative_filter_norm(psd, self.approximant,
+                                              self.min_f_lower)
+
+        kmin = int(self.f_lower / psd.delta_f)
+        sigmasq = self.sigma_scale * \
+            (curr_sigmasq[self.end_idx-1] - curr_sigmasq[kmin])
+
+    else:
+        cache_sigma_view(self)
+
+        if key not in _psd_invsqrt:
+            _psd_invsqrt[key] = 1.0 / psd
+
+        sigmasq = self.sigma_view.inner(_psd_invsqrt[key][self.sslice])
+
+    self._sigmasq[key] = sigmasq
+    if table is not None:
+        table.set(key, self.template_index, sigmasq)
+    return sigmasq
+
+def cache_sigma_view(self):
+    """ Cache the part of the sigmasq of a FilterBank template that does not
+    depend on the PSD, for templates without a precomputable norm.
+    """
+    if not hasattr(self, 'sigma_view'):
+        from pycbc.filter.matchedfilter import get_cutoff_indices
+        N = (len(self) -1) * 2
+        kmin, kmax = get_cutoff_indices(
+                self.min_f_lower or self.f_lower, self.end_frequency,
+                self.delta_f, N)
+        self.sslice = slice(kmin, kmax)
+        self.sigma_view = self[self.sslice].squared_norm() * 4.0 * self.delta_f
+
+class SigmasqTable(object):
+    """ The sigmasq of every template of a bank, for each PSD it has been
+    computed against.
+
+    Values are keyed by the hash of the PSD (see `psd_key`), so that they can
+    be written out next to the bank file and reused by later jobs that see the
+    same PSD, such as restarted or followup jobs.
 
-        else:
-            if not hasattr(self, 'sigma_view'):
-                from pycbc.filter.matchedfilter import get_cutoff_indices
-                N = (len(self) -1) * 2
-                kmin, kmax = get_cutoff_indices(
-                        self.min_f_lower or self.f_lower, self.end_frequency,
-                        self.delta_f, N)
-                self.sslice = slice(kmin, kmax)
-                self.sigma_view = self[self.sslice].squared_norm() * 4.0 * self.delta_f
+    Parameters
+    ----------
+    size : int
+        The number of templates in the bank.
+    bank_key : {None, str}
+        A hash of the bank and of the settings the templates are generated
+        with. A file is only loaded if it was written with the same key.
+    """
+    def __init__(self, size, bank_key=None):
+        self.size = size
+        self.bank_key = bank_key
+        self.values = {}
+
+    def _values(self, key):
+        if key not in self.values:
+            vals = np.empty(self.size, dtype=np.float64)
+            vals.fill(np.nan)
+            self.values[key] = vals
+        return self.values[key]
+
+    def get(self, key, index):
+        """ Return the sigmasq of a template for the given PSD key, or None if
+        it has not been computed.
+        """
+        if key not in self.values:
+            return None
+        sigmasq = self.values[key][index]
+        return None if np.isnan(sigmasq) else float(sigmasq)
 
-            if not hasattr(psd, 'invsqrt'):
-                psd.invsqrt = 1.0 / psd
+    def set(self, key, index, sigmasq):
+        """ Store the sigmasq of a template for the given PSD key.
+        """
+        self._values(key)[index] = sigmasq
+
+    def update(self, key, indices, sigmasqs):
+        """ Store the sigmasq of many templates for the given PSD key.
+        """
+        self._values(key)[indices] = sigmasqs
+
+    def missing(self, key, indices):
+        """ Return the subset of indices with no sigmasq for the PSD key.
+        """
+        if key not in self.values:
+            return indices
+        return indices[np.isnan(self.values[key][indices])]
+
+    def load(self, filename):
+        """ Read the values stored in a file, if it exists and was written
+        for the same bank. Values already in the table take precedence, and
+        the file fills in the templates missing from it.
+        """
+        if not os.path.exists(filename):
+            return
+
+        with h5py.File(filename, 'r') as f:
+            if f.attrs.get('bank_key') != self.bank_key or \
+                    f.attrs.get('size') != self.size:
+                logging.warning('Ignoring sigmasq cache %s, it was written '
+                                'for a different bank', filename)
+                return
+
+            for key in f:
+                if key not in self.values:
+                    self.values[key] = f[key][:]
+                else:
+                    vals = self.values[key]
+                    missing = np.isnan(vals)
+                    vals[missing] = f[key][:][missing]
+            logging.info('Loaded the sigmasq of %s PSDs from %s',
+                         len(f), filename)
+
+    def save(self, filename):
+        """ Write the table to a file, keeping any values already stored in
+        it for other PSDs. The file is locked while it is read and replaced,
+        so that jobs sharing it keep each other's values.
+        """
+        with file_lock(filename):
+            self.load(filename)
 
-            self._sigmasq[key] = self.sigma_view.inner(psd.invsqrt[self.sslice])
-    return self._sigmasq[key]
+            tmpname = '%s.tmp%s' % (filename, os.getpid())
+            with h5py.File(tmpname, 'w') as f:
+                f.attrs['bank_key'] = self.bank_key
+                f.attrs['size'] = self.size
+                for key in self.values:
+                    f[key] = self.values[key]
+            os.rename(tmpname, filename)
 
 # dummy class needed for loading LIGOLW files
 class LIGOLWContentHandler(ligolw.LIGOLWContentHandler):
@@ -656,6 +801,7 @@ class FilterBank(TemplateBank):
                  enable_compressed_waveforms=True,
                  low_frequency_cutoff=None,
                  waveform_decompression_method=None,
+                 sigmasq_cache_file=None,
                  **kwds):
         self.out = out
         self.dtype = dtype
@@ -673,6 +819,91 @@ class FilterBank(TemplateBank):
             parameters=parameters, **kwds)
         self.ensure_standard_filter_columns(low_frequency_cutoff=low_frequency_cutoff)
 
+        self.sigmasq_cache_file = sigmasq_cache_file
+        self.init_sigmasq_table()
+
+    def init_sigmasq_table(self):
+        """Set up the table of template sigmasq for the current templates,
+        reading in any values stored in the cache file."""
+        self.sigmasq_table = SigmasqTable(len(self), self.sigmasq_bank_key())
+        if self.sigmasq_cache_file is not None:
+            self.sigmasq_table.load(self.sigmasq_cache_file)
+        self._sigmasq_geometry = None
+
+    def template_thinning(self, inj_filter_rejector):
+        super(FilterBank, self).template_thinning(inj_filter_rejector)
+        self.init_sigmasq_table()
+
+    def sigmasq_bank_key(self):
+        """Return a hash of the templates and of the settings that they are
+        generated with, which identifies the sigmasq of this bank."""
+        digest = hashlib.sha1()
+        digest.update(np.ascontiguousarray(self.table.template_hash).tobytes())
+        digest.update(np.ascontiguousarray(self.table.f_lower).tobytes())
+        apprxs = list(self.table['approximant']) \
+            if 'approximant' in self.table.fieldnames else None
+        digest.update(repr((apprxs,
+                            self.filter_length, self.delta_f, self.f_lower,
+                            self.max_template_length,
+                            self.enable_compressed_waveforms,
+                            sorted(self.extra_args.items()))).encode())
+        return digest.hexdigest()
+
+    def filter_end_frequency(self, index):
+        """Return the end frequency of the template at the given index,
+        limited to the frequencies covered by the filter."""
+        f_end = self.end_frequency(index)
+        if f_end is None or f_end >= (self.filter_length * self.delta_f):
+            f_end = (self.filter_length-1) * self.delta_f
+        return f_end
+
+    def precompute_sigmasq(self, psd):
+        """Compute the sigmasq of all templates whose approximant has a
+        precomputable norm for the given PSD, at once.
+
+        The parts of sigmasq that do not depend on the PSD are worked out
+        the first time this is called, after which each PSD only costs a
+        lookup into its cumulative norm. Templates with no such norm get their
+        sigmasq when they are generated and their `sigmasq` method is called.
+        """
+        key = psd_key(psd)
+        if self._sigmasq_geometry is None:
+            self._sigmasq_geometry = {}
+            approximants = np.array(self.table['approximant'])
+            for apx in np.unique(approximants):
+                if not pycbc.waveform.waveform_norm_exists(apx):
+                    continue
+                idx = np.flatnonzero(approximants == apx)
+                f_low = np.zeros(len(idx))
+                end_idx = np.zeros(len(idx), dtype=int)
+                scale = np.zeros(len(idx))
+                for j, i in enumerate(idx):
+                    f_low[j] = find_variable_start_frequency(
+                        apx, self.table[i], self.f_lower,
+                        self.max_template_length)
+                    end_idx[j] = int(self.filter_end_frequency(i) /
+                                     self.delta_f)
+                    amp_norm = pycbc.waveform.get_template_amplitude_norm(
+                                         self.table[i], approximant=apx)
+                    amp_norm = 1 if amp_norm is None else amp_norm
+                    scale[j] = (DYN_RANGE_FAC * amp_norm) ** 2.0
+                self._sigmasq_geometry[apx] = (idx, f_low, end_idx, scale)
+
+        for apx in self._sigmasq_geometry:
+            idx, f_low, end_idx, scale = self._sigmasq_geometry[apx]
+            if not len(self.sigmasq_table.missing(key, idx)):
+                continue
+            vec = cumulative_filter_norm(psd, apx, self.min_f_lower).numpy()
+            kmin = (f_low / psd.delta_f).astype(int)
+            self.sigmasq_table.update(key, idx,
+                                      scale * (vec[end_idx-1] - vec[kmin]))
+
+    def save_sigmasq(self):
+        """Write the sigmasq of the templates to the cache file, if one was
+        given."""
+        if self.sigmasq_cache_file is not None:
+            self.sigmasq_table.save(self.sigmasq_cache_file)
+
     def get_decompressed_waveform(self, tempout, index, f_lower=None,
                                   approximant=None, df=None):
         """Returns a frequency domain decompressed waveform for the template
@@ -757,9 +988,7 @@ class FilterBank(TemplateBank):
             tempout = self.out
 
         approximant = self.approximant(index)
-        f_end = self.end_frequency(index)
-        if f_end is None or f_end >= (self.filter_length * self.delta_f):
-            f_end = (self.filter_length-1) * self.delta_f
+        f_end = self.filter_end_frequency(index)
 
         # Find the start frequency, if variable
         f_low = find_variable_start_frequency(approximant,
@@ -793,6 +1022,12 @@ class FilterBank(TemplateBank):
         if hasattr(htilde, 'chirp_length'):
             template_duration = htilde.chirp_length
 
+        return self._finalize_template(htilde, index, approximant, f_low,
+                                       f_end, ttotal, template_duration)
+
+    def _finalize_template(self, htilde, index, approximant, f_low, f_end,
+                           ttotal, template_duration):
+        """Attach the bank metadata to a freshly generated template."""
         self.table[index].template_duration = template_duration
 
         htilde = htilde.astype(self.dtype)
@@ -808,8 +1043,94 @@ class FilterBank(TemplateBank):
         # Add sigmasq as a method of this instance
         htilde.sigmasq = types.MethodType(sigma_cached, htilde)
         htilde._sigmasq = {}
+        htilde.sigmasq_table = self.sigmasq_table
+        htilde.template_index = index
         return htilde
 
+    def get_templates(self, indices, outs):
+        """Generate a chunk of templates, each into its own output memory.
+
+        SPAtmplt templates are generated together, with their PN coefficients
+        computed at once and the waveforms filled in by a single threaded
+        call. Other templates, and any template when running on a GPU or
+        reading compressed waveforms, are generated one at a time as with
+        indexing the bank.
+
+        Parameters
+        ----------
+        indices : list of ints
+            The indices of the templates in the bank.
+        outs : list of Arrays
+            The memory to generate each template into, one for each index.
+
+        Returns
+        -------
+        htildes : list of FrequencySeries
+            The templates, in the order of `indices`.
+        """
+        from pycbc.scheme import CPUScheme, mgr
+        from pycbc.waveform.spa_tmplt import spa_tmplt_batch, \
+                                             findchirp_chirptime
+
+        htildes = [None] * len(indices)
+        batch = []
+        use_batch = isinstance(mgr.state, CPUScheme) and \
+            'f_upper' not in self.extra_args and \
+            not (self.has_compressed_waveforms and
+                 self.enable_compressed_waveforms)
+
+        out = self.out
+        for i, index in enumerate(indices):
+            if use_batch and self.approximant(index) == 'SPAtmplt':
+                batch.append(i)
+            else:
+                self.out = outs[i]
+                htildes[i] = self[index]
+        self.out = out
+
+        if not batch:
+            return htildes
+
+        f_lows, f_ends, mems = [], [], []
+        for i in batch:
+            index = indices[i]
+            f_end = self.filter_end_frequency(index)
+            f_low = find_variable_start_frequency('SPAtmplt',
+                                                  self.table[index],
+                                                  self.f_lower,
+                                                  self.max_template_length)
+            logging.info('%s: generating %s from %s Hz',
+                         index, 'SPAtmplt', f_low)
+
+            # Clear the storage memory
+            tempout = outs[i]
+            poke  = tempout.data # pylint:disable=unused-variable
+            tempout.clear()
+            mems.append(tempout[0:self.filter_length])
+            f_lows.append(f_low)
+            f_ends.append(f_end)
+
+        params = self.table[[indices[i] for i in batch]]
+        f_lows = np.array(f_lows, dtype=np.float64)
+        generated = spa_tmplt_batch(params.mass1, params.mass2,
+                                    params.spin1z, params.spin2z,
+                                    f_lows, self.delta_f, mems,
+                                    distance=1.0 / DYN_RANGE_FAC,
+                                    spin_order=int(self.extra_args.get(
+                                        'spin_order', -1)),
+                                    phase_order=int(self.extra_args.get(
+                                        'phase_order', -1)))
+        durations = findchirp_chirptime(params.mass1, params.mass2, f_lows,
+                                        int(self.extra_args.get(
+                                            'phase_order', -1)))
+
+        for j, i in enumerate(batch):
+            duration = float(durations[j])
+            htildes[i] = self._finalize_template(generated[j], indices[i],
+                                                 'SPAtmplt', f_lows[j],
+                                                 f_ends[j], duration, duration)
+        return htildes
+
 def find_variable_start_frequency(approximant, parameters, f_start, max_length,
                                   delta_f = 1):
     """ Find a frequency value above the starting frequency that results in a
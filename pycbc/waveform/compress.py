@@ -735,3 +735,95 @@ class CompressedWaveform(object):
             precision=fp_group.attrs['precision'],
             load_to_memory=load_to_memory)
 
+
+
+class QuantizedWaveform(object):
+    """Class that keeps a frequency domain waveform in a compact,
+    reduced-precision form.
+
+    Only the band from the first to the last nonzero sample is kept. The
+    amplitude is stored as float16 relative to its maximum, and the phase as
+    an uint16 fraction of a cycle, so each stored sample takes four bytes
+    instead of the eight of a complex64 sample. The error this introduces is
+    about 5e-4 in relative amplitude and 1e-4 radians in phase.
+
+    Parameters
+    ----------
+    htilde : FrequencySeries
+        The waveform to store.
+
+    Attributes
+    ----------
+    kmin : int
+        The index of the first stored sample.
+    kmax : int
+        One past the index of the last stored sample.
+    amplitude_scale : float
+        The maximum amplitude of the waveform.
+    """
+    _phase_steps = 2 ** 16
+
+    def __init__(self, htilde):
+        data = htilde.numpy()
+        nonzero = numpy.flatnonzero(data)
+        if len(nonzero):
+            self.kmin, self.kmax = int(nonzero[0]), int(nonzero[-1]) + 1
+        else:
+            self.kmin = self.kmax = 0
+
+        band = data[self.kmin:self.kmax]
+        amp = abs(band)
+        self.amplitude_scale = float(amp.max()) if len(amp) else 0.
+        if self.amplitude_scale > 0:
+            amp /= self.amplitude_scale
+        self.amplitude = amp.astype(numpy.float16)
+
+        cycles = numpy.angle(band) * (self._phase_steps / (2 * numpy.pi))
+        cycles = numpy.round(cycles).astype(numpy.int64) % self._phase_steps
+        self.phase = cycles.astype(numpy.uint16)
+
+        self.length = len(htilde)
+        self.dtype = htilde.dtype
+        self.delta_f = htilde.delta_f
+        self.epoch = htilde._epoch
+
+    @property
+    def nbytes(self):
+        """The memory taken by the stored amplitude and phase."""
+        return self.amplitude.nbytes + self.phase.nbytes
+
+    def expand(self, out=None):
+        """Expand the waveform into full length working memory.
+
+        Parameters
+        ----------
+        out : {None, Array}
+            Memory to expand the waveform into. It must be at least as long
+            as the waveform; everything outside the stored band is zeroed.
+            If None, new memory is allocated. Must be CPU memory.
+
+        Returns
+        -------
+        FrequencySeries
+            The expanded waveform, using the memory of `out`.
+        """
+        if out is None:
+            out = zeros(self.length, dtype=self.dtype)
+        elif len(out) < self.kmax:
+            raise ValueError("Output memory is too short for the waveform")
+
+        data = out.numpy()
+        data[:self.kmin] = 0
+        data[self.kmax:] = 0
+
+        real_dtype = real_same_precision_as(out)
+        amp = self.amplitude.astype(real_dtype)
+        amp *= self.amplitude_scale
+        phi = self.phase.astype(real_dtype)
+        phi *= 2 * numpy.pi / self._phase_steps
+        band = data[self.kmin:self.kmax]
+        band.real = amp * numpy.cos(phi)
+        band.imag = amp * numpy.sin(phi)
+
+        return FrequencySeries(out[0:self.length], delta_f=self.delta_f,
+                               epoch=self.epoch, copy=False)
@@ -28,9 +28,9 @@ from pycbc.types import FrequencySeries, Array, complex64, float32, zeros
 from pycbc.waveform.utils import ceilpow2
 
 def findchirp_chirptime(m1, m2, fLower, porder):
-    # variables used to compute chirp time
-    m1 = float(m1)
-    m2 = float(m2)
+    # variables used to compute chirp time; the masses may also be arrays
+    m1 = numpy.asarray(m1, dtype=numpy.float64)
+    m2 = numpy.asarray(m2, dtype=numpy.float64)
     m = m1 + m2
     eta = m1 * m2 / m / m
     c0T = c2T = c3T = c4T = c5T = c6T = c6LogT = c7T = 0.
@@ -157,6 +157,147 @@ def spa_tmplt_engine(htilde, kmin, phase_order, delta_f, piM, pfaN,
     err_msg += "scheme. You shouldn't be seeing this error!"
     raise ValueError(err_msg)
 
+@schemed("pycbc.waveform.spa_tmplt_")
+def spa_tmplt_batch_engine(htildes, kmins, kmaxs, coeffs, amp_factors,
+                           delta_f):
+    """ Calculate the spa tmplt of many templates at once
+    """
+    err_msg = "This function is a stub that should be overridden using the "
+    err_msg += "scheme. You shouldn't be seeing this error!"
+    raise ValueError(err_msg)
+
+def spa_tmplt_phasing(mass1, mass2, spin1z, spin2z, spin_order=-1,
+                      phase_order=-1):
+    """ Return the PN phasing coefficients used by `spa_tmplt` for arrays of
+    templates.
+
+    Parameters
+    ----------
+    mass1, mass2, spin1z, spin2z : numpy.ndarray
+        The parameters of the templates.
+    spin_order : {-1, int}
+        The twice PN order of the spin terms, or -1 for all of them.
+    phase_order : {-1, int}
+        The twice PN order of the phasing, or -1 for all of it.
+
+    Returns
+    -------
+    coeffs : numpy.ndarray
+        Array of shape (number of templates, 10) holding piM, pfaN, pfa2,
+        pfa3, pfa4, pfa5, pfl5, pfa6, pfl6 and pfa7 for each template.
+    """
+    params = [numpy.array(x, dtype=numpy.float64, ndmin=1)
+              for x in (mass1, mass2, spin1z, spin2z)]
+    mass1, mass2, spin1z, spin2z = params
+    num = len(mass1)
+    vec_len = lalsimulation.PN_PHASING_SERIES_MAX_ORDER + 1
+
+    if spin_order == -1 and phase_order == -1:
+        # All the templates in one call; the tidal and quadrupole-monopole
+        # terms are left at the defaults, as in spa_tmplt
+        zero = numpy.zeros(num)
+        vecs = []
+        for x in params + [zero, zero, zero, zero]:
+            vec = lal.CreateREAL8Vector(num)
+            vec.data[:] = x
+            vecs.append(vec)
+        phasing = lalsimulation.SimInspiralTaylorF2AlignedPhasingArray(*vecs)
+        phasing = numpy.array(phasing.data).reshape(-1, vec_len, num)
+        pv, pvlogv = phasing[0], phasing[1]
+    else:
+        # The array function includes all PN terms, so fall back to one
+        # call per template
+        lal_pars = lal.CreateDict()
+        if phase_order != -1:
+            lalsimulation.SimInspiralWaveformParamsInsertPNPhaseOrder(
+                lal_pars, phase_order)
+        if spin_order != -1:
+            lalsimulation.SimInspiralWaveformParamsInsertPNSpinOrder(
+                lal_pars, spin_order)
+        pv = numpy.zeros((vec_len, num))
+        pvlogv = numpy.zeros((vec_len, num))
+        for i in range(num):
+            phasing = lalsimulation.SimInspiralTaylorF2AlignedPhasing(
+                            float(mass1[i]), float(mass2[i]),
+                            float(spin1z[i]), float(spin2z[i]), lal_pars)
+            pv[:, i] = phasing.v
+            pvlogv[:, i] = phasing.vlogv
+
+    pfaN = pv[0]
+    coeffs = numpy.zeros((num, 10))
+    coeffs[:, 0] = lal.PI * (mass1 + mass2) * lal.MTSUN_SI
+    coeffs[:, 1] = pfaN
+    coeffs[:, 2] = pv[2] / pfaN
+    coeffs[:, 3] = pv[3] / pfaN
+    coeffs[:, 4] = pv[4] / pfaN
+    coeffs[:, 5] = pv[5] / pfaN
+    coeffs[:, 6] = pvlogv[5] / pfaN
+    coeffs[:, 7] = (pv[6] - pvlogv[6] * log(4)) / pfaN
+    coeffs[:, 8] = pvlogv[6] / pfaN
+    coeffs[:, 9] = pv[7] / pfaN
+    return coeffs
+
+def spa_tmplt_batch(mass1, mass2, spin1z, spin2z, f_lower, delta_f, out,
+                    f_upper=None, distance=1., spin_order=-1,
+                    phase_order=-1):
+    """ Generate many SPA TaylorF2 templates at once.
+
+    The PN coefficients of all templates are computed together, and the
+    templates are then filled in with a single call, split over as many
+    threads as the processing scheme gives. Each template is the same as
+    `spa_tmplt` would generate with the same arguments.
+
+    Parameters
+    ----------
+    mass1, mass2, spin1z, spin2z : numpy.ndarray
+        The parameters of the templates.
+    f_lower : {float, numpy.ndarray}
+        The starting frequency of each template.
+    delta_f : float
+        The frequency step of the templates.
+    out : list of Arrays
+        The complex64 memory to generate each template into. Only the
+        nonzero part of each template is written.
+    f_upper : {None, float, numpy.ndarray}
+        The ending frequency of each template. If None, the ISCO frequency of
+        each template is used.
+    distance : {1., float}
+        The distance of the templates.
+    spin_order : {-1, int}
+        The twice PN order of the spin terms, or -1 for all of them.
+    phase_order : {-1, int}
+        The twice PN order of the phasing, or -1 for all of it.
+
+    Returns
+    -------
+    htildes : list of FrequencySeries
+        The templates, using the memory in `out`.
+    """
+    coeffs = spa_tmplt_phasing(mass1, mass2, spin1z, spin2z,
+                               spin_order=spin_order,
+                               phase_order=phase_order)
+    num = len(coeffs)
+    amp_factor = spa_amplitude_factor(mass1=numpy.array(mass1, ndmin=1),
+                                      mass2=numpy.array(mass2, ndmin=1))
+    amp_factor = amp_factor / distance
+
+    piM = coeffs[:, 0]
+    if f_upper is None:
+        vISCO = 1. / sqrt(6.)
+        f_upper = vISCO * vISCO * vISCO / piM
+    f_lower = numpy.broadcast_to(f_lower, (num,))
+    f_upper = numpy.broadcast_to(f_upper, (num,))
+
+    kmins = (f_lower / float(delta_f)).astype(int)
+    kmaxs = (f_upper / float(delta_f)).astype(int)
+    for i, o in enumerate(out):
+        if o.dtype != complex64:
+            raise TypeError("Output array is the wrong dtype")
+        kmaxs[i] = min(kmaxs[i], len(o))
+
+    spa_tmplt_batch_engine(out, kmins, kmaxs, coeffs, amp_factor, delta_f)
+    return [FrequencySeries(o, delta_f=delta_f, copy=False) for o in out]
+
 def spa_tmplt(**kwds):
     """ Generate a minimal TaylorF2 approximant with optimizations for the sin/cos
     """
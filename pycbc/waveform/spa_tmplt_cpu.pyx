@@ -21,6 +21,7 @@ import pycbc
 from pycbc.types import Array, float32, FrequencySeries
 from pycbc.waveform.spa_tmplt import spa_tmplt_precondition
 from libc.math cimport cbrt, log, M_PI, M_PI_2, M_PI_4, floor, fabs
+from cython.parallel import prange
 
 # Precompute cbrt(f) ###########################################################
 
@@ -51,31 +52,22 @@ def get_log(vmax, delta):
         _logv_vec = logv_lookup(vmax, delta)
     return _logv_vec
 
-@cython.wraparound(False)
-@cython.boundscheck(False)
 @cython.cdivision(True)
-cdef spa_tmplt_inline(float piM, float pfaN,
-                      float pfa2, float pfa3,
-                      float pfa4, float pfa5,
-                      float pfl5, float pfa6,
-                      float pfl6, float pfa7,
-                      float ampc, int kmin,
-                      numpy.ndarray[numpy.float32_t, ndim=1] _logv_vec,
-                      numpy.ndarray[numpy.float32_t, ndim=1] _cbrt_vec,
-                      numpy.ndarray[numpy.float32_t, ndim=1] _kfac,
-                      numpy.ndarray[numpy.complex64_t, ndim=1] _htilde,
-                      ):
+cdef void _spa_tmplt_row(float piM, float pfaN,
+                         float pfa2, float pfa3,
+                         float pfa4, float pfa5,
+                         float pfl5, float pfa6,
+                         float pfl6, float pfa7,
+                         float ampc,
+                         float* logv_vec, float* cbrt_vec, float* kfac,
+                         float complex* _htilde, unsigned int xmax) nogil:
     cdef float piM13 = cbrt(piM)
     cdef float logpiM13 = log(piM13)
     cdef float log4 = log(4.)
     cdef float two_pi = 2 * M_PI
-    cdef float v, logv, v5, phasing, amp
-
-    cdef float complex* htilde = &_htilde[0]
-    cdef float* kfac = &_kfac[0]
-    cdef float* cbrt_vec = &_cbrt_vec[kmin]
-    cdef float* logv_vec = &_logv_vec[kmin]
-    cdef unsigned int i, xmax = _htilde.shape[0]
+    cdef float v, logv, v5, phasing, amp, sinp, cosp
+    cdef float* htilde = <float*> _htilde
+    cdef unsigned int i
 
     for i in range(xmax):
         v = piM13 * cbrt_vec[i]
@@ -108,7 +100,54 @@ cdef spa_tmplt_inline(float piM, float pfaN,
         cosp = 1.273239545 * phasing - .405284735 * phasing * fabs(phasing)
         cosp = .225 * (cosp * fabs(cosp) - cosp) + cosp
 
-        htilde[i] = (cosp - sinp * 1j) * amp
+        # htilde[i] = (cosp - sinp * 1j) * amp
+        htilde[2 * i] = cosp * amp
+        htilde[2 * i + 1] = -sinp * amp
+
+@cython.wraparound(False)
+@cython.boundscheck(False)
+cdef spa_tmplt_inline(float piM, float pfaN,
+                      float pfa2, float pfa3,
+                      float pfa4, float pfa5,
+                      float pfl5, float pfa6,
+                      float pfl6, float pfa7,
+                      float ampc, int kmin,
+                      numpy.ndarray[numpy.float32_t, ndim=1] _logv_vec,
+                      numpy.ndarray[numpy.float32_t, ndim=1] _cbrt_vec,
+                      numpy.ndarray[numpy.float32_t, ndim=1] _kfac,
+                      numpy.ndarray[numpy.complex64_t, ndim=1] _htilde,
+                      ):
+    _spa_tmplt_row(piM, pfaN, pfa2, pfa3, pfa4, pfa5, pfl5, pfa6, pfl6, pfa7,
+                   ampc, &_logv_vec[kmin], &_cbrt_vec[kmin], &_kfac[0],
+                   &_htilde[0], _htilde.shape[0])
+
+@cython.wraparound(False)
+@cython.boundscheck(False)
+def _spa_tmplt_batch(numpy.ndarray[long, ndim=1] htilde_ptrs,
+                     numpy.ndarray[long, ndim=1] kmins,
+                     numpy.ndarray[long, ndim=1] kmaxs,
+                     numpy.ndarray[double, ndim=2] coeffs,
+                     numpy.ndarray[double, ndim=1] amps,
+                     numpy.ndarray[numpy.float32_t, ndim=1] _logv_vec,
+                     numpy.ndarray[numpy.float32_t, ndim=1] _cbrt_vec,
+                     numpy.ndarray[numpy.float32_t, ndim=1] _kfac):
+    cdef int ntmplt = htilde_ptrs.shape[0]
+    cdef int j
+    cdef long kmin
+    cdef float* logv_vec = &_logv_vec[0]
+    cdef float* cbrt_vec = &_cbrt_vec[0]
+    cdef float* kfac = &_kfac[0]
+
+    for j in prange(ntmplt, nogil=True, schedule='dynamic'):
+        kmin = kmins[j]
+        if kmaxs[j] > kmin:
+            _spa_tmplt_row(coeffs[j, 0], coeffs[j, 1], coeffs[j, 2],
+                           coeffs[j, 3], coeffs[j, 4], coeffs[j, 5],
+                           coeffs[j, 6], coeffs[j, 7], coeffs[j, 8],
+                           coeffs[j, 9], amps[j],
+                           logv_vec + kmin, cbrt_vec + kmin, kfac + kmin,
+                           (<float complex*> htilde_ptrs[j]) + kmin,
+                           kmaxs[j] - kmin)
 
 @cython.wraparound(False)
 @cython.boundscheck(False)
@@ -178,3 +217,20 @@ def spa_tmplt_engine(htilde,  kmin,  phase_order, delta_f, piM,  pfaN,
                       pfa6, pfl6, pfa7, amp_factor,
                       kmin, logv_vec, cbrt_vec, kfac, htilde.data,
                       )
+
+def spa_tmplt_batch_engine(htildes, kmins, kmaxs, coeffs, amp_factors,
+                           delta_f):
+    """ Calculate the spa tmplt of many templates at once, on as many
+    threads as the scheme gives
+    """
+    kmax = int(max(kmaxs))
+    kfac = spa_tmplt_precondition(kmax, delta_f).data
+    cbrt_vec = get_cbrt(kmax * delta_f, delta_f).data
+    logv_vec = get_log(kmax * delta_f, delta_f).data
+    ptrs = numpy.array([h.ptr for h in htildes], dtype=numpy.int_)
+    _spa_tmplt_batch(ptrs,
+                     numpy.array(kmins, dtype=numpy.int_),
+                     numpy.array(kmaxs, dtype=numpy.int_),
+                     numpy.ascontiguousarray(coeffs, dtype=numpy.float64),
+                     numpy.array(amp_factors, dtype=numpy.float64),
+                     logv_vec, cbrt_vec, kfac)
@@ -517,6 +517,43 @@ for ty,oktype in types:
 
 
 
+class TestArrayPool(unittest.TestCase):
+    def setUp(self):
+        self.context = _context
+
+    def test_reuse(self):
+        with self.context:
+            pool = ArrayPool()
+            a = pool.borrow(16, complex64)
+            a[3] = 1
+            pool.release(a)
+            b = pool.borrow(16, complex64)
+            # Released memory is handed out again, zeroed
+            self.assertTrue(b is a)
+            self.assertEqual(numpy.count_nonzero(b.numpy()), 0)
+            c = pool.borrow(16, complex64)
+            d = pool.borrow(16, float32)
+            self.assertTrue(c is not b)
+            self.assertTrue(d.dtype == float32)
+            self.assertEqual(pool.num_allocations, 3)
+            self.assertEqual(pool.num_reuses, 1)
+            self.assertEqual(pool.peak_in_use_nbytes, 16 * 8 * 2 + 16 * 4)
+            pool.release(b, c, d)
+            self.assertEqual(pool.in_use_nbytes, 0)
+            self.assertEqual(pool.peak_nbytes, pool.nbytes)
+            pool.clear()
+            self.assertEqual(pool.nbytes, 0)
+
+    def test_release_unknown(self):
+        with self.context:
+            pool = ArrayPool()
+            with pool.borrowed(8, float32) as a:
+                pass
+            self.assertRaises(ValueError, pool.release, a)
+            self.assertRaises(ValueError, pool.release, zeros(8))
+
+suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestArrayPool))
+
 # TODO More specific array tests (instatiation, failure modes, type conversion, etc)
 
 
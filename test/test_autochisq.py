@@ -191,6 +191,42 @@ class TestAutochisquare(unittest.TestCase):
         #   self.assertTrue(achi_list[i,2] > 2.e3)
 
 
+    def test_against_loop(self):
+        """ Compare with computing the autochisq one trigger at a time """
+        rng = np.random.RandomState(1234)
+        num = 4096
+        sn = rng.normal(size=num) + 1j * rng.normal(size=num)
+        hacor = rng.normal(size=num) * 0.1 + 1j * rng.normal(size=num) * 0.1
+        hacor[0] = 1.
+        indx = np.array([3, 100, 2000, 4090])
+
+        for oneside in (None, 'left', 'right'):
+            for twophase in (True, False):
+                for maxvalued in (True, False):
+                    dof, achisq, _ = autochisq_from_precomputed(
+                        sn, sn, hacor, indx, stride=3, num_points=20,
+                        oneside=oneside, twophase=twophase,
+                        maxvalued=maxvalued)
+
+                    lags, num_points = autochisq_lags(num, stride=3,
+                                                      num_points=20,
+                                                      oneside=oneside)
+                    hvec = hacor[lags]
+                    cnorm = 1.0 - abs(hvec) ** 2
+                    for ip, ind in enumerate(indx):
+                        phase = sn[ind] / abs(sn[ind])
+                        snr_ind = abs(sn[ind])
+                        idx = (lags + ind) % num
+                        z = (sn[idx] * phase.conjugate())
+                        dz = z.real - hvec.real * snr_ind
+                        vals = dz * dz / cnorm
+                        if twophase:
+                            dz = z.imag - hvec.imag * snr_ind
+                            vals += dz * dz / cnorm
+                        expected = vals.max() if maxvalued else vals.sum()
+                        self.assertAlmostEqual(achisq[ip] / expected, 1.,
+                                               places=10)
+
 
 suite = unittest.TestSuite()
 suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestAutochisquare))
@@ -0,0 +1,104 @@
+#
+# =============================================================================
+#
+#                                   Preamble
+#
+# =============================================================================
+#
+"""
+These are the unittests for the bank veto overlaps in pycbc.vetoes.bank_chisq
+"""
+import os
+import unittest
+import tempfile
+import shutil
+import functools
+import numpy
+from utils import simple_exit
+from pycbc.types import FrequencySeries
+from pycbc.filter import overlap_cplx, sigmasq
+from pycbc.vetoes.bank_chisq import template_overlaps_matrix, \
+                                    bank_overlap_matrix, BankVetoOverlaps
+
+
+class TestBankVetoOverlaps(unittest.TestCase):
+    def setUp(self, *args):
+        numpy.random.seed(8642)
+        self.tmpdir = tempfile.mkdtemp()
+        self.flow = 20.
+        self.delta_f = 0.25
+        num = 2049
+        self.psd = FrequencySeries(numpy.random.uniform(1, 2, size=num),
+                                   delta_f=self.delta_f)
+        self.bank = [self.waveform(num) for _ in range(5)]
+        self.templates = [self.waveform(num) for _ in range(7)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def waveform(self, num):
+        wf = FrequencySeries(numpy.random.normal(size=num) +
+                             1j * numpy.random.normal(size=num),
+                             delta_f=self.delta_f)
+        wf.sigmasq = functools.partial(sigmasq, wf,
+                                       low_frequency_cutoff=self.flow)
+        return wf
+
+    def test_matrix(self):
+        overlaps = template_overlaps_matrix(self.bank, self.templates,
+                                            self.psd, self.flow, chunk_size=3)
+        self.assertEqual(overlaps.shape, (7, 5))
+        for i, tmplt in enumerate(self.templates):
+            for j, bank_tmplt in enumerate(self.bank):
+                expected = overlap_cplx(tmplt, bank_tmplt, psd=self.psd,
+                                        low_frequency_cutoff=self.flow)
+                self.assertAlmostEqual(abs(overlaps[i, j] - expected), 0,
+                                       places=6)
+
+        # The bank matrix may be computed once and reused
+        bank_matrix = bank_overlap_matrix(self.bank, self.psd, self.flow)
+        reused = template_overlaps_matrix(self.bank, self.templates,
+                                          self.psd, self.flow,
+                                          bank_matrix=bank_matrix)
+        self.assertTrue(numpy.allclose(reused, overlaps))
+
+    def test_save(self):
+        fname = os.path.join(self.tmpdir, 'overlaps.hdf')
+        ovl = BankVetoOverlaps(bank_key='bank')
+        ovl.update('psd1', ['a', 'b'], numpy.ones((2, 5)) * 1j)
+        ovl.save(fname)
+
+        # Another job writing to the same file keeps the values stored
+        other = BankVetoOverlaps(bank_key='bank')
+        other.update('psd2', ['c'], numpy.ones((1, 5)) * 2)
+        other.save(fname)
+
+        loaded = BankVetoOverlaps(bank_key='bank')
+        loaded.load(fname)
+        self.assertTrue((loaded.get('psd1', 'b') == 1j).all())
+        self.assertTrue((loaded.get('psd2', 'c') == 2).all())
+        self.assertTrue(loaded.get('psd2', 'a') is None)
+
+        # The values of a different bank are kept apart, and a job using it
+        # does not remove the values of the first bank
+        other = BankVetoOverlaps(bank_key='other')
+        other.load(fname)
+        self.assertEqual(other.values, {})
+        other.update('psd1', ['a'], numpy.ones((1, 5)) * 3)
+        other.save(fname)
+
+        loaded = BankVetoOverlaps(bank_key='bank')
+        loaded.load(fname)
+        self.assertTrue((loaded.get('psd1', 'a') == 1j).all())
+        self.assertTrue((loaded.get('psd2', 'c') == 2).all())
+        loaded = BankVetoOverlaps(bank_key='other')
+        loaded.load(fname)
+        self.assertTrue((loaded.get('psd1', 'a') == 3).all())
+
+suite = unittest.TestSuite()
+suite.addTest(unittest.TestLoader().loadTestsFromTestCase(
+    TestBankVetoOverlaps))
+
+if __name__ == '__main__':
+    results = unittest.TextTestRunner(verbosity=2).run(suite)
+    simple_exit(results)
@@ -37,6 +37,7 @@ _scheme, _context = parse_args_all_schemes("correlate")
 from pycbc.vetoes.chisq_cpu import chisq_accum_bin_numpy
 from pycbc.vetoes import chisq_accum_bin, power_chisq_bins, power_chisq
 from pycbc.vetoes import power_chisq_at_points_from_precomputed
+from pycbc.vetoes import power_chisq_at_points_batch
 from pycbc.filter import resample_to_delta_t, highpass
 from pycbc.catalog import Merger
 from pycbc.psd import interpolate, inverse_spectrum_truncation
@@ -125,6 +126,28 @@ class TestChisq(unittest.TestCase):
             max_diff = max(abs(chisq_full[ifo] - chisq_quick[ifo]))
             self.assertTrue(max_diff < 1E-5)
 
+    def test_chisq_batch(self):
+        nbins = 26
+        bins, snrs, indices = [], [], []
+        for i, ifo in enumerate(self.ifos):
+            bins.append(power_chisq_bins(self.hp, nbins, self.psd[ifo],
+                                         low_frequency_cutoff=20.0))
+            idx = numpy.arange(27402, 27442 + 7 * i)
+            indices.append(idx)
+            snrs.append(self.snr_unnorm[ifo][idx[0]:idx[-1] + 1].data)
+
+        with self.context:
+            chisqs = power_chisq_at_points_batch(
+                [self.corr[ifo] for ifo in self.ifos], snrs,
+                [self.norm[ifo] for ifo in self.ifos], bins, indices)
+            for i, ifo in enumerate(self.ifos):
+                chisq = power_chisq_at_points_from_precomputed(
+                    self.corr[ifo], snrs[i], self.norm[ifo], bins[i],
+                    indices[i])
+                self.assertEqual(len(chisqs[i]), len(indices[i]))
+                max_diff = max(abs(chisqs[i] - chisq)) / (nbins * 2 - 2)
+                self.assertTrue(max_diff < 1E-5)
+
 
 suite = unittest.TestSuite()
 suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestChisq))
@@ -26,8 +26,12 @@ These are the unit-tests for the pycbc.fft subpackage, testing only unthreaded
 backends for the various schemes.
 """
 
+import os
+import shutil
+import tempfile
 import pycbc.fft
 import unittest
+from pycbc.types import zeros, float32, complex64
 from utils import parse_args_all_schemes, simple_exit
 from fft_base import _BaseTestFFTClass
 
@@ -52,6 +56,167 @@ for backend in backends:
                  (_BaseTestFFTClass,),kdict)
     FFTTestClasses.append(klass)
 
+class TestFFTWWisdomCache(unittest.TestCase):
+    def setUp(self):
+        import pycbc.fft.fftw as fftw
+        self.fftw = fftw
+        self.dir = tempfile.mkdtemp()
+        self.mlvl = fftw.get_measure_level()
+        fftw.set_measure_level(1)
+        fftw.set_wisdom_cache_dir(self.dir)
+        # Start without the wisdom of transforms planned by other tests
+        fftw.float_lib.fftwf_forget_wisdom()
+
+    def tearDown(self):
+        self.fftw.set_wisdom_cache_dir(None)
+        self.fftw._wisdom_cache_loaded.clear()
+        self.fftw._wisdom_cache_dirty.clear()
+        self.fftw._wisdom_cache_entries.clear()
+        self.fftw._wisdom_cache_invalid.clear()
+        self.fftw.set_measure_level(self.mlvl)
+        shutil.rmtree(self.dir)
+
+    def wisdom_files(self):
+        return sorted(f for f in os.listdir(self.fftw.get_wisdom_cache_dir())
+                      if f.endswith('.wisdom'))
+
+    def file_entries(self, fname):
+        with open(os.path.join(self.fftw.get_wisdom_cache_dir(), fname)) as f:
+            return set(l.strip() for l in f.readlines()[1:-1])
+
+    def test_cache_round_trip(self):
+        fftw = self.fftw
+        with _context:
+            invec = zeros(2048, dtype=float32)
+            outvec = zeros(1025, dtype=complex64)
+            fftw.FFT(invec, outvec)
+
+            # The transform was not in the cache, so should be written to it
+            fftw.export_cached_wisdom()
+            fname = os.path.join(fftw.get_wisdom_cache_dir(),
+                                 'float-r2c-2048-1threads.wisdom')
+            self.assertTrue(os.path.isfile(fname))
+            self.assertEqual(self.wisdom_files(), [os.path.basename(fname)])
+
+            # A new job should read it back and have nothing to write
+            fftw._wisdom_cache_loaded.clear()
+            fftw.FFT(invec, outvec)
+            self.assertEqual(len(fftw._wisdom_cache_dirty), 0)
+
+    def test_cache_files(self):
+        fftw = self.fftw
+        umask = os.umask(0o027)
+        try:
+            with _context:
+                for size in (2048, 4096):
+                    fftw.FFT(zeros(size, dtype=float32),
+                             zeros(size // 2 + 1, dtype=complex64))
+                fftw.export_cached_wisdom()
+        finally:
+            os.umask(umask)
+
+        entries = {}
+        for size in (2048, 4096):
+            fname = 'float-r2c-%s-1threads.wisdom' % size
+            # The files are readable as if written directly by the job
+            self.assertEqual(os.stat(os.path.join(
+                fftw.get_wisdom_cache_dir(), fname)).st_mode & 0o777, 0o640)
+            entries[size] = self.file_entries(fname)
+            self.assertTrue(len(entries[size]) > 0)
+
+        # Each file only holds the wisdom of its own transform
+        self.assertEqual(entries[2048] & entries[4096], set())
+        header, known = fftw.wisdom_entries('float')
+        self.assertEqual(entries[2048] | entries[4096], known)
+
+    def test_cache_update(self):
+        fftw = self.fftw
+        with _context:
+            invec = zeros(2048, dtype=float32)
+            outvec = zeros(1025, dtype=complex64)
+            fftw.FFT(invec, outvec)
+            fftw.export_cached_wisdom()
+            first = self.file_entries('float-r2c-2048-1threads.wisdom')
+
+            # A later job reads the file, and then plans the inverse and a
+            # batched forward transform of the same size
+            fftw.float_lib.fftwf_forget_wisdom()
+            fftw._wisdom_cache_loaded.clear()
+            fftw.FFT(invec, outvec)
+            self.assertEqual(len(fftw._wisdom_cache_dirty), 0)
+            fftw.IFFT(outvec, invec)
+            fftw.FFT(zeros(2048 * 2, dtype=float32),
+                     zeros(1025 * 2, dtype=complex64), nbatch=2, size=2048)
+            fftw.export_cached_wisdom()
+
+        # The inverse has its own file, and the new wisdom of the forward
+        # transforms is merged into theirs
+        self.assertEqual(self.wisdom_files(),
+                         ['float-c2r-2048-1threads.wisdom',
+                          'float-r2c-2048-1threads.wisdom'])
+        updated = self.file_entries('float-r2c-2048-1threads.wisdom')
+        self.assertTrue(first < updated)
+
+class TestFFTBenchmark(unittest.TestCase):
+    def test_time_transforms(self):
+        from pycbc.fft import benchmark
+        # Real in-place and batched transforms through the class API
+        results = benchmark.run_benchmark([256], backends=['fftw'],
+                                          batch_sizes=[1, 2], min_time=0.001)
+        self.assertEqual(len(results), 16)
+        self.assertTrue(all(r['time'] > 0 for r in results))
+
+    def test_make_profile(self):
+        from pycbc.fft import benchmark
+        results = []
+        for size, nthreads, t in [(1024, 1, 1.0), (1024, 2, 0.6),
+                                  (4096, 1, 4.0), (4096, 2, 1.5)]:
+            results.append({'size': size, 'backend': 'fftw',
+                            'measure_level': 0, 'num_threads': nthreads,
+                            'time': t})
+        profile = benchmark.make_profile(results, objective='latency')
+        self.assertEqual(profile['best']['1024']['num_threads'], 2)
+        profile = benchmark.make_profile(results, objective='throughput')
+        self.assertEqual(profile['best']['1024']['num_threads'], 1)
+        self.assertEqual(profile['best']['4096']['num_threads'], 2)
+        self.assertEqual(benchmark.profile_settings(profile, size=3000),
+                         profile['best']['4096'])
+        self.assertEqual(profile['default']['num_threads'], 2)
+
+    def test_measure_level_rule(self):
+        import functools
+        from pycbc.fft import benchmark, fftw
+        results = []
+        for size, mlvl, t in [(1024, 0, 1.0), (1024, 1, 0.5),
+                              (4096, 0, 2.0), (4096, 1, 3.0)]:
+            results.append({'size': size, 'backend': 'fftw',
+                            'measure_level': mlvl, 'num_threads': 1,
+                            'time': t})
+        profile = benchmark.make_profile(results)
+        # Each size uses the level that was fastest for the nearest size
+        self.assertEqual(benchmark.profile_measure_level(profile, 1000, 1), 1)
+        self.assertEqual(benchmark.profile_measure_level(profile, 8192, 1), 0)
+        # The profile says nothing about other thread counts
+        self.assertEqual(benchmark.profile_measure_level(profile, 1024, 2),
+                         None)
+
+        old_mlvl = fftw.get_measure_level()
+        try:
+            fftw.set_measure_level(2)
+            fftw.set_measure_level_rule(
+                functools.partial(benchmark.profile_measure_level, profile))
+            with _context:
+                self.assertEqual(fftw.get_measure_level(1024), 1)
+                self.assertEqual(fftw.get_measure_level(4096), 0)
+                self.assertEqual(fftw.get_measure_level(), 2)
+        finally:
+            fftw.set_measure_level_rule(None)
+            fftw.set_measure_level(old_mlvl)
+
+if _scheme == 'cpu' and 'fftw' in backends:
+    FFTTestClasses.append(TestFFTWWisdomCache)
+    FFTTestClasses.append(TestFFTBenchmark)
+
 # Finally, we create suites and run them
 
 if __name__ == '__main__':
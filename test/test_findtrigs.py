@@ -0,0 +1,91 @@
+#
+# =============================================================================
+#
+#                                   Preamble
+#
+# =============================================================================
+#
+"""
+These are the unittests for finding two detector coincidences with
+pycbc_coinc_findtrigs
+"""
+import os
+import sys
+import unittest
+import tempfile
+import shutil
+import subprocess
+import numpy
+import h5py
+from utils import simple_exit
+
+script = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                      'bin', 'hdfcoinc', 'pycbc_coinc_findtrigs')
+
+
+class TestFindTrigs(unittest.TestCase):
+    def setUp(self, *args):
+        numpy.random.seed(97531)
+        self.tmpdir = tempfile.mkdtemp()
+        num_templates = 30
+        self.bank = os.path.join(self.tmpdir, 'bank.hdf')
+        with h5py.File(self.bank, 'w') as f:
+            f['template_hash'] = numpy.arange(num_templates)
+
+        self.trigger_files = []
+        for ifo in ('H1', 'L1'):
+            counts = numpy.random.randint(0, 80, size=num_templates)
+            num = counts.sum()
+            fname = os.path.join(self.tmpdir, ifo + '.hdf')
+            with h5py.File(fname, 'w') as f:
+                f[ifo + '/search/start_time'] = numpy.array([1000.])
+                f[ifo + '/search/end_time'] = numpy.array([1100.])
+                ends = numpy.cumsum(counts)
+                f[ifo + '/template_boundaries'] = ends - counts
+                f[ifo + '/template_end_boundaries'] = ends
+                f[ifo + '/template_id'] = numpy.repeat(
+                    numpy.arange(num_templates), counts)
+                f[ifo + '/end_time'] = numpy.random.uniform(1000, 1100,
+                                                            size=num)
+                f[ifo + '/snr'] = numpy.random.uniform(5, 12, size=num)
+                f[ifo + '/chisq'] = numpy.random.uniform(10, 40, size=num)
+                f[ifo + '/chisq_dof'] = numpy.ones(num) * 16
+            self.trigger_files.append(fname)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def run_findtrigs(self, name, *extra):
+        out = os.path.join(self.tmpdir, name)
+        subprocess.check_call([sys.executable, script,
+                               '--trigger-files'] + self.trigger_files +
+                              ['--template-bank', self.bank,
+                               '--ranking-statistic', 'newsnr',
+                               '--timeslide-interval', '0.2',
+                               '--loudest-keep-values', '9:5',
+                               '--batch-singles', '20',
+                               '--output-file', out] + list(extra))
+        with h5py.File(out, 'r') as f:
+            data = {key: f[key][:] for key in ('stat', 'template_id',
+                                               'trigger_id1', 'trigger_id2',
+                                               'timeslide_id',
+                                               'decimation_factor')}
+            maxshape = f['stat'].maxshape
+        return data, maxshape
+
+    def test_processes(self):
+        serial, maxshape = self.run_findtrigs('serial.hdf')
+        # The default keeps fixed size datasets
+        self.assertEqual(maxshape, serial['stat'].shape)
+        self.assertTrue(len(serial['stat']) > 0)
+
+        parallel, _ = self.run_findtrigs('parallel.hdf', '--processes', '3')
+        for key in serial:
+            self.assertTrue((serial[key] == parallel[key]).all())
+
+suite = unittest.TestSuite()
+suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestFindTrigs))
+
+if __name__ == '__main__':
+    results = unittest.TextTestRunner(verbosity=2).run(suite)
+    simple_exit(results)
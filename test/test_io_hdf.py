@@ -0,0 +1,89 @@
+#
+# =============================================================================
+#
+#                                   Preamble
+#
+# =============================================================================
+#
+"""
+These are the unittests for reading merged trigger files in pycbc.io.hdf
+"""
+import os
+import unittest
+import tempfile
+import shutil
+import numpy
+import h5py
+from utils import simple_exit
+from pycbc.io.hdf import ReadByTemplate
+
+
+class TestReadByTemplate(unittest.TestCase):
+    def setUp(self, *args):
+        numpy.random.seed(1234)
+        self.tmpdir = tempfile.mkdtemp()
+        self.num_templates = 50
+        counts = numpy.random.randint(0, 40, size=self.num_templates)
+        counts[::7] = 0
+        # The triggers are stored in the order of a permutation of the
+        # templates, as they are in the order of the template hashes
+        order = numpy.random.permutation(self.num_templates)
+        self.tid = numpy.repeat(order, counts[order])
+        self.end_time = numpy.random.uniform(100, 200, size=len(self.tid))
+        ends = numpy.cumsum(counts[order])
+        self.starts = numpy.zeros(self.num_templates, dtype=int)
+        self.ends = numpy.zeros(self.num_templates, dtype=int)
+        self.starts[order] = ends - counts[order]
+        self.ends[order] = ends
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, index=True, compress=True):
+        fname = os.path.join(self.tmpdir, name)
+        with h5py.File(fname, 'w') as f:
+            f['H1/search/start_time'] = numpy.array([100.])
+            f['H1/search/end_time'] = numpy.array([180.])
+            f['H1/template_boundaries'] = self.starts
+            if index:
+                f['H1/template_end_boundaries'] = self.ends
+            for col, data in (('end_time', self.end_time),
+                              ('template_id', self.tid)):
+                key = 'H1/' + col
+                if compress:
+                    dset = f.create_dataset(key, data=data, chunks=(16,),
+                                            compression='gzip')
+                else:
+                    dset = f.create_dataset(key, data=data)
+                refs = [dset.regionref[l:r]
+                        for l, r in zip(self.starts, self.ends)]
+                f.create_dataset(key + '_template', data=refs,
+                                 dtype=h5py.special_dtype(
+                                     ref=h5py.RegionReference))
+        return fname
+
+    def test_layouts(self):
+        old = ReadByTemplate(self.write('old.hdf', index=False))
+        self.assertTrue(old.template_slice(0) is None)
+        for compress in (True, False):
+            new = ReadByTemplate(self.write('new%s.hdf' % compress,
+                                            compress=compress))
+            self.assertEqual(isinstance(new.column('end_time'),
+                                        numpy.memmap), not compress)
+            for num in range(self.num_templates):
+                tid_old = old.set_template(num)
+                tid_new = new.set_template(num)
+                self.assertTrue((tid_old == tid_new).all())
+                self.assertTrue((new['template_id'] == num).all())
+                self.assertTrue((new['end_time'] ==
+                                 old['end_time']).all())
+                self.assertTrue((new['end_time'] <= 180).all())
+            new.close()
+        old.close()
+
+suite = unittest.TestSuite()
+suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestReadByTemplate))
+
+if __name__ == '__main__':
+    results = unittest.TextTestRunner(verbosity=2).run(suite)
+    simple_exit(results)
@@ -0,0 +1,182 @@
+#
+# =============================================================================
+#
+#                                   Preamble
+#
+# =============================================================================
+#
+"""
+These are the unittests for the buffers of the live coincidence code
+"""
+import itertools
+import unittest
+import numpy
+from utils import simple_exit
+from pycbc.events.coinc import MultiRingBuffer
+from pycbc.events.coinc import LiveCoincTimeslideBackgroundEstimator
+
+
+class TestMultiRingBuffer(unittest.TestCase):
+    def setUp(self, *args):
+        numpy.random.seed(1357)
+        self.num_rings = 50
+        self.max_time = 7
+        self.dtype = [('end_time', numpy.float64), ('stat', numpy.float32)]
+
+    def test_against_lists(self):
+        buf = MultiRingBuffer(self.num_rings, self.max_time, self.dtype,
+                              min_buffer_size=2, buffer_increment=3)
+        ref = [[] for _ in range(self.num_rings)]
+        for time in range(40):
+            num = numpy.random.randint(0, 30)
+            indices = numpy.random.randint(0, self.num_rings, size=num)
+            values = numpy.zeros(num, dtype=self.dtype)
+            values['end_time'] = time + numpy.random.uniform(size=num)
+            values['stat'] = numpy.random.uniform(size=num)
+            buf.add(indices, values)
+            for i, v in zip(indices, values):
+                ref[i].append((time, v))
+
+            # Back out some updates, as the live coincidence code does
+            if time % 5 == 4:
+                buf.discard_last(indices)
+                for i in indices:
+                    ref[i].pop()
+
+            expired = buf.time - self.max_time
+            ref = [[(t, v) for t, v in r if t >= expired] for r in ref]
+            for i in range(self.num_rings):
+                expected = numpy.array([v for _, v in ref[i]],
+                                       dtype=self.dtype)
+                self.assertTrue((buf.data(i) == expected).all())
+                self.assertEqual(list(buf.expire_vector(i)),
+                                 [t for t, _ in ref[i]])
+            self.assertEqual(buf.num_elements(), sum(len(r) for r in ref))
+
+            rings = numpy.random.randint(0, self.num_rings, size=10)
+            data, expire, offsets = buf.data_bulk(rings)
+            for k, i in enumerate(rings):
+                s, e = offsets[k], offsets[k + 1]
+                self.assertTrue((data[s:e] == buf.data(i)).all())
+                self.assertTrue((expire[s:e] == buf.expire_vector(i)).all())
+
+    def test_memory(self):
+        buf = MultiRingBuffer(100000, self.max_time, self.dtype)
+        # Rings take no space until they are used
+        self.assertEqual(buf.nbytes, 0)
+
+        # One noisy ring only makes its own segment larger
+        buf.add(numpy.zeros(20000, dtype=int),
+                numpy.zeros(20000, dtype=self.dtype))
+        buf.add(numpy.arange(1, 11), numpy.zeros(10, dtype=self.dtype))
+        self.assertTrue(buf.capacity[0] >= 20000)
+        self.assertTrue((buf.capacity[1:11] == buf.min_buffer_size).all())
+        self.assertTrue((buf.capacity[11:] == 0).all())
+        self.assertEqual(len(buf.data(0)), 20000)
+        self.assertEqual(len(buf.data(5)), 1)
+
+        # and gives the space back once its triggers expire
+        big = buf.nbytes
+        for _ in range(self.max_time - 1):
+            buf.add([5], numpy.zeros(1, dtype=self.dtype))
+        self.assertEqual(len(buf.data(0)), 0)
+        self.assertTrue(buf.nbytes < big / 100)
+        self.assertEqual(buf.capacity[0], 0)
+        self.assertEqual(len(buf.data(5)), self.max_time)
+
+
+class TestLiveCoincEstimator(unittest.TestCase):
+    def setUp(self, *args):
+        numpy.random.seed(2468)
+        self.ifos = ['H1', 'L1', 'V1']
+        self.estimator = LiveCoincTimeslideBackgroundEstimator(
+            20, 8, 'newsnr', [], self.ifos, timeslide_interval=0.1,
+            max_coinc_ifos=3)
+
+    def results(self, start):
+        results = {}
+        for ifo in self.ifos:
+            num = numpy.random.randint(1, 40)
+            results[ifo] = {
+                'template_id': numpy.random.randint(0, 20, size=num),
+                'end_time': start + numpy.random.uniform(0, 8, size=num),
+                'snr': numpy.random.uniform(5, 10, size=num).astype(
+                    numpy.float32),
+                'chisq': numpy.random.uniform(0.5, 2, size=num).astype(
+                    numpy.float32),
+                'chisq_dof': numpy.ones(num, dtype=numpy.int32) * 10}
+        return results
+
+    def brute_force(self, ctype, new_ifos):
+        """Every coincidence of ctype with at least one new trigger"""
+        est = self.estimator
+        step = est.timeslide_interval
+        found = set()
+        for template in range(20):
+            data = [est.singles[ifo].data(template) for ifo in ctype]
+            expire = [est.singles[ifo].expire_vector(template)
+                      for ifo in ctype]
+            for combo in itertools.product(*[range(len(d)) for d in data]):
+                times = [d['end_time'][i] for d, i in zip(data, combo)]
+                new = [ifo in new_ifos and
+                       e[i] == est.singles[ifo].time - 1
+                       for ifo, e, i in zip(ctype, expire, combo)]
+                if not any(new):
+                    continue
+                slide = int(numpy.rint((times[0] - times[1]) / step))
+                times[0] -= slide * step
+                if all(abs(times[a] - times[b]) <= est.time_window[ctype[a],
+                                                                  ctype[b]]
+                       for a, b in itertools.combinations(range(len(ctype)),
+                                                          2)):
+                    found.add(tuple(times) + (slide,))
+        return found
+
+    def test_candidates(self):
+        est = self.estimator
+        for update in range(6):
+            results = self.results(1000000000 + 8 * update)
+            new = est._add_singles_to_buffer(results, self.ifos)
+            for ctype in est.coinc_types:
+                found = set()
+                for i, anchor in enumerate(ctype):
+                    members, _, slide = est._coinc_candidates(
+                        ctype, anchor, new[anchor], ctype[:i])
+                    times = [members[ifo]['end_time'].copy() for ifo in ctype]
+                    times[0] -= slide * est.timeslide_interval
+                    cands = list(zip(*(times + [slide])))
+                    self.assertEqual(len(set(cands) & found), 0)
+                    found.update(cands)
+                self.assertEqual(found, self.brute_force(ctype, self.ifos))
+            est._find_coincs(new, self.ifos)
+            self.assertTrue(est.coinc_type_background_time(
+                ('H1', 'L1', 'V1')) > 0)
+
+    def test_coinc_types(self):
+        self.assertEqual(self.estimator.coinc_types,
+                         [('H1', 'L1'), ('H1', 'V1'), ('L1', 'V1'),
+                          ('H1', 'L1', 'V1')])
+        est = LiveCoincTimeslideBackgroundEstimator(
+            20, 8, 'newsnr', [], self.ifos, max_coinc_ifos=3,
+            coinc_types=[('L1', 'V1')])
+        self.assertEqual(est.coinc_types, [('L1', 'V1')])
+        self.assertEqual(list(est.coincs.keys()), [('L1', 'V1')])
+        with self.assertRaises(ValueError):
+            LiveCoincTimeslideBackgroundEstimator(
+                20, 8, 'newsnr', [], self.ifos, coinc_types=[('H1', 'K1')])
+
+    def test_coinc_stats(self):
+        est = self.estimator
+        for ctype in est.coinc_types:
+            stat = est.coinc_stats[ctype]
+            self.assertEqual(list(stat.ifos), list(ctype))
+            self.assertTrue(stat.files is est.stat_calculator.files)
+
+suite = unittest.TestSuite()
+suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestMultiRingBuffer))
+suite.addTest(unittest.TestLoader().loadTestsFromTestCase(
+    TestLiveCoincEstimator))
+
+if __name__ == '__main__':
+    results = unittest.TextTestRunner(verbosity=2).run(suite)
+    simple_exit(results)
@@ -126,6 +126,145 @@ class TestMatchedFilter(unittest.TestCase):
             o,i = match(self.filtD,self.filt2D)
             self.assertAlmostEqual(sqrt(0.5),o,places=3)
 
+    def test_batched_matched_filter(self):
+        # Filtering a batch of templates together should give the same
+        # triggers as filtering each template on its own
+        if self.scheme != 'cpu':
+            return
+        with self.context:
+            tlen = 4096 * 4
+            flen = tlen // 2 + 1
+            delta_f = 4096.0 / tlen
+            rng = numpy.random.RandomState(0)
+
+            segs = []
+            for i in range(2):
+                d = rng.normal(size=tlen)
+                d = TimeSeries(d, dtype=float32, delta_t=1.0/4096)
+                seg = make_frequency_series(d)
+                seg.analyze = slice(1024, tlen - 1024)
+                segs.append(seg)
+
+            temps = []
+            for i in range(3):
+                t = rng.normal(size=flen) + 1j * rng.normal(size=flen)
+                temps.append(Array(t, dtype=complex64))
+
+            for cluster_function in ['findchirp', 'symmetric']:
+                single_mem = zeros(tlen, dtype=complex64)
+                single = MatchedFilterControl(20, None, 4, tlen, delta_f,
+                                              complex64, segs, single_mem, True,
+                                              cluster_function=cluster_function)
+                batch_mem = zeros(tlen * 4, dtype=complex64)
+                batch = MatchedFilterControl(20, None, 4, tlen, delta_f,
+                                             complex64, segs, batch_mem, True,
+                                             cluster_function=cluster_function,
+                                             template_batch_size=4)
+
+                for t, h in zip(temps, batch.htilde_batch):
+                    h[0:flen] = t
+
+                for segnum in range(len(segs)):
+                    results = batch.batched_matched_filter_and_cluster(
+                        segnum, [1.0] * len(temps), 128)
+                    self.assertEqual(len(results), len(temps))
+                    for t, res in zip(temps, results):
+                        single_mem[0:flen] = t
+                        snr, norm, corr, idx, snrv = \
+                            single.matched_filter_and_cluster(segnum, 1.0, 128)
+                        self.assertTrue(len(idx) > 0)
+                        self.assertEqual(norm, res[1])
+                        self.assertTrue(numpy.array_equal(idx, res[3]))
+                        self.assertTrue(numpy.allclose(snrv, res[4], rtol=1e-4))
+                        self.assertTrue(numpy.allclose(snr.numpy(),
+                                                       res[0].numpy(),
+                                                       rtol=1e-4, atol=1e-2))
+
+    def test_heirarchical_matched_filter(self):
+        # A loud signal should be recovered with the same index and snr by
+        # the reduced rate plus pruned FFT filter as by the full filter
+        if self.scheme != 'cpu':
+            return
+        from pycbc.waveform import get_fd_waveform
+        with self.context:
+            tlen = 4096 * 4
+            flen = tlen // 2 + 1
+            delta_f = 4096.0 / tlen
+            rng = numpy.random.RandomState(0)
+
+            hp, _ = get_fd_waveform(approximant='TaylorF2', mass1=10,
+                                    mass2=10, f_lower=30, delta_f=delta_f)
+            hp.resize(flen)
+            h = Array(hp.numpy() / abs(hp.numpy()).max(), dtype=complex64)
+            norm = float((abs(h.numpy()[int(30 / delta_f):]) ** 2).sum())
+
+            segs = []
+            for shift in [3000, 9001]:
+                d = TimeSeries(rng.normal(size=tlen), dtype=float32,
+                               delta_t=1.0/4096)
+                seg = make_frequency_series(d)
+                k = numpy.arange(flen)
+                seg.data[:] += 100 * h.numpy() * numpy.exp(-2j * numpy.pi * k * shift / tlen)
+                seg.analyze = slice(1024, tlen - 1024)
+                segs.append(seg)
+
+            full_mem = zeros(tlen, dtype=complex64)
+            full = MatchedFilterControl(30, None, 8, tlen, delta_f,
+                                        complex64, segs, full_mem, True,
+                                        cluster_function='findchirp')
+            red_mem = zeros(tlen, dtype=complex64)
+            red = MatchedFilterControl(30, None, 8, tlen, delta_f,
+                                       complex64, segs, red_mem, True,
+                                       cluster_function='findchirp',
+                                       downsample_factor=4,
+                                       upsample_threshold=0.5)
+            full_mem[0:flen] = h
+            red_mem[0:flen] = h
+
+            for segnum, shift in enumerate([3000, 9001]):
+                _, fnorm, _, fidx, fsnrv = \
+                    full.matched_filter_and_cluster(segnum, norm, 2048)
+                _, rnorm, _, ridx, rsnrv = \
+                    red.matched_filter_and_cluster(segnum, norm, 2048)
+                floud = abs(fsnrv).argmax()
+                rloud = abs(rsnrv).argmax()
+                self.assertEqual(fidx[floud], shift - 1024)
+                self.assertEqual(ridx[rloud], fidx[floud])
+                self.assertAlmostEqual(abs(rsnrv[rloud] * rnorm),
+                                       abs(fsnrv[floud] * fnorm), places=2)
+
+            self.assertRaises(ValueError, MatchedFilterControl, 30, None, 8,
+                              tlen, delta_f, complex64, segs, red_mem, True,
+                              cluster_function='findchirp',
+                              downsample_factor=3, upsample_threshold=0.5)
+
+    def test_matched_filter_window(self):
+        # Each method should give the same samples as the full snr series
+        from pycbc.filter.matchedfilter import matched_filter_window_core
+        with self.context:
+            snr, _, norm = matched_filter_core(self.filt, self.filt_offset,
+                                               low_frequency_cutoff=10)
+            methods = ['auto', 'fft', 'direct']
+            if self.scheme == 'cpu':
+                methods.append('pruned')
+            for method in methods:
+                for start, length in [(1000, 50), (len(snr) - 10, 20)]:
+                    wsnr, _, wnorm = matched_filter_window_core(
+                        self.filt, self.filt_offset, start, length,
+                        low_frequency_cutoff=10, method=method)
+                    expected = numpy.roll(snr.numpy(), -start)[0:length]
+                    self.assertEqual(len(wsnr), length)
+                    self.assertAlmostEqual(wnorm, norm)
+                    self.assertAlmostEqual(float(wsnr.start_time),
+                                           float(snr.start_time) +
+                                           start * snr.delta_t)
+                    self.assertTrue(numpy.allclose(wsnr.numpy(), expected,
+                                                   rtol=1e-4,
+                                                   atol=1e-5 * abs(expected).max()))
+
+            self.assertRaises(ValueError, matched_filter_window_core,
+                              self.filt, self.filt_offset, 0, 0)
+
     def test_errors(self):
         with self.context:
             #Check that an incompatible data and filter produce an error
@@ -0,0 +1,109 @@
+#
+# =============================================================================
+#
+#                                   Preamble
+#
+# =============================================================================
+#
+"""
+These are the unittests for merging single detector trigger files with
+pycbc_coinc_mergetrigs
+"""
+import os
+import sys
+import unittest
+import tempfile
+import shutil
+import subprocess
+import numpy
+import h5py
+from utils import simple_exit
+
+script = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                      'bin', 'hdfcoinc', 'pycbc_coinc_mergetrigs')
+
+
+class TestMergeTrigs(unittest.TestCase):
+    def setUp(self, *args):
+        numpy.random.seed(4321)
+        self.tmpdir = tempfile.mkdtemp()
+        self.num_templates = 60
+        self.hashes = numpy.random.permutation(10 ** 6)[:self.num_templates]
+        self.bank = os.path.join(self.tmpdir, 'bank.hdf')
+        with h5py.File(self.bank, 'w') as f:
+            f['template_hash'] = self.hashes
+
+        # Each job has a sub-bank and a stretch of time, and some jobs have
+        # no triggers
+        self.files = []
+        for i in range(8):
+            tids = numpy.arange(i % 2 * 30, i % 2 * 30 + 30)
+            num = 0 if i == 5 else numpy.random.randint(50, 200)
+            tid = numpy.random.choice(tids, size=num)
+            fname = os.path.join(self.tmpdir, 'trigs%s.hdf' % i)
+            with h5py.File(fname, 'w') as f:
+                f['H1/search/start_time'] = numpy.array([100. * i])
+                f['H1/search/end_time'] = numpy.array([100. * i + 100])
+                f['H1/template_hash'] = self.hashes[tid]
+                f['H1/end_time'] = numpy.random.uniform(100 * i,
+                                                        100 * i + 100,
+                                                        size=num)
+                f['H1/snr'] = numpy.random.uniform(4, 10, size=num
+                                                   ).astype(numpy.float32)
+            self.files.append(fname)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def old_merge(self):
+        """ Merge the files in memory, as the script used to """
+        cols = {}
+        for key in ('template_hash', 'end_time', 'snr'):
+            data = []
+            for fname in self.files:
+                with h5py.File(fname, 'r') as f:
+                    data.append(f['H1/' + key][:])
+            cols[key] = numpy.concatenate(data)
+        bank_tids = self.hashes.argsort()
+        unsort = bank_tids.argsort()
+        hashes = self.hashes[bank_tids]
+        sort = cols['template_hash'].argsort()
+        trigger_hashes = cols['template_hash'][sort]
+        starts = numpy.searchsorted(trigger_hashes, hashes)
+        ends = numpy.searchsorted(trigger_hashes, hashes, side='right')
+        return (starts[unsort], ends[unsort],
+                {key: cols[key][sort] for key in ('end_time', 'snr')})
+
+    def test_merge(self):
+        out = os.path.join(self.tmpdir, 'merged.hdf')
+        subprocess.check_call([sys.executable, script,
+                               '--trigger-files'] + self.files +
+                              ['--bank-file', self.bank,
+                               '--output-file', out,
+                               '--buffer-size', '100',
+                               '--tmp-dir', self.tmpdir])
+        starts, ends, cols = self.old_merge()
+        with h5py.File(out, 'r') as f:
+            self.assertTrue((f['H1/template_boundaries'][:] == starts).all())
+            self.assertTrue((f['H1/template_end_boundaries'][:] ==
+                             ends).all())
+            tid = f['H1/template_id'][:]
+            merged = {key: f['H1/' + key][:] for key in cols}
+            self.assertEqual(len(f['H1/search/start_time']), 8)
+
+        for num in range(self.num_templates):
+            l, r = starts[num], ends[num]
+            self.assertTrue((tid[l:r] == num).all())
+            self.assertEqual(set(zip(merged['end_time'][l:r],
+                                     merged['snr'][l:r])),
+                             set(zip(cols['end_time'][l:r],
+                                     cols['snr'][l:r])))
+        # Nothing should be left behind in the temporary directory
+        self.assertEqual(len(os.listdir(self.tmpdir)), len(self.files) + 2)
+
+suite = unittest.TestSuite()
+suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestMergeTrigs))
+
+if __name__ == '__main__':
+    results = unittest.TextTestRunner(verbosity=2).run(suite)
+    simple_exit(results)
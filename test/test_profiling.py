@@ -0,0 +1,134 @@
+#
+# =============================================================================
+#
+#                                   Preamble
+#
+# =============================================================================
+#
+"""
+These are the unittests for the phase timers in pycbc.profiling and for
+combining them with pycbc_profile_summary
+"""
+import os
+import sys
+import unittest
+import tempfile
+import shutil
+import subprocess
+import time
+import numpy
+import h5py
+from utils import simple_exit
+from pycbc.profiling import PhaseTimers, read_profile
+
+script = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                      'bin', 'pycbc_profile_summary')
+
+
+class TestPhaseTimers(unittest.TestCase):
+    def setUp(self, *args):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_disabled(self):
+        timers = PhaseTimers()
+        with timers.phase('correlate'):
+            pass
+        timers.count('triggers', 5)
+        self.assertEqual(timers.times, {})
+        self.assertEqual(timers.counters, {})
+
+    def test_phases(self):
+        timers = PhaseTimers()
+        timers.enable()
+
+        @timers.timed('chisq')
+        def chisq():
+            time.sleep(0.01)
+
+        # Nested phases are each timed, the outer one including the inner
+        for _ in range(3):
+            with timers.phase('filter'):
+                with timers.phase('correlate'):
+                    time.sleep(0.01)
+                chisq()
+        timers.count('triggers', 5)
+        timers.count('triggers')
+
+        self.assertEqual(timers.calls, {'filter': 3, 'correlate': 3,
+                                        'chisq': 3})
+        self.assertTrue(timers.times['correlate'] >= 0.03)
+        self.assertTrue(timers.times['filter'] >=
+                        timers.times['correlate'] + timers.times['chisq'])
+        self.assertEqual(timers.counters, {'triggers': 6})
+
+        # Times added to a phase are summed
+        timers.add_time('output', 1.5)
+        timers.add_time('output', 2.)
+        self.assertEqual(timers.times['output'], 3.5)
+        self.assertEqual(timers.calls['output'], 2)
+
+        fname = os.path.join(self.tmpdir, 'profile.hdf')
+        with h5py.File(fname, 'w') as f:
+            timers.write(f, 'H1/search/profile')
+        with h5py.File(fname, 'r') as f:
+            times, calls, counters = read_profile(f, 'H1/search/profile')
+        self.assertEqual(times, timers.times)
+        self.assertEqual(calls, timers.calls)
+        self.assertEqual(counters, timers.counters)
+
+        timers.reset()
+        self.assertEqual(timers.times, {})
+
+    def test_summary(self):
+        jobs = [({'correlate': 6., 'chisq': 2.}, {'triggers': 10}),
+                ({'correlate': 4., 'output': 1.}, {'triggers': 5})]
+        files = []
+        for i, (times, counters) in enumerate(jobs):
+            timers = PhaseTimers()
+            for name, seconds in times.items():
+                timers.add_time(name, seconds)
+            timers.counters.update(counters)
+            fname = os.path.join(self.tmpdir, 'job%s.hdf' % i)
+            with h5py.File(fname, 'w') as f:
+                timers.write(f, 'H1/search/profile')
+                f['H1/search/run_time'] = numpy.array([10.])
+            files.append(fname)
+
+        # A job run without the timers is skipped
+        fname = os.path.join(self.tmpdir, 'noprofile.hdf')
+        with h5py.File(fname, 'w') as f:
+            f['H1/search/run_time'] = numpy.array([10.])
+        files.append(fname)
+
+        out = os.path.join(self.tmpdir, 'summary.hdf')
+        text = subprocess.check_output([sys.executable, script,
+                                        '--trigger-files'] + files +
+                                       ['--output-file', out])
+        lines = text.decode().splitlines()
+        self.assertEqual(lines[0], 'H1: 2 jobs, 20.0 s run time')
+        # The phases are listed by decreasing total time
+        self.assertEqual([l.split()[0] for l in lines[2:5]],
+                         ['correlate', 'chisq', 'output'])
+        self.assertEqual(lines[2].split(), ['correlate', '10.0', '5.00',
+                                            '0.500', '2'])
+        self.assertEqual(lines[4].split(), ['output', '1.0', '0.50',
+                                            '0.050', '1'])
+        self.assertEqual(lines[5].split(), ['triggers', '15'])
+
+        with h5py.File(out, 'r') as f:
+            times, calls, counters = read_profile(f, 'H1')
+            self.assertEqual(f['H1'].attrs['num_jobs'], 2)
+        self.assertEqual(times, {'correlate': 10., 'chisq': 2.,
+                                 'output': 1.})
+        self.assertEqual(calls, {'correlate': 2, 'chisq': 1, 'output': 1})
+        self.assertEqual(counters, {'triggers': 15})
+
+suite = unittest.TestSuite()
+suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestPhaseTimers))
+
+if __name__ == '__main__':
+    results = unittest.TextTestRunner(verbosity=2).run(suite)
+    simple_exit(results)
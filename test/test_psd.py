@@ -125,6 +125,35 @@ class TestPSD(unittest.TestCase):
                                 msg='seg_len=%d max_len=%d -> rms=%.3f' \
                                 % (seg_len, max_len, err_rms))
 
+    def test_variation_streaming(self):
+        """Test the streaming PSD variation against the full data one"""
+        srate = 2048
+        numpy.random.seed(2468)
+        strain = TimeSeries(numpy.random.normal(size=128 * srate),
+                            delta_t=1. / srate, epoch=1000000000)
+        psd_var = pycbc.psd.calc_filt_psd_variation(strain, 8, 0.25, 128, 8,
+                                                    4, 'median', 20, 480)
+
+        var = pycbc.psd.PSDVariation(srate)
+        var.set_psd(pycbc.psd.welch(strain, seg_len=8 * srate,
+                                    seg_stride=4 * srate,
+                                    avg_method='median'))
+        for start in range(0, 128, 16):
+            var.update(strain.time_slice(strain.start_time + start,
+                                         strain.start_time + start + 16))
+
+        # The first and last short segments of the full data are not
+        # checked for outliers, so skip the values that include them
+        times = psd_var.sample_times.numpy()[1:-1]
+        expected = psd_var.numpy()[1:-1]
+        self.assertTrue(numpy.allclose(var.find_trigger_value(times),
+                                       expected, rtol=1e-4))
+        self.assertTrue(numpy.allclose(
+            pycbc.psd.find_trigger_value(psd_var, (times - 1000000000) * 16,
+                                         1000000000, 16), expected))
+        self.assertEqual(pycbc.psd.find_trigger_value(
+            psd_var, numpy.array([0]), 1000000000, 16)[0], 1.)
+
 suite = unittest.TestSuite()
 suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestPSD))
 
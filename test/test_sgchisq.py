@@ -0,0 +1,144 @@
+#
+# =============================================================================
+#
+#                                   Preamble
+#
+# =============================================================================
+#
+"""
+These are the unittests for the sine-Gaussian chisq in pycbc.vetoes.sgchisq
+"""
+import unittest
+import types
+import numpy
+from utils import simple_exit
+from pycbc.types import FrequencySeries
+from pycbc.filter import sigma
+from pycbc.waveform import sinegauss, apply_fseries_time_shift
+from pycbc.events import ranking
+from pycbc.vetoes.sgchisq import SingleDetSGChisq
+
+
+def loop_sgchisq(stilde, template, psd, snrv, snr_norm, bchisq, bchisq_dof,
+                 indices, bins, values, snr_threshold):
+    """ The sine-Gaussian chisq computed one trigger and one tile at a time,
+    as it was before the tiles were applied with a matrix product
+    """
+    values = values.split(',')
+    chisq = numpy.ones(len(snrv))
+    for i, snrvi in enumerate(snrv):
+        snr = abs(snrvi * snr_norm)
+        nsnr = ranking.newsnr(snr, bchisq[i] / bchisq_dof[i])
+        if nsnr < snr_threshold:
+            continue
+
+        N = (len(template) - 1) * 2
+        dt = 1.0 / (N * template.delta_f)
+        kmin = int(template.f_lower / psd.delta_f)
+        time = float(template.epoch) + dt * indices[i]
+        stilde_shift = apply_fseries_time_shift(stilde, -time)
+
+        qwindow = 50
+        chisq[i] = 0
+        fstep = (bins[-2] - bins[-3])
+        fpeak = (bins[-2] + fstep) * template.delta_f
+        fstop = len(stilde) * stilde.delta_f * 0.9
+
+        dof = 0
+        for descr in values:
+            q, offset = descr.split('-')
+            q, offset = float(q), float(offset)
+            fcen = fpeak + offset
+            flow = max(kmin * template.delta_f, fcen - qwindow)
+            fhigh = fcen + qwindow
+            if fhigh > fstop:
+                return numpy.ones(len(snrv))
+
+            kmin = int(flow / template.delta_f)
+            kmax = int(fhigh / template.delta_f)
+            gtem = sinegauss.fd_sine_gaussian(1.0, q, fcen, flow,
+                                  len(template) * template.delta_f,
+                                  template.delta_f).astype(numpy.complex64)
+            gsigma = sigma(gtem, psd=psd,
+                                 low_frequency_cutoff=flow,
+                                 high_frequency_cutoff=fhigh)
+            gsnr = (gtem[kmin:kmax] * stilde_shift[kmin:kmax]).sum()
+            gsnr *= 4.0 * gtem.delta_f / gsigma
+            chisq[i] += abs(gsnr)**2.0
+            dof += 2
+        chisq[i] /= dof
+    return chisq
+
+
+class TestSGChisq(unittest.TestCase):
+    def setUp(self, *args):
+        numpy.random.seed(2468)
+        delta_f = 0.25
+        flen = 4097
+        self.psd = FrequencySeries(numpy.random.uniform(1, 2, size=flen),
+                                   delta_f=delta_f)
+        self.stilde = FrequencySeries((numpy.random.normal(size=flen) +
+                                       1j * numpy.random.normal(size=flen)
+                                       ).astype(numpy.complex64),
+                                      delta_f=delta_f, epoch=1000)
+        self.template = FrequencySeries(numpy.zeros(flen,
+                                                    dtype=numpy.complex64),
+                                        delta_f=delta_f, epoch=1000)
+        self.template.f_lower = 20.
+        self.template.params = types.SimpleNamespace(template_hash=7)
+        self.bins = numpy.array([80, 200, 400, 600, 800, 1000])
+
+        num = 50
+        self.snrv = numpy.random.uniform(4, 10, size=num) * \
+            numpy.exp(2j * numpy.pi * numpy.random.uniform(size=num))
+        self.bchisq = numpy.random.uniform(10, 30, size=num)
+        self.bchisq_dof = numpy.ones(num) * 16
+        self.indices = numpy.random.randint(0, 2 * (flen - 1), size=num)
+        self.threshold = 6.
+
+    def sgchisq(self, values):
+        sgchisq = SingleDetSGChisq(None)
+        sgchisq.do = True
+        sgchisq.snr_threshold = self.threshold
+        sgchisq.params = {7: values}
+        sgchisq._tiles = {}
+        sgchisq.cached_chisq_bins = lambda template, psd: self.bins
+        return sgchisq
+
+    def compare(self, values):
+        sgchisq = self.sgchisq(values)
+        args = (self.stilde, self.template, self.psd, self.snrv, 1.0,
+                self.bchisq, self.bchisq_dof, self.indices)
+        expected = loop_sgchisq(*(args + (self.bins, values,
+                                          self.threshold)))
+        for _ in range(2):
+            chisq = sgchisq.values(*args)
+            self.assertTrue(numpy.allclose(chisq, expected, rtol=1e-4))
+        # The tiles are reused for the second call
+        self.assertEqual(len(sgchisq._tiles), 1)
+        return chisq
+
+    def test_values(self):
+        chisq = self.compare('20-0,20-40,10-80')
+        # Some triggers are tested and some are not
+        self.assertTrue((chisq == 1).any())
+        self.assertTrue((chisq != 1).any())
+
+    def test_nyquist(self):
+        chisq = self.compare('20-0,20-700')
+        self.assertTrue((chisq == 1).all())
+
+    def test_other_template(self):
+        sgchisq = self.sgchisq('20-0')
+        sgchisq.params = {}
+        chisq = sgchisq.values(self.stilde, self.template, self.psd,
+                               self.snrv, 1.0, self.bchisq, self.bchisq_dof,
+                               self.indices)
+        self.assertTrue((chisq == 1).all())
+
+suite = unittest.TestSuite()
+suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestSGChisq))
+
+if __name__ == '__main__':
+    results = unittest.TextTestRunner(verbosity=2).run(suite)
+    simple_exit(results)
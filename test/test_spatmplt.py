@@ -26,9 +26,11 @@ These are the unittests for the pycbc.waveform module
 """
 import pycbc
 import unittest
+import numpy
 from pycbc.types import zeros, complex64
 from pycbc.filter import overlap
 from pycbc.waveform import get_fd_waveform, get_waveform_filter
+from pycbc.waveform.spa_tmplt import spa_tmplt_batch
 from utils import parse_args_all_schemes, simple_exit
 
 _scheme, _context = parse_args_all_schemes("Waveform")
@@ -71,6 +73,37 @@ class TestSPAtmplt(unittest.TestCase):
 
                             print("checked m1: %s m2:: %s s1z: %s s2z: %s] overlap = %s, diff = %s" % (m1, m2, s1, s2, o, diff))
 
+    def test_spatmplt_batch(self):
+        if self.scheme != 'cpu':
+            return
+
+        fl = 25
+        delta_f = 1.0 / 256
+        mass1 = numpy.array([1, 1.4, 20, 20])
+        mass2 = numpy.array([1.4, 1.4, 1.4, 20])
+        spin1z = numpy.array([0, 0.5, -0.5, 0.9])
+        spin2z = numpy.array([0, -1, 0.2, 0.9])
+
+        for phase_order, spin_order in ((-1, -1), (4, -1), (6, 5)):
+            with self.context:
+                outs = [zeros(2 ** 16, dtype=complex64) for m in mass1]
+                hbatch = spa_tmplt_batch(mass1, mass2, spin1z, spin2z, fl,
+                                         delta_f, outs,
+                                         spin_order=spin_order,
+                                         phase_order=phase_order)
+                for i, hb in enumerate(hbatch):
+                    out = zeros(2 ** 16, dtype=complex64)
+                    hp = get_waveform_filter(out, mass1=mass1[i],
+                                             mass2=mass2[i],
+                                             spin1z=spin1z[i],
+                                             spin2z=spin2z[i],
+                                             delta_f=delta_f, f_lower=fl,
+                                             approximant="SPAtmplt",
+                                             spin_order=spin_order,
+                                             phase_order=phase_order)
+                    diff = abs(hb - hp).sum() / abs(hp).sum()
+                    self.assertTrue(diff < 1e-5)
+
 
 suite = unittest.TestSuite()
 suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestSPAtmplt))
@@ -58,6 +58,28 @@ class TestThreshold(unittest.TestCase):
             self.assertTrue((locs == self.locs).all())
             self.assertTrue((vals == self.vals).all())
             print(len(locs), len(vals))
+
+    def test_threshold_threads(self):
+        # Each thread must get back its own triggers, not a view of another
+        # thread's output buffer
+        if self.scheme != 'cpu':
+            return
+        from multiprocessing.pool import ThreadPool
+        series = [self.series, Array(self.series * 0.9, dtype=complex64)]
+        expected = [trusted_threshold(s, self.threshold) for s in series]
+
+        def run(i):
+            locs, vals = threshold(series[i % 2], self.threshold)
+            return locs.copy(), vals.copy()
+
+        with self.context:
+            pool = ThreadPool(4)
+            results = pool.map(run, range(8))
+            pool.close()
+        for i, (locs, vals) in enumerate(results):
+            self.assertTrue((locs == expected[i % 2][0]).all())
+            self.assertTrue((vals == expected[i % 2][1]).all())
+
 suite = unittest.TestSuite()
 suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestThreshold))
 
@@ -0,0 +1,173 @@
+#
+# =============================================================================
+#
+#                                   Preamble
+#
+# =============================================================================
+#
+"""
+These are the unittests for the columnar trigger store in pycbc.events
+"""
+import os
+import unittest
+import tempfile
+import shutil
+import argparse
+import weakref
+import numpy
+import h5py
+from utils import simple_exit
+from pycbc.events import EventManager, ranking
+from pycbc.events.trigger_store import TriggerStore
+
+
+class TestTriggerStore(unittest.TestCase):
+    def setUp(self, *args):
+        self.dtype = [('template_id', int), ('snr', numpy.complex64),
+                      ('time_index', numpy.uint32)]
+        self.events = numpy.zeros(5000, dtype=self.dtype)
+        self.events['template_id'] = numpy.arange(5000)[::-1] // 10
+        self.events['snr'] = numpy.random.uniform(0, 10, size=5000)
+        self.events['time_index'] = numpy.arange(5000)
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def check_store(self, store):
+        for i in range(0, 5000, 37):
+            store.append(self.events[i:i + 37])
+        self.assertEqual(len(store), 5000)
+
+        mask = abs(self.events['snr']) > 5
+        kept = store[mask]
+        self.assertEqual(len(kept), mask.sum())
+        self.assertTrue((kept['time_index'] ==
+                         self.events['time_index'][mask]).all())
+
+        store.sort(order='template_id')
+        order = numpy.argsort(self.events['template_id'], kind='stable')
+        expected = self.events[order]
+        self.assertTrue((store['template_id'] ==
+                         expected['template_id']).all())
+        self.assertTrue((store.to_array() == expected).all())
+
+    def test_memory(self):
+        self.check_store(TriggerStore(self.dtype))
+
+    def test_spill(self):
+        store = TriggerStore(self.dtype, spill_size=1000,
+                             spill_dir=self.tmpdir)
+        self.check_store(store)
+        store.close()
+
+
+class TestEventManagerCheckpoint(unittest.TestCase):
+    def setUp(self, *args):
+        self.tmpdir = tempfile.mkdtemp()
+        self.opt = argparse.Namespace(output=os.path.join(self.tmpdir,
+                                                          'out.hdf'),
+                                      trigger_spill_size=100)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def add_templates(self, mgr, num):
+        for i in range(num):
+            mgr.new_template(tmplt=i, sigmasq=float(i))
+            mgr.add_template_events(['time_index', 'snr'],
+                                    [numpy.arange(30) + i,
+                                     numpy.ones(30) * i])
+            mgr.finalize_template_events()
+
+    def test_incremental(self):
+        fname = self.opt.output + '.checkpoint'
+        mgr = EventManager(self.opt, ['time_index', 'snr'],
+                           [numpy.uint32, numpy.complex64])
+        self.add_templates(mgr, 5)
+        mgr.save_state(4, fname)
+        self.add_templates(mgr, 5)
+        mgr.save_state(9, fname)
+
+        # Consolidating replaces the triggers, which are then written again.
+        # The checkpoint does not keep the old triggers alive.
+        old = weakref.ref(mgr.events)
+        mgr.events = mgr.events[mgr.events['time_index'] % 2 == 0]
+        self.assertTrue(old() is None)
+        self.add_templates(mgr, 2)
+        mgr.save_state(11, fname)
+
+        # The file is written again, holding only the current triggers
+        with h5py.File(fname, 'r') as f:
+            self.assertEqual([k for k in f.keys() if k.startswith('events')],
+                             ['events'])
+            self.assertEqual(f['events/snr'].shape, (len(mgr.events),))
+        self.assertFalse([n for n in os.listdir(self.tmpdir)
+                          if n.startswith(os.path.basename(fname) + '.tmp')])
+
+        tnum, restored = EventManager.restore_state(fname)
+        self.assertEqual(tnum, 12)
+        self.assertEqual(len(restored.template_params), 12)
+        self.assertEqual(restored.template_params[7]['sigmasq'], 7.)
+        self.assertTrue((restored.events.to_array() ==
+                         mgr.events.to_array()).all())
+
+        # Carry on from the restored manager
+        self.add_templates(restored, 1)
+        restored.save_state(12, fname)
+        tnum, restored = EventManager.restore_state(fname)
+        self.assertEqual(tnum, 13)
+        self.assertEqual(len(restored.events), len(mgr.events) + 30)
+
+
+class TestEventManagerCuts(unittest.TestCase):
+    def setUp(self, *args):
+        opt = argparse.Namespace(output='out.hdf', chisq_bins=16)
+        self.mgr = EventManager(opt, ['time_index', 'snr', 'chisq',
+                                      'chisq_dof'],
+                                [numpy.uint32, numpy.complex64,
+                                 numpy.float32, int])
+        num = 2000
+        self.mgr.new_template(tmplt=None)
+        self.mgr.add_template_events(
+            ['time_index', 'snr', 'chisq', 'chisq_dof'],
+            [numpy.random.randint(0, 100000, size=num),
+             numpy.random.uniform(4, 20, size=num),
+             numpy.random.uniform(10, 100, size=num),
+             numpy.ones(num) * 30])
+        self.mgr.finalize_template_events()
+        self.events = self.mgr.events.to_array()
+
+    def test_fused(self):
+        window, num_keep = 1000, 3
+        self.mgr.apply_cuts([
+            self.mgr.chisq_cut(2.),
+            self.mgr.loudest_in_interval_cut(window, num_keep)])
+
+        # Compare with applying the cuts one at a time
+        e = self.events
+        e = e[e['chisq'] / e['chisq_dof'] <= 2.]
+        dof = 2. * (e['chisq_dof'] / 2 + 1) - 2.
+        statv = ranking.newsnr(abs(e['snr']), e['chisq'] / dof)
+        wtime = (e['time_index'] / window).astype(numpy.int32)
+        expected = []
+        for b in numpy.unique(wtime):
+            bloc = numpy.where(wtime == b)[0]
+            expected.append(bloc[statv[bloc].argsort()[-num_keep:]])
+        expected = e[numpy.sort(numpy.concatenate(expected))]
+
+        kept = self.mgr.events.to_array()
+        self.assertEqual(len(kept), len(expected))
+        self.assertEqual(set(kept['time_index']),
+                         set(expected['time_index']))
+
+suite = unittest.TestSuite()
+suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestTriggerStore))
+suite.addTest(unittest.TestLoader().loadTestsFromTestCase(
+    TestEventManagerCuts))
+suite.addTest(unittest.TestLoader().loadTestsFromTestCase(
+    TestEventManagerCheckpoint))
+
+if __name__ == '__main__':
+    results = unittest.TextTestRunner(verbosity=2).run(suite)
+    simple_exit(results)
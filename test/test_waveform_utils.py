@@ -4,6 +4,7 @@ import numpy
 from utils import simple_exit
 
 from pycbc.waveform.utils import apply_fd_time_shift
+from pycbc.waveform.compress import QuantizedWaveform
 from pycbc.types import (FrequencySeries, TimeSeries)
 
 
@@ -108,8 +109,37 @@ class TestFDTimeShift(unittest.TestCase):
         fseries = self.fdsinx.sample_frequencies.numpy()
         self._test_apply_fd_time_shift(fdsinx, fseries)
 
+class TestQuantizedWaveform(unittest.TestCase):
+    """Tests ``QuantizedWaveform``."""
+    def test_expand(self):
+        delta_f = 0.25
+        f = numpy.arange(4097) * delta_f
+        data = numpy.zeros(len(f), dtype=numpy.complex64)
+        band = slice(80, 3000)
+        data[band] = f[band] ** (-7./6) * numpy.exp(1j * f[band] ** (1./3))
+        htilde = FrequencySeries(data, delta_f=delta_f)
+
+        qwf = QuantizedWaveform(htilde)
+        self.assertEqual((qwf.kmin, qwf.kmax), (80, 3000))
+        self.assertTrue(qwf.nbytes < htilde.nbytes / 2)
+
+        # the expanded waveform overwrites everything outside the band
+        out = FrequencySeries(numpy.ones(len(f), dtype=numpy.complex64),
+                              delta_f=delta_f)
+        hexp = qwf.expand(out)
+        self.assertEqual(len(hexp), len(htilde))
+        self.assertEqual(hexp.delta_f, delta_f)
+        self.assertTrue(numpy.all(out.numpy()[:80] == 0))
+        self.assertTrue(numpy.all(out.numpy()[3000:] == 0))
+        overlap = numpy.vdot(data, hexp.numpy())
+        match = abs(overlap) / numpy.vdot(data, data).real
+        self.assertTrue(abs(1 - match) < 1e-5)
+        numpy.testing.assert_allclose(hexp.numpy()[band], data[band],
+                                      rtol=2e-3)
+
 suite = unittest.TestSuite()
 suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestFDTimeShift))
+suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestQuantizedWaveform))
 
 if __name__ == '__main__':
     results = unittest.TextTestRunner(verbosity=2).run(suite)